@@ -20,67 +20,75 @@ limitations under the License.
 import os
 import time
 import logging
-import threading
-from random import randrange
 from multiprocessing import Process, Queue, Manager
-from mapgen.modules.get_quicklook import get_quicklook
+from mapgen.modules.get_quicklook import get_quicklook, warm_up, start_artefact_cleanup, product_config_for_request
+from mapgen.modules.csw_summary import start_prefetch_thread
+from mapgen.modules.artefacts import artefact_usage
+from mapgen.modules import metrics
+from mapgen.modules import profiling
+from mapgen.modules import request_log
+from mapgen.modules import admission
+from mapgen.modules import deadline
+from mapgen.modules import worker_recycling
+from mapgen.modules import routing
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
+request_log.configure()
 manager = Manager()
 shared_cache = manager.dict()
+start_prefetch_thread(shared_cache)
+# Import and initialize what the config needs once. The request processes inherit it.
+warm_up(shared_cache)
+start_artefact_cleanup(shared_cache)
 
-logging_cfg = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'KeyValueFormatter': {
-            'format': (
-                '[%(asctime)s] [%(process)d] '
-                '[%(levelname)s] %(message)s'
-            )
-        },
-    },
-    'handlers': {
-        'console': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'formatter': 'KeyValueFormatter',
-        }
-    },
-    'loggers': {
-        'gunicorn.access': {
-            'propagate': True,
-        },
-        'gunicorn.error': {
-            'propagate': True,
-        },
-    },
-    'root': {
-        'level': 'DEBUG',
-        'handlers': ['console'],
-    }
-}
+logging_cfg = request_log.logging_config()
 
-def start_processing(api, netcdf_path, query_string, netloc, scheme, q, shared_cache):
+def start_processing(api, netcdf_path, query_string, netloc, scheme, q, shared_cache,
+                     request_id=None, profile=False, debug=False, deadline_at=None):
     try:
-        start = time.time()
-        response_code, response, content_type = get_quicklook(netcdf_path, query_string, netloc, scheme, shared_cache, products=None, api=api)
-        end = time.time()
-        logging.debug(f"qet_quicklook completed in: {end - start:f}seconds")
-        start = end
-        q.put((response_code, response, content_type))
-        end = time.time()
-        logging.debug(f"Put results in queue in: {end - start:f}seconds")
+        admission.release_inherited()
+        request_log.set_request_id(request_id)
+        with request_log.request_level('DEBUG' if debug else None), deadline.request_deadline(at=deadline_at):
+            start = time.time()
+            with profiling.profile(request_id if profile else None, netcdf_path, query_string):
+                response_code, response, content_type = get_quicklook(netcdf_path, query_string, netloc, scheme, shared_cache, products=None, api=api)
+            end = time.time()
+            logging.debug("qet_quicklook completed in: %fseconds", end - start)
+            metrics.observe('quicklook', end - start)
+            start = end
+            q.put((response_code, response, content_type))
+            end = time.time()
+            logging.debug("Put results in queue in: %fseconds", end - start)
+            metrics.publish(shared_cache)
+            request_log.publish(shared_cache)
     except KeyboardInterrupt:
         pass
 
+def metrics_response(shared_cache):
+    """Stage latency histograms of all server processes, their RSS and the disk usage of the generated files."""
+    metrics.record([], process_gauges())
+    usage = artefact_usage(shared_cache)
+    gauges = {'mapgen_artefact_bytes': [({'path': path}, u['bytes']) for path, u in usage.items()],
+              'mapgen_artefact_files': [({'path': path}, u['files']) for path, u in usage.items()]}
+    return metrics.render(gauges)
+
+def process_gauges():
+    """What this server process reports about itself to /metrics."""
+    return {'mapgen_worker_rss_bytes': worker_recycling.rss_bytes()}
+
 def app(environ, start_response):
-    logging.config.dictConfig(logging_cfg)
     start = time.time()
+    deadline_at = deadline.after(deadline.REQUEST_TIMEOUT)
     content_type = 'text/plain'
-    for k in environ:
-        logging.debug(f"{k}: {environ[k]}")
+    logging.debug("Environ: %s", environ)
     q = Queue()
+    request_id = profiling.request_id(environ)
+    profile_id = None
+    stages = None
+    caches = None
+    request_class = None
+    retry_after = None
+    replica = None
     if (environ['PATH_INFO'].startswith('/api/get_quicklook') or
         environ['PATH_INFO'].startswith('/klimakverna') or
         environ['PATH_INFO'].startswith('/KSS') ) and environ['REQUEST_METHOD'] == 'GET':
@@ -104,23 +112,44 @@ def app(environ, start_response):
                 logging.warning(f"Failed to detect url scheme. Using http.")
                 url_scheme = 'http'
             http_host = environ['HTTP_HOST']
-            p = Process(target=start_processing,
-                        args=(api,
-                              netcdf_path,
-                              query_string,
-                              http_host,
-                              url_scheme,
-                              q,
-                              shared_cache))
-            p.start()
-            end = time.time()
-            logging.debug(f"Started processing in {end - start:f}seconds")
-            (response_code, response, content_type) = q.get()
-            response_headers = [('Content-Type', content_type)]
-            p.join()
-            logging.debug(f"Returning successfully from query.")
-            end = time.time()
-            logging.debug(f"Complete processing in {end - start:f}seconds")
+            routed = routing.router.forward(environ, http_host, url_scheme, request_id, deadline_at)
+            if routed is not None:
+                (replica, response_code, response, content_type) = routed
+            else:
+                request_class = admission.request_class(query_string, product_config_for_request(netcdf_path, shared_cache, api))
+                with admission.controller.admit(request_class):
+                    profile_id = profiling.profile_request(environ)
+                    request_id = profile_id or request_id
+                    p = Process(target=start_processing,
+                                args=(api,
+                                      netcdf_path,
+                                      query_string,
+                                      http_host,
+                                      url_scheme,
+                                      q,
+                                      shared_cache,
+                                      request_id,
+                                      profile_id is not None,
+                                      request_log.debug_requested(environ),
+                                      deadline_at))
+                    p.start()
+                    end = time.time()
+                    logging.debug("Started processing in %fseconds", end - start)
+                    (response_code, response, content_type) = deadline.wait_for_result(q, p, deadline_at)
+                    response_headers = [('Content-Type', content_type)]
+                    p.join()
+                    stages = request_log.stage_seconds(metrics.collect(shared_cache, p.pid, process_gauges()))
+                    caches = request_log.collect(shared_cache, p.pid)
+                    logging.debug("Returning successfully from query.")
+                    end = time.time()
+                    logging.debug("Complete processing in %fseconds", end - start)
+        except deadline.DeadlineExceeded:
+            response_code = '504 Gateway Timeout'
+            response = b'Processing took too long. Stopping this process. Sorry.\n'
+        except admission.Overloaded as overloaded:
+            response_code = '503 Service Unavailable'
+            response = b'The server is busy. Please try again later.\n'
+            retry_after = overloaded.retry_after
         except KeyError as ke:
             logging.debug(f"Failed to parse the query: {str(ke)}")
             response_code = '404 Not Found'
@@ -130,6 +159,17 @@ def app(environ, start_response):
             response_code = '500 Internal Server Error'
             response = b'Internal Server Error\n'
         response_headers = [('Content-Type', content_type)]
+        if retry_after is not None:
+            response_headers.append(('Retry-After', str(retry_after)))
+        if profile_id is not None:
+            response_headers.append(('X-Mapgen-Profile-Id', profile_id))
+        if replica is not None:
+            response_headers.append((routing.REPLICA_HEADER, replica))
+    elif environ['PATH_INFO'] == '/metrics' and environ['REQUEST_METHOD'] == 'GET':
+        response_code = '200 OK'
+        response = metrics_response(shared_cache)
+        content_type = metrics.CONTENT_TYPE
+        response_headers = [('Content-Type', content_type)]
     elif environ['REQUEST_METHOD'] == 'GET':
         """Need this to local images and robots.txt"""
         image_path = environ['PATH_INFO']
@@ -189,8 +229,11 @@ def app(environ, start_response):
         logging.debug(f"{response_code}, {response}, {content_type}")
     if ('Access-Control-Allow-Origin', '*') not in response_headers:
         response_headers.append(('Access-Control-Allow-Origin', '*'))
+    response_headers.append(('X-Request-Id', request_id))
     start_response(response_code, response_headers)
-    logging.debug(f"Queue length: {q.qsize()}")
+    request_log.access(request_id, environ['REQUEST_METHOD'], environ['PATH_INFO'], environ.get('QUERY_STRING', ''),
+                       response_code, time.time() - start, len(response), stages, caches, request_class=request_class,
+                       replica=replica)
     return [response]
 
 def terminate_process(obj):
@@ -251,28 +294,40 @@ class wmsServer(BaseHTTPRequestHandler):
                         query_string = ""
                     url_scheme = os.environ.get('SCHEME', url_scheme)  # environ.get('HTTP_X_SCHEME', environ['wsgi.url_scheme'])
                     http_host = os.environ.get('HOST_NAME', http_host)  # environ['HTTP_HOST']
+                    deadline_at = deadline.after(deadline.REQUEST_TIMEOUT)
                     p = Process(target=start_processing,
-                                args=(netcdf_path,
+                                args=('api/get_quicklook',
+                                    netcdf_path,
                                     query_string,
                                     http_host,
                                     url_scheme,
-                                    q))
+                                    q,
+                                    shared_cache,
+                                    None,
+                                    False,
+                                    False,
+                                    deadline_at))
                     p.start()
                     end = time.time()
                     logging.debug(f"Started processing in {end - start:f}seconds")
-                    p.join(300)  # Timeout
-                    logging.debug(f"Processing exitcode: {p.exitcode}")
-                    if p.exitcode is None:
-                        logging.debug(f"Processing took too long. Stopping this process. Sorry.")
-                        p.terminate()
-                        response_code = '500'
-                        response = b'Processing took too long. Stopping this process. Sorry.\n'
-                    else:
-                        logging.debug(f"Returning successfully from query: {p.exitcode}")
-                        (response_code, response, content_type) = q.get()
-                        number_of_successfull_requests += 1
+                    try:
+                        (response_code, response, content_type) = deadline.wait_for_result(
+                            q, p, deadline_at, disconnected=lambda: deadline.socket_disconnected(self.connection))
+                        p.join()
+                    finally:
+                        # The process is ended here. Take what it published out of the shared cache.
+                        metrics.collect(shared_cache, p.pid, process_gauges())
+                        request_log.collect(shared_cache, p.pid)
+                    logging.debug(f"Returning successfully from query: {p.exitcode}")
+                    number_of_successfull_requests += 1
                     end = time.time()
                     logging.debug(f"Complete processing in {end - start:f}seconds")
+                except deadline.DeadlineExceeded:
+                    logging.debug(f"Processing took too long. Stopping this process. Sorry.")
+                    response_code = '504'
+                    response = b'Processing took too long. Stopping this process. Sorry.\n'
+                except deadline.ClientDisconnected:
+                    return
                 except KeyError as ke:
                     logging.debug(f"Failed to parse the query: {str(ke)}")
                     response_code = '404'
@@ -281,6 +336,10 @@ class wmsServer(BaseHTTPRequestHandler):
                     logging.debug(f"Failed to parse the query: {str(e)}")
                     response_code = '500'
                     response = b'Internal Server Error\n'
+            elif self.path.split('?')[0] == '/metrics':
+                response_code = '200'
+                response = metrics_response(shared_cache)
+                content_type = metrics.CONTENT_TYPE
             else:
                 """Need this to local images and robots.txt"""
                 image_path = self.path
@@ -319,7 +378,7 @@ class wmsServer(BaseHTTPRequestHandler):
                     content_type = 'text/plain'
             response_headers = [('Content-Type', content_type)]
             response_headers.append(('Access-Control-Allow-Origin', '*'))
-            self.send_response(int(response_code))
+            self.send_response(int(str(response_code).split()[0]))
             for response_header in response_headers:
                 self.send_header(response_header[0], response_header[1])
             self.end_headers()
@@ -345,71 +404,34 @@ class wmsServer(BaseHTTPRequestHandler):
         self.wfile.write(response)
 
 
-def request_counter(web_server, request_limit):
-    while 1:
-        try:
-            if number_of_successfull_requests > request_limit:
-                logging.info("Request limit reach, shutting down...")
-                web_server.shutdown()
-                logging.info("Shutting down complete.")
-                break
-            logging.info(f"Number of requests {number_of_successfull_requests} of {request_limit}")
-            time.sleep(1)
-        except KeyboardInterrupt:
-            break
-
-class request_limit_shutdown(threading.Thread):
-
-    """"""
-
-    def __init__(self, web_server, request_limit):
-        threading.Thread.__init__(self)
-        self.loop = True
-        self.web_server = web_server
-        self.request_limit = request_limit
-
-    def stop(self):
-        """Stops the request_limit loop"""
-        self.loop = False
-
-    def run(self):
-        try:
-            self.loop = True
-            while self.loop:
-                if number_of_successfull_requests > self.request_limit:
-                    logging.info("Request limit reach, shutting down...")
-                    self.web_server.shutdown()
-                    logging.info("Shutting down complete.")
-                    self.loop = False
-                logging.info(f"Number of requests {number_of_successfull_requests} of {self.request_limit}")
-                time.sleep(1)
-        except KeyboardInterrupt:
-            logging.info("Shutdown request_limit")
-
 class CustomHTTPServer(HTTPServer):
     request_queue_size = 1
 
+def serve(web_server, ready, recycle, drain):
+    """Serve requests in a worker process until it is drained."""
+    global number_of_successfull_requests
+    number_of_successfull_requests = 0
+    monitor = worker_recycling.WorkerMonitor(web_server, worker_recycling.MemoryWatch.from_environ(),
+                                             lambda: number_of_successfull_requests, recycle, drain)
+    monitor.start()
+    ready.set()
+    try:
+        web_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    web_server.server_close()
+
 if __name__ == "__main__":        
-    logging.config.dictConfig(logging_cfg)
     hostName = "0.0.0.0"
     serverPort = 8040
     webServer = CustomHTTPServer((hostName, serverPort), wmsServer)
     webServer.timeout = 600
-    number_of_successfull_requests = 0
+    # The workers share the socket. A worker not getting the connection must not block in accept.
+    webServer.socket.setblocking(False)
 
     logging.info(f"request queue size: {webServer.request_queue_size}")
     logging.info(f"Server started http://{hostName}:{serverPort}")
 
-    request_limit = randrange(50,100)
-    logging.debug(f"This server request_limit: {request_limit}")
-    request_counter_thread = request_limit_shutdown(webServer, request_limit)
-    request_counter_thread.start()
-    try:
-        webServer.serve_forever()
-    except KeyboardInterrupt:
-        request_counter_thread.stop()
-        pass
-
-    request_counter_thread.join()
+    worker_recycling.Supervisor.from_environ(serve, (webServer,)).run()
     webServer.server_close()
     print("Server stopped.")
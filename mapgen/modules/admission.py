@@ -0,0 +1,191 @@
+"""
+admission : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Admission control of the request processes.
+
+Requests are put in classes, each with a number of slots, the number of
+requests of the class processed at the same time, and a bounded queue
+of requests waiting for a slot:
+
+    cheap: GetLegendGraphic and GetFeatureInfo.
+    capabilities: GetCapabilities.
+    getmap: GetMap and other requests.
+    satpy: all requests handled by the satpy module, which may generate
+        the geotiffs.
+
+A config entry can put its requests in a class with admission_class.
+Cheap requests have slots of their own, so they are answered also when
+the renders fill the other classes.
+
+A request waits in the queue for at most the queue timeout of the class.
+When the queue is full or the timeout is reached, the request is
+rejected with 503 and Retry-After, instead of starting yet another
+process.
+
+Slots and queue places are lock files in ADMISSION_DIR held with flock,
+so they are shared by all server processes and threads on the host and
+are freed if a server process dies. Configured with environment
+variables, a number for all classes or per class like getmap=8,satpy=1:
+
+    ADMISSION_DIR: default /tmp/mapgen-admission.
+    ADMISSION_SLOTS: default cheap, getmap number of cpus, capabilities half of that, satpy 1.
+    ADMISSION_QUEUE: places in the queue, default twice the slots.
+    ADMISSION_QUEUE_TIMEOUT: seconds, default 10, cheap 2.
+    ADMISSION_RETRY_AFTER: seconds in the Retry-After header, default 5.
+"""
+
+import os
+import time
+import fcntl
+import logging
+from contextlib import contextmanager
+
+from mapgen.modules import metrics
+
+logger = logging.getLogger(__name__)
+
+CLASSES = ('cheap', 'capabilities', 'getmap', 'satpy')
+CHEAP_REQUESTS = ('getlegendgraphic', 'getfeatureinfo')
+SATPY_MODULE = 'mapgen.modules.satellite_satpy_quicklook'
+POLL_INTERVAL = 0.05
+
+# Lock files held by this process, closed in the request processes forked from it.
+_held = set()
+
+
+class Overloaded(Exception):
+    """No slot for the request within the queue timeout, or the queue is full."""
+
+    def __init__(self, request_class, reason, retry_after):
+        super().__init__(f"{request_class}: {reason}")
+        self.request_class = request_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def request_class(query_string, product_config=None):
+    """The class of a request."""
+    product_config = product_config or {}
+    if product_config.get('admission_class') in CLASSES:
+        return product_config['admission_class']
+    request = metrics.request_type(query_string)
+    if request in CHEAP_REQUESTS:
+        return 'cheap'
+    if product_config.get('module') == SATPY_MODULE:
+        return 'satpy'
+    if request == 'getcapabilities':
+        return 'capabilities'
+    return 'getmap'
+
+
+def _per_class(value, defaults, convert=int):
+    """Parse a number for all classes, or class=number,... on top of defaults."""
+    settings = dict(defaults)
+    if not value:
+        return settings
+    for item in str(value).split(','):
+        name, _, number = item.rpartition('=')
+        if name:
+            settings[name.strip()] = convert(number)
+        else:
+            settings = {request_class: convert(number) for request_class in settings}
+    return settings
+
+
+def release_inherited():
+    """Close the lock files inherited from the server process. Call first in a forked request process.
+
+    The locks stay held by the server process until it is done with the request.
+    """
+    for fd in list(_held):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    _held.clear()
+
+
+class AdmissionController:
+
+    def __init__(self, directory, slots, queue, queue_timeout, retry_after=5, poll_interval=POLL_INTERVAL):
+        self.directory = directory
+        self.slots = slots
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        cpus = os.cpu_count() or 1
+        slots = _per_class(environ.get('ADMISSION_SLOTS'),
+                           {'cheap': cpus, 'capabilities': max(cpus // 2, 1), 'getmap': cpus, 'satpy': 1})
+        queue = _per_class(environ.get('ADMISSION_QUEUE'), {k: 2 * v for k, v in slots.items()})
+        queue_timeout = _per_class(environ.get('ADMISSION_QUEUE_TIMEOUT'),
+                                   {'cheap': 2., 'capabilities': 10., 'getmap': 10., 'satpy': 10.}, float)
+        return cls(environ.get('ADMISSION_DIR', '/tmp/mapgen-admission'), slots, queue, queue_timeout,
+                   int(environ.get('ADMISSION_RETRY_AFTER', 5)))
+
+    def _acquire(self, request_class, kind, count):
+        """Lock a free one of the count lock files, or return None."""
+        for i in range(count):
+            fd = os.open(os.path.join(self.directory, f'{request_class}-{kind}-{i}.lock'), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            _held.add(fd)
+            return fd
+        return None
+
+    def _release(self, fd):
+        _held.discard(fd)
+        os.close(fd)
+
+    def _reject(self, request_class, reason):
+        logger.warning(f"Rejected {request_class} request: {reason}")
+        return Overloaded(request_class, reason, self.retry_after)
+
+    @contextmanager
+    def admit(self, request_class):
+        """Hold a slot of request_class in the block. Raises Overloaded."""
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.monotonic()
+        slot = self._acquire(request_class, 'slot', self.slots.get(request_class, 1))
+        if slot is None:
+            ticket = self._acquire(request_class, 'queue', self.queue.get(request_class, 0))
+            if ticket is None:
+                raise self._reject(request_class, "queue is full")
+            try:
+                deadline = start + self.queue_timeout.get(request_class, 0)
+                while slot is None:
+                    if time.monotonic() >= deadline:
+                        raise self._reject(request_class, "no slot within the queue timeout")
+                    time.sleep(self.poll_interval)
+                    slot = self._acquire(request_class, 'slot', self.slots.get(request_class, 1))
+            finally:
+                self._release(ticket)
+        metrics.observe('admission_wait', time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self._release(slot)
+
+
+controller = AdmissionController.from_environ()
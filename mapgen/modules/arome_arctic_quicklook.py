@@ -40,7 +40,11 @@ import logging
 import datetime
 import mapscript
 import xarray as xr
-from mapgen.modules.create_symbol_file import create_symbol_file
+from mapgen.modules.artefacts import touch_artefact
+from mapgen.modules.create_symbol_file import attach_symbol_set
+from mapgen.modules.metrics import stage
+from mapgen.modules import artefact_store
+from mapgen.modules.mapfile_store import mapfile_key, mapfile_path, load_mapfile, save_mapfile
 from mapgen.modules.helpers import handle_request, _parse_filename, _get_mapfiles_path, _fill_metadata_to_mapfile
 from mapgen.modules.helpers import _generate_getcapabilities, _generate_getcapabilities_vector, _generate_layer
 from mapgen.modules.helpers import _parse_request, HTTPError
@@ -69,7 +73,8 @@ def arome_arctic_quicklook(netcdf_path: str,
         logger.error(f"status_code=404, Could not find {orig_netcdf_path} in server configured directory.")
         raise HTTPError(response_code='404 Not Found', response=f"Could not find {orig_netcdf_path} in server configured directory.")
 
-    ds_disk = xr.open_dataset(netcdf_path)
+    with stage('open_dataset'):
+        ds_disk = xr.open_dataset(netcdf_path)
 
     #get forecast reference time from dataset
     try:
@@ -79,49 +84,53 @@ def arome_arctic_quicklook(netcdf_path: str,
         # Parse the netcdf filename to get start time or reference time
         _, _forecast_time = _parse_filename(netcdf_path, product_config)
         forecast_time = datetime.datetime.strptime(_forecast_time, "%Y%m%dT%H")
-        logger.debug(f"Forecast time: {forecast_time}")
+        logger.debug("Forecast time: %s", forecast_time)
 
     symbol_file = os.path.join(_get_mapfiles_path(product_config), "symbol.sym")
-    create_symbol_file(symbol_file)
     qp = _parse_request(query_string)
 
     map_object = None
     actual_variable = None
     if 'request' in qp and qp['request'] != 'GetCapabilities':
-        mapserver_map_file = os.path.join(_get_mapfiles_path(product_config), f'{os.path.basename(orig_netcdf_path)}.map')
+        mapserver_map_file = mapfile_path(_get_mapfiles_path(product_config),
+                                          f'{os.path.basename(orig_netcdf_path)}-{qp.get("layers", qp.get("layer"))}',
+                                          mapfile_key(netcdf_path, product_config, qp, http_host, url_scheme, api))
         map_object = mapscript.mapObj()
-        _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "WMS Arome Arctic.", api)
-        map_object.setSymbolSet(symbol_file)
+        _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "WMS Arome Arctic.", api, product_config)
+        attach_symbol_set(map_object, symbol_file)
         layer = mapscript.layerObj()
         actual_variable = _generate_layer(layer, ds_disk, shared_cache, netcdf_path, qp, map_object, product_config, shared_cache)
         if actual_variable:
             layer_no = map_object.insertLayer(layer)
     else:
         # Assume getcapabilities
-        mapserver_map_file = os.path.join(_get_mapfiles_path(product_config), f'{os.path.basename(orig_netcdf_path)}-getcapabilities.map')
-        if os.path.exists(mapserver_map_file):
-            logger.debug(f"Reuse existing getcapabilities map file {mapserver_map_file}")
-            map_object = mapscript.mapObj(mapserver_map_file)
+        mapserver_map_file = mapfile_path(_get_mapfiles_path(product_config),
+                                          f'{os.path.basename(orig_netcdf_path)}-getcapabilities',
+                                          mapfile_key(netcdf_path, product_config, None, http_host, url_scheme, api))
+        map_object = load_mapfile(mapserver_map_file, artefact_store.store_for(product_config))
+        if map_object:
+            logger.debug("Reuse existing getcapabilities map file %s", mapserver_map_file)
+            touch_artefact(mapserver_map_file)
         else:
             map_object = mapscript.mapObj()
-            _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "WMS Arome Arctic", api)
-            map_object.setSymbolSet(symbol_file)
+            _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "WMS Arome Arctic", api, product_config)
+            attach_symbol_set(map_object, symbol_file)
             # Read all variables names from the netcdf file.
             variables = list(ds_disk.keys())
             for variable in variables:
                 if variable in ['forecast_reference_time', 'p0', 'ap', 'b', 'projection_lambert']:
-                    logger.debug(f"Skipping variable or dimension: {variable}")
+                    logger.debug("Skipping variable or dimension: %s", variable)
                     continue
                 layer = mapscript.layerObj()
                 if _generate_getcapabilities(layer, ds_disk, variable, shared_cache, netcdf_path, product_config=product_config):
                     layer_no = map_object.insertLayer(layer)
                 if variable.startswith('x_wind') and variable.replace('x', 'y') in variables:
-                    logger.debug(f"Add wind vector layer for {variable}.")
+                    logger.debug("Add wind vector layer for %s.", variable)
                     layer_contour = mapscript.layerObj()
                     if _generate_getcapabilities_vector(layer_contour, ds_disk, variable, shared_cache, netcdf_path, product_config=product_config):
                         layer_no = map_object.insertLayer(layer_contour)
 
-    map_object.save(mapserver_map_file)
+    save_mapfile(map_object, mapserver_map_file, artefact_store.store_for(product_config))
 
     ds_disk.close()
     # Handle the request and return results.
@@ -0,0 +1,261 @@
+"""
+artefact store : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Derived artefacts shared by all replicas.
+
+The expensive artefacts are published to a store shared by the
+replicas, so a replica that has not made an artefact itself, like a new
+or restarted pod, can fetch it instead of computing it again:
+
+    resample-lut/: the resample lookup tables, with resample_cache_dir.
+    north/: the north direction grids of the vector layers.
+    mapfile/: map files, with the files in mapfiles_path they use, like
+        resampled GeoTIFFs and GetFeatureInfo templates. Map files using
+        netcdf or vrt files generated for the request are not published.
+    csw-summary/: the dataset summaries, with csw_summary_cache_dir.
+
+All are named by a hash of their inputs, so an artefact never changes
+once published and there is nothing to invalidate.
+
+The store is given by artefact_store in the config entry, or else the
+ARTEFACT_STORE environment variable:
+
+    s3://bucket/prefix: the S3/CEPH object store at S3_ENDPOINT_URL, with
+        S3_ACCESS_KEY and S3_SECRET_KEY.
+    file:///path or /path: a directory, on a filesystem shared by the
+        replicas, or local.
+
+Failing to use the store is logged and otherwise ignored. The artefact
+is then computed as without a store.
+"""
+
+import os
+import re
+import shutil
+import logging
+
+from mapgen.modules.artefacts import atomic_path
+
+logger = logging.getLogger(__name__)
+
+# Files in mapfiles_path generated for a single request
+REQUEST_ARTEFACT_PREFIXES = ('netcdf-', 'vrt-')
+
+_stores = {}
+
+
+def _write_atomically(path, write):
+    """Write the file with write(f) to a temporary file and rename."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with atomic_path(path, prefix='.store-') as tmp_file, open(tmp_file, 'wb') as f:
+        write(f)
+
+
+class FileStore:
+    """Artefacts in a directory, on a filesystem shared by the replicas or local."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __repr__(self):
+        return f'FileStore({self.directory!r})'
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split('/'))
+
+    def get(self, key):
+        """The content of the artefact, or None if it is not in the store."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        _write_atomically(self._path(key), lambda f: f.write(data))
+
+    def fetch(self, key, path):
+        """Copy the artefact to path. False if it is not in the store."""
+        try:
+            with open(self._path(key), 'rb') as src:
+                _write_atomically(path, lambda f: shutil.copyfileobj(src, f))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def publish(self, key, path):
+        """Copy the file at path to the store."""
+        if os.path.exists(self._path(key)):
+            return
+        with open(path, 'rb') as src:
+            _write_atomically(self._path(key), lambda f: shutil.copyfileobj(src, f))
+
+
+class S3Store:
+    """Artefacts in a bucket of the S3/CEPH object store."""
+
+    def __init__(self, bucket, prefix=''):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self._client = None
+
+    def __repr__(self):
+        return f'S3Store({self.bucket!r}, {self.prefix!r})'
+
+    def __getstate__(self):
+        # Passed to other processes without the client
+        return dict(self.__dict__, _client=None)
+
+    def _key(self, key):
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def client(self):
+        """A client per process, as clients can not be shared with forked processes."""
+        if self._client is None or self._client[0] != os.getpid():
+            import boto3
+            self._client = (os.getpid(), boto3.client(service_name='s3',
+                                                      endpoint_url=os.environ['S3_ENDPOINT_URL'],
+                                                      aws_access_key_id=os.environ['S3_ACCESS_KEY'],
+                                                      aws_secret_access_key=os.environ['S3_SECRET_KEY']))
+        return self._client[1]
+
+    @staticmethod
+    def _not_found(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def get(self, key):
+        import botocore.exceptions
+        try:
+            return self.client().get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+        except botocore.exceptions.ClientError as e:
+            if self._not_found(e):
+                return None
+            raise
+
+    def put(self, key, data):
+        self.client().put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def fetch(self, key, path):
+        import botocore.exceptions
+        try:
+            _write_atomically(path, lambda f: self.client().download_fileobj(self.bucket, self._key(key), f))
+        except botocore.exceptions.ClientError as e:
+            if self._not_found(e):
+                return False
+            raise
+        return True
+
+    def publish(self, key, path):
+        self.client().upload_file(path, self.bucket, self._key(key))
+
+
+def store_for(product_config):
+    """The artefact store of the config entry, or None without one."""
+    url = (product_config or {}).get('artefact_store', os.environ.get('ARTEFACT_STORE'))
+    if not url:
+        return None
+    if url not in _stores:
+        if url.startswith('s3://'):
+            bucket, _, prefix = url[len('s3://'):].partition('/')
+            _stores[url] = S3Store(bucket, prefix)
+        else:
+            _stores[url] = FileStore(url[len('file://'):] if url.startswith('file://') else url)
+    return _stores[url]
+
+
+def get(store, key):
+    """The content of the artefact, or None if not in the store or the store fails."""
+    try:
+        return store.get(key)
+    except Exception as e:
+        logger.warning(f"Failed to get {key} from {store}: {str(e)}")
+        return None
+
+
+def put(store, key, data):
+    try:
+        store.put(key, data)
+    except Exception as e:
+        logger.warning(f"Failed to put {key} in {store}: {str(e)}")
+
+
+def fetch(store, key, path):
+    """Fetch the artefact to path. False if not in the store or the store fails."""
+    try:
+        return store.fetch(key, path)
+    except Exception as e:
+        logger.warning(f"Failed to fetch {key} from {store}: {str(e)}")
+        return False
+
+
+def publish(store, key, path):
+    try:
+        store.publish(key, path)
+    except Exception as e:
+        logger.warning(f"Failed to publish {key} to {store}: {str(e)}")
+
+
+def _dependencies(content, directory):
+    """Names of the files in directory the map file content uses, or None if it uses request artefacts."""
+    prefix = os.path.join(directory, '')
+    names = set(re.findall(r'(?<![\w./-])' + re.escape(prefix) + r'([^"\'\s:/]+)', content))
+    if any(name.startswith(REQUEST_ARTEFACT_PREFIXES) for name in names):
+        return None
+    return sorted(names)
+
+
+def publish_mapfile(store, path):
+    """Publish the map file and the files it uses in its directory."""
+    directory, name = os.path.split(path)
+    try:
+        with open(path, errors='replace') as f:
+            dependencies = _dependencies(f.read(), directory)
+    except OSError as e:
+        logger.warning(f"Failed to read map file {path}: {str(e)}")
+        return
+    if dependencies is None:
+        logger.debug(f"Map file {path} uses files generated for the request. Not published.")
+        return
+    # Not every name in the map file is a file, like the template in the capabilities
+    files = [dependency for dependency in dependencies if os.path.isfile(os.path.join(directory, dependency))]
+    # The files used and their list first, so a published map file has them
+    for dependency in files:
+        publish(store, f'mapfile/{name}.d/{dependency}', os.path.join(directory, dependency))
+    put(store, f'mapfile/{name}.files', '\n'.join(files).encode())
+    publish(store, f'mapfile/{name}', path)
+
+
+def fetch_mapfile(store, path):
+    """Fetch the map file and the files it uses missing in its directory. False if not in the store."""
+    directory, name = os.path.split(path)
+    content = get(store, f'mapfile/{name}')
+    files = get(store, f'mapfile/{name}.files') if content is not None else None
+    if files is None:
+        return False
+    for dependency in files.decode().split():
+        dependency_path = os.path.join(directory, dependency)
+        if not os.path.exists(dependency_path) and not fetch(store, f'mapfile/{name}.d/{dependency}',
+                                                             dependency_path):
+            logger.warning(f"Map file {name} in {store} misses {dependency}")
+            return False
+    try:
+        _write_atomically(path, lambda f: f.write(content))
+    except OSError as e:
+        logger.warning(f"Failed to write map file {path}: {str(e)}")
+        return False
+    return True
@@ -0,0 +1,294 @@
+"""
+artefacts : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Lifecycle of the files generated in mapfiles_path.
+
+Requests generate netcdf-* and vrt-* directories, resample-output_*.tif
+files, getfeature-info-*.html templates and map files. The artefacts
+are named by kind, and the last use of an artefact is its modification
+time, updated when a map file is reused. Only the map files named by
+mapfile_store.mapfile_path, <prefix>-<32 hex digits>.map, and the satpy
+satpy-products-<start time>.map files are generated, so other map files
+in mapfiles_path, like map file templates, are left alone.
+
+A map file refers to the other artefacts it uses, directly or through
+the VRT files in vrt-* directories, which refer to the netcdf-* files
+they read. These are kept as long as an artefact referring to them is
+kept, and if one of them is removed, the map files and VRT files
+referring to it are removed as well. The cleanup removes
+artefacts not used for artefact_max_age seconds, and then the least
+recently used ones until the total size is below artefact_max_bytes.
+Nothing used within artefact_min_age seconds is removed, so files of
+requests in progress are left alone.
+
+The resample-lut-*.npz lookup tables in resample_cache_dir are cleaned
+up the same way, with the same policy. A table is used when it is read.
+
+The cleanup runs in a thread of the server process and stores the disk
+usage of each directory in the shared cache.
+
+Generated files are written with atomic_path, so a reader, or another
+process writing the same file, never sees a partial file.
+"""
+
+import os
+import glob
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# The glob patterns of each kind of artefact
+ARTEFACT_KINDS = {'netcdf': ('netcdf-*',),
+                  'vrt': ('vrt-*',),
+                  'resample': ('resample-output_*.tif',),
+                  'getfeatureinfo': ('getfeature-info-*.html',),
+                  'mapfile': ('*-' + '[0-9a-f]' * 32 + '.map', 'satpy-products-' + '[0-9]' * 14 + '.map')}
+RESAMPLE_CACHE_KINDS = {'resample_lut': ('resample-lut-*.npz',)}
+ARTEFACT_MAX_AGE = 86400
+ARTEFACT_MIN_AGE = 600
+CLEANUP_INTERVAL = 600
+USAGE_KEY = 'artefact-usage'
+
+
+def _mapfiles_path(product_config):
+    return (product_config or {}).get('mapfiles_path', "./")
+
+
+def new_artefact_dir(product_config, kind):
+    """Create a new directory for an artefact of kind in mapfiles_path."""
+    if ARTEFACT_KINDS.get(kind) != (f'{kind}-*',):
+        raise ValueError(f"Not a directory artefact kind: {kind}")
+    return tempfile.mkdtemp(prefix=f'{kind}-', dir=_mapfiles_path(product_config))
+
+
+def touch_artefact(path):
+    """Mark the artefact as used now."""
+    try:
+        os.utime(path)
+    except OSError as e:
+        logger.debug(f"Failed to touch artefact {path}: {str(e)}")
+
+
+@contextmanager
+def atomic_path(path, prefix='.tmp-', suffix='.tmp'):
+    """A temporary file next to path, renamed to path when the block succeeds.
+
+    The temporary file is removed if the block or the rename fails.
+    """
+    fd, tmp_file = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=os.path.dirname(path) or '.')
+    os.close(fd)
+    try:
+        yield tmp_file
+        os.replace(tmp_file, path)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class Artefact:
+    """An artefact found in mapfiles_path."""
+
+    def __init__(self, path, kind, size, last_used):
+        self.path = path
+        self.kind = kind
+        self.size = size
+        self.last_used = last_used
+        self.referred_by = []
+
+
+def _content(artefact):
+    """Text of a map file, or of the VRT files in a vrt directory, where references to other artefacts are."""
+    if artefact.kind == 'mapfile':
+        paths = [artefact.path]
+    elif artefact.kind == 'vrt':
+        paths = glob.glob(os.path.join(artefact.path, '*.vrt'))
+    else:
+        return ''
+    content = []
+    for path in paths:
+        try:
+            with open(path, errors='replace') as f:
+                content.append(f.read())
+        except OSError:
+            pass
+    return '\n'.join(content)
+
+
+def scan_artefacts(directory, kinds=ARTEFACT_KINDS):
+    """All artefacts of kinds in directory, with the artefacts referring to each of them.
+
+    The references are followed, so a netcdf file read by a VRT file of a
+    map file is referred to by both. The map files are first in referred_by.
+    """
+    artefacts = {}
+    for kind, patterns in kinds.items():
+        for pattern in patterns:
+            for path in glob.glob(os.path.join(directory, pattern)):
+                try:
+                    artefacts[path] = Artefact(path, kind, _size(path), os.stat(path).st_mtime)
+                except OSError:
+                    # Removed while scanning
+                    pass
+    dependencies = {os.path.basename(a.path): a for a in artefacts.values() if a.kind != 'mapfile'}
+    references = {}
+    for artefact in artefacts.values():
+        content = _content(artefact)
+        references[artefact.path] = [dependency for name, dependency in dependencies.items()
+                                     if dependency is not artefact and name in content]
+    for referrer in sorted(artefacts.values(), key=lambda a: a.kind != 'mapfile'):
+        found = set()
+        to_follow = list(references[referrer.path])
+        while to_follow:
+            dependency = to_follow.pop()
+            if dependency.path in found:
+                continue
+            found.add(dependency.path)
+            dependency.referred_by.append(referrer)
+            dependency.last_used = max(dependency.last_used, referrer.last_used)
+            to_follow.extend(references[dependency.path])
+    return list(artefacts.values())
+
+
+def _remove(artefact):
+    try:
+        if os.path.isdir(artefact.path):
+            shutil.rmtree(artefact.path)
+        else:
+            os.remove(artefact.path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove artefact {artefact.path}: {str(e)}")
+        return False
+    return True
+
+
+def collect_garbage(directory, max_age=ARTEFACT_MAX_AGE, max_bytes=None, min_age=ARTEFACT_MIN_AGE, now=None,
+                    kinds=ARTEFACT_KINDS):
+    """Remove expired artefacts and the least recently used ones above max_bytes.
+
+    Returns the usage after the cleanup as a dict with files, bytes and removed.
+    """
+    now = now or time.time()
+    artefacts = sorted(scan_artefacts(directory, kinds), key=lambda a: a.last_used)
+    total = sum(a.size for a in artefacts)
+    removed = set()
+
+    def remove(artefact):
+        nonlocal total
+        # Referring artefacts first, map files first, so nothing refers to a removed artefact
+        for referrer in artefact.referred_by + [artefact]:
+            if referrer.path not in removed and _remove(referrer):
+                removed.add(referrer.path)
+                total -= referrer.size
+
+    for artefact in artefacts:
+        if artefact.path in removed or artefact.last_used > now - min_age:
+            continue
+        if artefact.last_used < now - max_age or (max_bytes is not None and total > max_bytes):
+            remove(artefact)
+    if max_bytes is not None and total > max_bytes:
+        logger.warning(f"Artefacts in {directory} use {total} bytes, above artefact_max_bytes {max_bytes}. "
+                       f"All remaining artefacts are used within the last {min_age} seconds.")
+    usage = {'files': len(artefacts) - len(removed), 'bytes': total, 'removed': len(removed), 'updated': now}
+    logger.debug(f"Artefacts in {directory}: {usage}")
+    return usage
+
+
+def _policies(product_configs):
+    """Cleanup policy of each mapfiles_path and resample_cache_dir.
+
+    The first config using a directory sets the policy. A directory used
+    as both gets the artefact kinds of both.
+    """
+    policies = {}
+    for product_config in product_configs:
+        if not isinstance(product_config, dict):
+            continue
+        max_bytes = product_config.get('artefact_max_bytes')
+        policy = {'max_age': float(product_config.get('artefact_max_age', ARTEFACT_MAX_AGE)),
+                  'max_bytes': int(max_bytes) if max_bytes is not None else None,
+                  'min_age': float(product_config.get('artefact_min_age', ARTEFACT_MIN_AGE))}
+        directories = [(_mapfiles_path(product_config), ARTEFACT_KINDS)]
+        if product_config.get('resample_cache_dir'):
+            directories.append((product_config['resample_cache_dir'], RESAMPLE_CACHE_KINDS))
+        for directory, kinds in directories:
+            directory = os.path.abspath(directory)
+            if directory not in policies:
+                policies[directory] = dict(policy, kinds={})
+            policies[directory]['kinds'] = {**policies[directory]['kinds'], **kinds}
+    return policies
+
+
+def cleanup(product_configs, shared_cache=None):
+    """Run the cleanup of all mapfiles_path and resample_cache_dir in product_configs once."""
+    usage = {}
+    for directory, policy in _policies(product_configs).items():
+        try:
+            usage[directory] = collect_garbage(directory, **policy)
+        except Exception as e:
+            logger.warning(f"Artefact cleanup of {directory} failed: {str(e)}")
+    if shared_cache is not None:
+        shared_cache[USAGE_KEY] = usage
+    return usage
+
+
+def artefact_usage(shared_cache):
+    """Disk usage of each cleaned up directory from the last cleanup."""
+    return dict(shared_cache.get(USAGE_KEY, {}))
+
+
+def _cleanup_loop(read_product_configs, shared_cache, interval):
+    while True:
+        try:
+            cleanup(read_product_configs(), shared_cache)
+        except Exception as e:
+            logger.warning(f"Artefact cleanup failed: {str(e)}")
+        time.sleep(interval)
+
+
+def start_cleanup_thread(read_product_configs, shared_cache, interval=CLEANUP_INTERVAL):
+    """Clean up artefacts every interval seconds in a thread of this process.
+
+    read_product_configs returns the product configs, so config changes are picked up.
+    """
+    thread = threading.Thread(target=_cleanup_loop, args=(read_product_configs, shared_cache, interval),
+                              daemon=True, name='artefact-cleanup')
+    thread.start()
+    return thread
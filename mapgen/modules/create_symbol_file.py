@@ -1,9 +1,22 @@
 import os
+import logging
 import mapscript
 
-def create_symbol_file(symbol_file):
-    created = False
-    if not os.path.exists(symbol_file):
+from mapgen.modules.artefacts import atomic_path
+
+logger = logging.getLogger(__name__)
+
+# Symbol set built in this process. Built in the server process before
+# forking requests, it is inherited by the request processes.
+_symbol_set = None
+# Symbol files known to exist
+_symbol_files = set()
+
+def symbol_set():
+    """The symbol set, built once per process."""
+    global _symbol_set
+    if _symbol_set is None:
+        logger.debug("Build symbol set")
         symbol_obj = mapscript.symbolSetObj()
         symbol = mapscript.symbolObj("horizline")
         symbol.name = "horizline"
@@ -499,6 +512,34 @@ def create_symbol_file(symbol_file):
 
 
 
-        symbol_obj.save(symbol_file)
+        _symbol_set = symbol_obj
+    return _symbol_set
+
+def create_symbol_file(symbol_file):
+    """Write the symbol set to symbol_file if it does not exist.
+
+    Written to a temporary file and renamed, so processes writing at the
+    same time do not leave a partial file.
+    """
+    created = False
+    if not os.path.exists(symbol_file):
+        with atomic_path(symbol_file, prefix='.symbol-', suffix='.sym') as tmp_file:
+            symbol_set().save(tmp_file)
         created = True
-    return created
\ No newline at end of file
+    return created
+
+def attach_symbol_set(map_object, symbol_file):
+    """Add the symbols to the map from memory instead of parsing the symbol file.
+
+    The map refers to symbol_file as its symbol set, so a saved map file
+    finds the symbols when it is loaded again.
+    """
+    if symbol_file not in _symbol_files:
+        create_symbol_file(symbol_file)
+        _symbol_files.add(symbol_file)
+    symbols = symbol_set()
+    map_object.symbolset.filename = symbol_file
+    for i in range(symbols.numsymbols):
+        symbol = symbols.getSymbol(i)
+        if symbol.name and map_object.symbolset.index(symbol.name) == -1:
+            map_object.symbolset.appendSymbol(symbol)
@@ -0,0 +1,188 @@
+"""
+csw summary : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Dataset summaries from the CSW, without waiting for the CSW on the
+request path.
+
+Summaries are kept in the shared cache and, if csw_summary_cache_dir is
+configured, in a summary store on disk which survives restarts, and
+with an artefact store, there for the other replicas. All expire after
+a ttl. Missing summaries are cached as well, with a shorter
+ttl, so a dataset without a CSW record is not searched for on every
+request.
+
+When the server has started the prefetch thread, a request with an
+unknown summary gets "Not Available." at once and the summary is fetched
+in the server process. Later requests get the summary. Without the
+prefetch thread the summary is fetched in the request with a short
+timeout.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from multiprocessing import Queue
+
+import requests
+
+from mapgen.modules import artefact_store
+from mapgen.modules.artefacts import atomic_path
+from mapgen.modules.request_log import cache_outcome
+
+logger = logging.getLogger(__name__)
+
+NOT_AVAILABLE = "Not Available."
+CSW_TIMEOUT = 2
+SUMMARY_TTL = 86400
+NEGATIVE_SUMMARY_TTL = 600
+
+# Set in the server process by start_prefetch_thread and inherited by the request processes.
+_prefetch_queue = None
+_session = None
+
+
+def csw_session():
+    """A requests session per process, so connections to the CSW are reused."""
+    global _session
+    if _session is None or _session[0] != os.getpid():
+        _session = (os.getpid(), requests.Session())
+    return _session[1]
+
+
+def _settings(product_config):
+    product_config = product_config or {}
+    return {'timeout': float(product_config.get('csw_timeout', CSW_TIMEOUT)),
+            'ttl': float(product_config.get('csw_summary_ttl', SUMMARY_TTL)),
+            'negative_ttl': float(product_config.get('csw_summary_negative_ttl', NEGATIVE_SUMMARY_TTL)),
+            'cache_dir': product_config.get('csw_summary_cache_dir'),
+            'store': artefact_store.store_for(product_config)}
+
+
+class SummaryStore:
+    """Summaries on disk, one small json file for each key, also published to the artefact store."""
+
+    def __init__(self, directory, store=None):
+        self.directory = directory
+        self.store = store
+
+    def _name(self, key):
+        return f'summary-{hashlib.sha1(key.encode()).hexdigest()}.json'
+
+    def _path(self, key):
+        return os.path.join(self.directory, self._name(key))
+
+    def get(self, key, now=None):
+        """The stored entry for key, or None if not stored or expired."""
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if self._valid(entry, key, now):
+            return entry
+        if self.store is not None:
+            data = artefact_store.get(self.store, f'csw-summary/{self._name(key)}')
+            try:
+                entry = json.loads(data) if data else None
+            except ValueError:
+                entry = None
+            if self._valid(entry, key, now):
+                self.put(key, entry, publish=False)
+                return entry
+        return None
+
+    @staticmethod
+    def _valid(entry, key, now=None):
+        return isinstance(entry, dict) and entry.get('key') == key and entry.get('expires', 0) >= (now or time.time())
+
+    def put(self, key, entry, publish=True):
+        """Write to a temporary file and rename, so readers never see a partial file."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with atomic_path(self._path(key), prefix='.summary-', suffix='.json') as tmp_file, open(tmp_file, 'w') as f:
+                json.dump(dict(entry, key=key), f)
+        except OSError as e:
+            logger.warning(f"Failed to store summary for {key}: {str(e)}")
+        if publish and self.store is not None:
+            artefact_store.put(self.store, f'csw-summary/{self._name(key)}', json.dumps(dict(entry, key=key)).encode())
+
+
+def _entry(summary, settings, now=None):
+    if summary:
+        return {'summary': summary, 'expires': (now or time.time()) + settings['ttl']}
+    return {'summary': NOT_AVAILABLE, 'expires': (now or time.time()) + settings['negative_ttl']}
+
+
+def _fetch_and_store(key, fetch, fetch_args, settings, shared_cache):
+    try:
+        summary = fetch(*fetch_args, timeout=settings['timeout'])
+    except Exception as e:
+        logger.warning(f"Failed to fetch summary for {key}: {str(e)}")
+        summary = None
+    entry = _entry(summary, settings)
+    shared_cache[key] = entry
+    if settings['cache_dir']:
+        SummaryStore(settings['cache_dir'], settings['store']).put(key, entry)
+    return entry
+
+
+def summary(key, fetch, fetch_args, shared_cache, product_config=None):
+    """The summary for key, or NOT_AVAILABLE while it is fetched or if there is none.
+
+    fetch(*fetch_args, timeout=...) returns the summary text or None.
+    """
+    settings = _settings(product_config)
+    now = time.time()
+    entry = shared_cache.get(key)
+    if isinstance(entry, dict) and entry.get('expires', 0) >= now:
+        cache_outcome('csw_summary', 'hit')
+        return entry['summary']
+    if settings['cache_dir']:
+        entry = SummaryStore(settings['cache_dir'], settings['store']).get(key, now)
+        if entry:
+            cache_outcome('csw_summary', 'disk')
+            shared_cache[key] = entry
+            return entry['summary']
+    cache_outcome('csw_summary', 'miss')
+    if _prefetch_queue is not None:
+        # Not Available until the prefetch thread has the summary. Do not queue it again before the fetch times out.
+        shared_cache[key] = {'summary': NOT_AVAILABLE, 'expires': now + 2 * settings['timeout']}
+        logger.debug(f"Fetch summary {key} in the background")
+        _prefetch_queue.put((key, fetch, fetch_args, settings))
+        return NOT_AVAILABLE
+    return _fetch_and_store(key, fetch, fetch_args, settings, shared_cache)['summary']
+
+
+def _prefetch(queue, shared_cache):
+    while True:
+        key, fetch, fetch_args, settings = queue.get()
+        entry = _fetch_and_store(key, fetch, fetch_args, settings, shared_cache)
+        logger.debug(f"Fetched summary {key}: {entry['summary']}")
+
+
+def start_prefetch_thread(shared_cache):
+    """Fetch summaries in a thread of this process. Call in the server process before forking requests."""
+    global _prefetch_queue
+    if _prefetch_queue is None:
+        _prefetch_queue = Queue()
+        threading.Thread(target=_prefetch, args=(_prefetch_queue, shared_cache), daemon=True,
+                         name='csw-summary-prefetch').start()
+    return _prefetch_queue
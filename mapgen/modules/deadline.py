@@ -0,0 +1,160 @@
+"""
+deadline : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Request deadlines and cancellation.
+
+The server process sets a deadline, REQUEST_TIMEOUT seconds (default
+300) after the request arrived, and hands it to the request process. A
+config entry can shorten it with request_timeout. The request process
+checks the deadline at the start of every timed stage (route, open,
+projection, dimensions, resample, style build, map file save, dispatch,
+...) and raises DeadlineExceeded if it has passed, which is answered
+with 504.
+
+The server process waits for the result until the deadline and
+REQUEST_TERMINATE_GRACE seconds (default 5) more, for a request stuck
+in a single stage. Then, or when the client has disconnected, the
+request process is terminated. A request process that dies without a
+result is noticed instead of waited for.
+
+Deadlines are monotonic clock times, which are the same in all processes
+on the host.
+"""
+
+import os
+import time
+import queue
+import select
+import socket
+import logging
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', 300))
+TERMINATE_GRACE = float(os.environ.get('REQUEST_TERMINATE_GRACE', 5))
+POLL_INTERVAL = 0.5
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(BaseException):
+    """The deadline of the request has passed.
+
+    A BaseException, like KeyboardInterrupt, so it passes through the
+    except Exception in the handlers and stops the request.
+    """
+
+    def __init__(self, stage=None):
+        super().__init__(f"Deadline exceeded before {stage}" if stage else "Deadline exceeded")
+        self.stage = stage
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before the result was ready."""
+
+
+class WorkerFailed(Exception):
+    """The request process ended without a result."""
+
+
+def after(seconds):
+    """The deadline seconds from now."""
+    return time.monotonic() + seconds
+
+
+@contextmanager
+def request_deadline(seconds=None, at=None):
+    """Finish the work in the block within seconds, or by the deadline at.
+
+    An earlier deadline already set is kept. Without seconds and at the
+    deadline is unchanged.
+    """
+    candidates = [d for d in (_deadline.get(), at, after(float(seconds)) if seconds else None) if d is not None]
+    token = _deadline.set(min(candidates) if candidates else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left until the deadline, or None without a deadline."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check(stage=None):
+    """Raise DeadlineExceeded if the deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(stage)
+
+
+def socket_disconnected(sock):
+    """True if the peer has closed the socket. Does not consume any data."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+def terminate(process, grace=TERMINATE_GRACE):
+    """Stop the request process, killing it if it does not stop within grace seconds."""
+    process.terminate()
+    process.join(grace)
+    if process.is_alive():
+        logger.error(f"Request process {process.pid} did not stop. Killing it.")
+        process.kill()
+        process.join()
+
+
+def wait_for_result(result_queue, process, at=None, disconnected=None, poll_interval=POLL_INTERVAL,
+                    grace=TERMINATE_GRACE):
+    """Wait for the result the request process puts on result_queue.
+
+    Raises DeadlineExceeded when there is no result grace seconds after the
+    deadline at, ClientDisconnected when disconnected() returns True and
+    WorkerFailed when the process ends without a result. The process is
+    terminated in the first two cases.
+    """
+    while True:
+        timeout = poll_interval
+        if at is not None:
+            left = at + grace - time.monotonic()
+            if left <= 0:
+                logger.warning(f"Request process {process.pid} passed the deadline. Terminating it.")
+                terminate(process, grace)
+                raise DeadlineExceeded('result')
+            timeout = min(timeout, left)
+        try:
+            return result_queue.get(timeout=timeout)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result may be put just before the process ended
+            try:
+                return result_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                raise WorkerFailed(f"Request process {process.pid} ended with exit code {process.exitcode}")
+        if disconnected is not None and disconnected():
+            logger.warning(f"Client disconnected. Terminating request process {process.pid}.")
+            terminate(process, grace)
+            raise ClientDisconnected()
@@ -0,0 +1,112 @@
+"""
+dimension index : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Sorted index of the values of a dimension, like time, height, pressure
+or ensemble member, to find the position of a requested value with a
+binary search instead of a loop over all values.
+
+Time values are kept as int64 seconds, other values as float64. The
+index is cached in the shared cache per file and dimension.
+"""
+
+import os
+import logging
+import datetime
+
+import numpy as np
+
+from mapgen.modules.time_axis import _time_values_to_seconds
+
+logger = logging.getLogger(__name__)
+
+# Relative tolerance when comparing float values. Covers values stored as
+# float32 in the netcdf file, e.g. 0.1, compared to the float64 request value.
+RELATIVE_TOLERANCE = 1e-6
+
+
+class DimensionIndex:
+    """Values of a dimension sorted, with the position of each value in the dimension."""
+
+    def __init__(self, values, positions, is_time=False, mtime=None):
+        self.values = values
+        self.positions = positions
+        self.is_time = is_time
+        self.mtime = mtime
+
+    @classmethod
+    def from_data_array(cls, data_array, mtime=None):
+        is_time = np.issubdtype(data_array.dtype, np.datetime64) or data_array.name == 'time'
+        if is_time:
+            values = _time_values_to_seconds(data_array)
+        else:
+            values = np.atleast_1d(np.asarray(data_array.data, dtype=np.float64))
+        positions = np.argsort(values, kind='stable')
+        return cls(values[positions], positions, is_time, mtime)
+
+    @property
+    def size(self):
+        return self.values.size
+
+    def _to_value(self, requested):
+        if self.is_time:
+            if isinstance(requested, str):
+                requested = datetime.datetime.strptime(requested, "%Y-%m-%dT%H:%M:%SZ")
+            return np.datetime64(requested, 's').astype(np.int64)
+        return float(requested)
+
+    def lookup(self, requested, tolerance=0, nearest=False):
+        """Position in the dimension of the requested value.
+
+        The closest value is used if it is within tolerance, or whatever
+        the distance is with nearest. tolerance is in the unit of the
+        dimension, seconds for time. Raises KeyError if no value matches.
+        """
+        value = self._to_value(requested)
+        if not self.is_time:
+            tolerance = max(tolerance, RELATIVE_TOLERANCE * abs(value))
+        insert_at = int(np.searchsorted(self.values, value))
+        candidates = [i for i in (insert_at - 1, insert_at) if 0 <= i < self.values.size]
+        if not candidates:
+            raise KeyError(f"No values in dimension to match {requested}")
+        closest = min(candidates, key=lambda i: abs(self.values[i] - value))
+        if not nearest and abs(self.values[closest] - value) > tolerance:
+            raise KeyError(f"Could not find {requested} in dimension")
+        # First position with this value, as a loop over the dimension would give
+        closest = int(np.searchsorted(self.values, self.values[closest]))
+        return int(self.positions[closest])
+
+
+def dimension_index(ds, dim_name, shared_cache=None, netcdf_file=None):
+    """Index of dim_name in ds. Cached until netcdf_file is modified."""
+    cache_key = None
+    mtime = None
+    if shared_cache is not None and netcdf_file:
+        try:
+            mtime = os.stat(netcdf_file).st_mtime
+            cache_key = f'dimension-index-{netcdf_file}-{dim_name}'
+        except OSError:
+            pass
+    if cache_key:
+        index = shared_cache.get(cache_key)
+        if index is not None and index.mtime == mtime and index.size == ds[dim_name].size:
+            return index
+    logger.debug(f"Build dimension index for {dim_name}")
+    index = DimensionIndex.from_data_array(ds[dim_name], mtime)
+    if cache_key:
+        shared_cache[cache_key] = index
+    return index
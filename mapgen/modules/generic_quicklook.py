@@ -41,10 +41,15 @@ import datetime
 import mapscript
 
 import xarray as xr
-from mapgen.modules.create_symbol_file import create_symbol_file
+from mapgen.modules.artefacts import touch_artefact
+from mapgen.modules.create_symbol_file import attach_symbol_set
 from mapgen.modules.helpers import handle_request, _fill_metadata_to_mapfile, _parse_filename, _get_mapfiles_path
 from mapgen.modules.helpers import _generate_getcapabilities, _generate_getcapabilities_vector, _generate_layer
-from mapgen.modules.helpers import _parse_request, _read_netcdfs_from_ncml, HTTPError
+from mapgen.modules.helpers import _parse_request, HTTPError
+from mapgen.modules.ncml import NcmlDataset
+from mapgen.modules.metrics import stage
+from mapgen.modules import artefact_store
+from mapgen.modules.mapfile_store import mapfile_key, mapfile_path, load_mapfile, save_mapfile
 
 # grid_mapping_cache = {}
 # summary_cache = {}
@@ -52,6 +57,13 @@ from mapgen.modules.helpers import _parse_request, _read_netcdfs_from_ncml, HTTP
 
 logger = logging.getLogger(__name__)
 
+def _requested_time(qp):
+    """The time in the request as datetime or None."""
+    try:
+        return datetime.datetime.strptime(qp['time'], "%Y-%m-%dT%H:%M:%SZ")
+    except (KeyError, TypeError, ValueError):
+        return None
+
 def generic_quicklook(netcdf_path: str,
                       query_string: str,
                       http_host: str,
@@ -81,26 +93,24 @@ def generic_quicklook(netcdf_path: str,
     try:
         request = qp.get('request')
         if request and request.lower() != 'getcapabilities':
-            try:
-                actual_variable_from_layer = qp.get('layers',qp.get('layer'))
-                actual_variable_from_time = qp.get('time','notime')
-                actual_variable_from_styles = qp.get('styles', 'default-style')
-                if not actual_variable_from_styles:
-                    actual_variable_from_styles = 'default-style'
-                mapserver_map_file = os.path.join(_get_mapfiles_path(product_config), f'{os.path.basename(orig_netcdf_path)}-{actual_variable_from_layer}-{actual_variable_from_styles}-{actual_variable_from_time}.map')
-                if os.path.exists(mapserver_map_file):
-                    logger.debug(f"Reuse existing layer map file {mapserver_map_file}")
-                    map_object = mapscript.mapObj(mapserver_map_file)
-                    return handle_request(map_object, query_string, product_config)
-                logger.debug(f"Need to generate mapfile {mapserver_map_file}")
-            except Exception:
-                logger.exception("Failed to generate mapfile with variable filename.")
+            mapserver_map_file = mapfile_path(_get_mapfiles_path(product_config),
+                                              f'{os.path.basename(orig_netcdf_path)}-{qp.get("layers", qp.get("layer"))}',
+                                              mapfile_key(netcdf_path, product_config, qp, http_host, url_scheme, api))
+            map_object = load_mapfile(mapserver_map_file, artefact_store.store_for(product_config))
+            if map_object:
+                logger.debug("Reuse existing layer map file %s", mapserver_map_file)
+                touch_artefact(mapserver_map_file)
+                return handle_request(map_object, query_string, product_config)
+            logger.debug("Need to generate mapfile %s", mapserver_map_file)
         else:
             # Assume getcapabilities
-            mapserver_map_file = os.path.join(_get_mapfiles_path(product_config), f'{os.path.basename(orig_netcdf_path)}-getcapabilities.map')
-            if os.path.exists(mapserver_map_file):
-                logger.debug(f"Reuse existing getcapabilities map file {mapserver_map_file}")
-                map_object = mapscript.mapObj(mapserver_map_file)
+            mapserver_map_file = mapfile_path(_get_mapfiles_path(product_config),
+                                              f'{os.path.basename(orig_netcdf_path)}-getcapabilities',
+                                              mapfile_key(netcdf_path, product_config, None, http_host, url_scheme, api))
+            map_object = load_mapfile(mapserver_map_file, artefact_store.store_for(product_config))
+            if map_object:
+                logger.debug("Reuse existing getcapabilities map file %s", mapserver_map_file)
+                touch_artefact(mapserver_map_file)
                 return handle_request(map_object, query_string)
     except AttributeError:
         logger.exception("Failed during check for existing mapfiles. Possible empty query string. Continue to generate new ones.")
@@ -111,16 +121,17 @@ def generic_quicklook(netcdf_path: str,
     last_ds_disk = None
     try:
         logger.debug("Before open dataset")
-        ds_disk = xr.open_dataset(netcdf_path, mask_and_scale=False)
+        with stage('open_dataset'):
+            ds_disk = xr.open_dataset(netcdf_path, mask_and_scale=False)
         logger.debug("After open dataset")
     except ValueError:
         try:
             if netcdf_path.endswith('ncml'):
-                netcdf_files = _read_netcdfs_from_ncml(netcdf_path)
-                ds_disk = xr.open_dataset(netcdf_files[0], mask_and_scale=False)
-                last_ds_disk = xr.open_dataset(netcdf_files[-1], mask_and_scale=False)
-                # import xncml
-                # ds_disk = xncml.open_ncml("./output.xml")
+                # Only open the member holding the requested time. Capabilities use the
+                # combined time axis of the ncml and the first member for the rest.
+                ncml_dataset = NcmlDataset(netcdf_path, shared_cache)
+                with stage('open_dataset'):
+                    ds_disk = ncml_dataset.open(_requested_time(qp))
                 is_ncml = True
         except Exception as e:
             logger.error(f"status_code=500, Can not open file. Either not existing or ncml file: {e}")
@@ -142,7 +153,7 @@ def generic_quicklook(netcdf_path: str,
             except TypeError as te:
                 forecast_time = pandas.to_datetime(ds_disk['forecast_reference_time'].data).to_pydatetime()
             try:
-                logger.debug(f"{ds_disk['time'].dt}")
+                logger.debug("%s", ds_disk['time'].dt)
             except (TypeError, AttributeError):
                 if ds_disk['time'].attrs['units'] == 'seconds since 1970-01-01 00:00:00 +00:00':
                     ds_disk['time'] = pandas.TimedeltaIndex(ds_disk['time'], unit='s') + datetime.datetime(1970, 1, 1)
@@ -159,18 +170,17 @@ def generic_quicklook(netcdf_path: str,
             # Parse the netcdf filename to get start time or reference time
             _, _forecast_time = _parse_filename(netcdf_path, product_config)
             forecast_time = datetime.datetime.strptime(_forecast_time, "%Y%m%dT%H")
-            logger.debug(f"{forecast_time}")
+            logger.debug("%s", forecast_time)
         except ValueError:
             logger.debug("Could not find any forecast_reference_time. Try use time_coverage_start.")
             try:
                 forecast_time = datetime.datetime.fromisoformat(ds_disk.time_coverage_start)
-                logger.debug(f"{forecast_time}")
+                logger.debug("%s", forecast_time)
             except Exception as ex:
-                logger.debug(f"Could not find any forecast_reference_time. Use now. Last unhandled exception: {str(ex)}")
+                logger.debug("Could not find any forecast_reference_time. Use now. Last unhandled exception: %s", ex)
                 forecast_time = datetime.datetime.now()
 
     symbol_file = os.path.join(_get_mapfiles_path(product_config), "symbol.sym")
-    create_symbol_file(symbol_file)
  
     mapserver_map_file = None
     layer_no = -1
@@ -178,63 +188,63 @@ def generic_quicklook(netcdf_path: str,
     actual_variable = None
     if 'request' in qp and qp['request'].lower() != 'getcapabilities':
         map_object = mapscript.mapObj()
-        _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "Generic netcdf WMS", api)
-        map_object.setSymbolSet(symbol_file)
+        _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "Generic netcdf WMS", api, product_config)
+        attach_symbol_set(map_object, symbol_file)
         layer = mapscript.layerObj()
         actual_variable = _generate_layer(layer, ds_disk, shared_cache, netcdf_path, qp, map_object, product_config, last_ds_disk)
         if actual_variable:
-            logger.debug(f"Add layer for variable {actual_variable}.")
+            logger.debug("Add layer for variable %s.", actual_variable)
             layer_no = map_object.insertLayer(layer)
         else:
             logger.debug("No variable found to generate layer for.")
-        actual_variable_from_time = qp.get('time', 'notime')
-        actual_variable_from_styles = qp.get('styles', 'default-style')
-        if not actual_variable_from_styles:
-            actual_variable_from_styles = 'default-style'
-        mapserver_map_file = os.path.join(_get_mapfiles_path(product_config), f'{os.path.basename(orig_netcdf_path)}-{actual_variable}-{actual_variable_from_styles}-{actual_variable_from_time}.map')
+        mapserver_map_file = mapfile_path(_get_mapfiles_path(product_config),
+                                          f'{os.path.basename(orig_netcdf_path)}-{qp.get("layers", qp.get("layer"))}',
+                                          mapfile_key(netcdf_path, product_config, qp, http_host, url_scheme, api))
     else:
         # Assume getcapabilities
-        logger.debug(f'grid_mapping_cache {shared_cache}')
-        mapserver_map_file = os.path.join(_get_mapfiles_path(product_config), f'{os.path.basename(orig_netcdf_path)}-getcapabilities.map')
+        logger.debug("grid_mapping_cache %s", shared_cache)
+        mapserver_map_file = mapfile_path(_get_mapfiles_path(product_config),
+                                          f'{os.path.basename(orig_netcdf_path)}-getcapabilities',
+                                          mapfile_key(netcdf_path, product_config, None, http_host, url_scheme, api))
         map_object = mapscript.mapObj()
-        _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "Generic netcdf WMS", api)
-        map_object.setSymbolSet(symbol_file)
+        _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, url_scheme, http_host, ds_disk, shared_cache, "Generic netcdf WMS", api, product_config)
+        attach_symbol_set(map_object, symbol_file)
 
         # Read all variables names from the netcdf file.
         variables = list(ds_disk.keys())
         netcdf_files = []
-        if netcdf_path.endswith('ncml'):
-            netcdf_files = _read_netcdfs_from_ncml(netcdf_path)
+        if is_ncml:
+            netcdf_files = ncml_dataset.members
         for variable in variables:
             if variable in ['longitude', 'latitude', 'forecast_reference_time', 'projection_lambert', 'projection_utm', 'p0', 'ap', 'b' , 'Lambert_Azimuthal_Grid', 'time_bnds', 'crs', 'projection_3']:
-                logger.debug(f"Skipping variable or dimension: {variable}")
+                logger.debug("Skipping variable or dimension: %s", variable)
                 continue
             layer = mapscript.layerObj()
             if _generate_getcapabilities(layer, ds_disk, variable, shared_cache, netcdf_path, last_ds_disk, netcdf_files, product_config):
                 layer_no = map_object.insertLayer(layer)
-                logger.debug(f"Add to GetCapabilities layer for variable {variable} with layer number {layer_no}.")
+                logger.debug("Add to GetCapabilities layer for variable %s with layer number %s.", variable, layer_no)
             else:
-                logger.debug(f"Skip for GetCapabilities layer for variable {variable}.")
+                logger.debug("Skip for GetCapabilities layer for variable %s.", variable)
             if variable.startswith('x_wind') and variable.replace('x', 'y') in variables:
-                logger.debug(f"Add wind vector layer for {variable}.")
+                logger.debug("Add wind vector layer for %s.", variable)
                 layer_contour = mapscript.layerObj()
                 if _generate_getcapabilities_vector(layer_contour, ds_disk, variable, shared_cache, netcdf_path, direction_speed=False, last_ds=last_ds_disk, netcdf_files=netcdf_files, product_config=product_config):
                     layer_no = map_object.insertLayer(layer_contour)
             if variable == 'wind_direction' and 'wind_speed' in variables:
-                logger.debug(f"Add wind vector layer based on wind direction and speed for {variable}.")
+                logger.debug("Add wind vector layer based on wind direction and speed for %s.", variable)
                 layer_contour = mapscript.layerObj()
                 if _generate_getcapabilities_vector(layer_contour, ds_disk, variable, shared_cache, netcdf_path, direction_speed=True, last_ds=last_ds_disk, netcdf_files=netcdf_files, product_config=product_config):
                     layer_no = map_object.insertLayer(layer_contour)
 
     if layer_no == -1 or not map_object:
-        logger.debug(f"No layers {layer_no} or no map_object {map_object}")
+        logger.debug("No layers %s or no map_object %s", layer_no, map_object)
         logger.error(f"status_code=500, Could not find any variables to turn into OGC WMS layers. One "
                      "reason can be your data does not have a valid grid_mapping (Please see CF "
                      "grid_mapping), or internal resampling failed.")
         raise HTTPError(response_code='500 Internal Server Error', response=("Could not find any variables to turn into OGC WMS layers. One reason can be your data does "
                                                      "not have a valid grid_mapping (Please see CF grid_mapping), internal resampling failed or some other unspecified reason."))
 
-    map_object.save(mapserver_map_file)
+    save_mapfile(map_object, mapserver_map_file, artefact_store.store_for(product_config))
 
     # Handle the request and return results.
     return handle_request(map_object, query_string, product_config)
@@ -17,17 +17,88 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import sys
+import re
 import logging
+import importlib
 
 from mapgen.modules.helpers import find_config_for_this_netcdf, HTTPError
-
-import mapgen.modules.arome_arctic_quicklook
-import mapgen.modules.generic_quicklook
-import mapgen.modules.satellite_satpy_quicklook
+from mapgen.modules.helpers import _read_config_file, WMS_SRS_SUPPORTED
+from mapgen.modules.metrics import request_type, set_labels, stage
+from mapgen.modules.request_log import request_level
+from mapgen.modules.deadline import DeadlineExceeded, request_deadline
 
 logger = logging.getLogger(__name__)
 
+REGEXP_CONFIG_FILENAMES = ['url-path-regexp-patterns.yaml', 'klimakverna-url-path-regexp-patterns.yaml']
+
+def _load_module_function(product_config):
+    """Import the module handling this config entry on first use and return the function to call."""
+    module = importlib.import_module(product_config['module'])
+    return getattr(module, product_config['module_function'])
+
+def _prime_projections():
+    """Load the PROJ database and the GDAL drivers before any request needs them."""
+    import mapscript
+    from osgeo import gdal
+    from pyproj import CRS
+    gdal.AllRegister()
+    for srs in WMS_SRS_SUPPORTED.split():
+        CRS.from_user_input(srs)
+        mapscript.projectionObj(f"init={srs.lower()}")
+
+def warm_up(shared_cache, regexp_config_filenames=REGEXP_CONFIG_FILENAMES, regexp_config_dir='/config'):
+    """Do the work every request would otherwise repeat, in the server process before requests are forked.
+
+    Reads the configs, imports only the modules the configs use, primes
+    PROJ and GDAL and builds the symbol set. Failures are logged, the
+    request then does the work itself.
+    """
+    from mapgen.modules.create_symbol_file import symbol_set
+    modules = []
+    for regexp_config_filename in regexp_config_filenames:
+        for product_config in _read_config_file(regexp_config_filename, regexp_config_dir, shared_cache) or []:
+            if product_config.get('module') and product_config['module'] not in modules:
+                modules.append(product_config['module'])
+    for module in modules:
+        try:
+            importlib.import_module(module)
+            logger.debug("Warm up imported %s", module)
+        except Exception as e:
+            logger.warning(f"Warm up failed to import {module}: {str(e)}")
+    for warm_up_step in (_prime_projections, symbol_set):
+        try:
+            warm_up_step()
+        except Exception as e:
+            logger.warning(f"Warm up step {warm_up_step.__name__} failed: {str(e)}")
+    return modules
+
+def start_artefact_cleanup(shared_cache, regexp_config_filenames=REGEXP_CONFIG_FILENAMES, regexp_config_dir='/config'):
+    """Clean up the generated files of all configured mapfiles_path in the background."""
+    from mapgen.modules.artefacts import start_cleanup_thread
+
+    def read_product_configs():
+        product_configs = []
+        for regexp_config_filename in regexp_config_filenames:
+            product_configs.extend(_read_config_file(regexp_config_filename, regexp_config_dir, shared_cache) or [])
+        return product_configs
+    return start_cleanup_thread(read_product_configs, shared_cache)
+
+def product_config_for_request(netcdf_path, shared_cache, api='api/get_quicklook', regexp_config_dir='/config'):
+    """The config entry handling netcdf_path, or None. Quiet, for use before the request is processed."""
+    regexp_config_filename = REGEXP_CONFIG_FILENAMES[1] if api in ('KSS', 'klimakverna') else REGEXP_CONFIG_FILENAMES[0]
+    netcdf_path = netcdf_path.replace("//", "/")
+    for product_config in _read_config_file(regexp_config_filename, regexp_config_dir, shared_cache) or []:
+        try:
+            if re.match(product_config['pattern'], netcdf_path):
+                return product_config
+        except (KeyError, TypeError, re.error):
+            continue
+    return None
+
+def _deadline_response(exceeded):
+    logger.warning(f"Stopped the request: {str(exceeded)}")
+    return ('504 Gateway Timeout', b'Processing took too long. Stopping this process. Sorry.\n', 'text/plain')
+
 def get_quicklook(netcdf_path: str,
                   query_string,
                   http_host,
@@ -35,47 +106,59 @@ def get_quicklook(netcdf_path: str,
                   shared_cache,
                   products=[],
                   api='api/get_quicklook'):
-    logger.debug(f"Request query_params: {query_string}")
-    logger.debug(f"Request url scheme: {url_scheme} and host {http_host}")
-    logger.debug(f"Selected api {api}")
+    logger.debug("Request query_params: %s", query_string)
+    logger.debug("Request url scheme: %s and host %s", url_scheme, http_host)
+    logger.debug("Selected api %s", api)
     netcdf_path = netcdf_path.replace("//", "/")
-    logger.debug(f'NETCDF PATH: {netcdf_path}')
+    logger.debug("NETCDF PATH: %s", netcdf_path)
     if not netcdf_path:
         response_code = '404 Not Found'
         response = b'Missing netcdf path\n'
         content_type = 'text/plain'
     else:        
-        logger.debug(f"Products: {products}")
-        if api == 'KSS' or api == 'klimakverna':
-            product_config, response, response_code, content_type = find_config_for_this_netcdf(netcdf_path, shared_cache,
-                                                                                                regexp_config_filename='klimakverna-url-path-regexp-patterns.yaml')
-        else:
-            product_config, response, response_code, content_type = find_config_for_this_netcdf(netcdf_path, shared_cache)
+        logger.debug("Products: %s", products)
+        set_labels(request=request_type(query_string))
+        try:
+            with stage('route'):
+                if api == 'KSS' or api == 'klimakverna':
+                    product_config, response, response_code, content_type = find_config_for_this_netcdf(netcdf_path, shared_cache,
+                                                                                                        regexp_config_filename='klimakverna-url-path-regexp-patterns.yaml')
+                else:
+                    product_config, response, response_code, content_type = find_config_for_this_netcdf(netcdf_path, shared_cache)
+        except DeadlineExceeded as de:
+            return _deadline_response(de)
         if product_config:
+            set_labels(product=product_config.get('pattern', ''))
             # Load module from config
             try:
-                loaded_module = getattr(sys.modules[product_config['module']], product_config['module_function'])
-                # Call module
-                response_code, response, content_type = loaded_module(netcdf_path, query_string, http_host, url_scheme, shared_cache, products, product_config, api)
+                # Debug logging and timeout for this config entry only
+                with request_level(product_config.get('log_level')), request_deadline(product_config.get('request_timeout')):
+                    try:
+                        loaded_module = _load_module_function(product_config)
+                    except (AttributeError, ImportError) as e:
+                        logger.error("Failed to load module: %s %s", product_config['module'], e)
+                        response_code = '500'
+                        response = (f"Failed to load function {product_config['module_function']} "
+                                    f"from module {product_config['module']}. "
+                                    "Check the server config.").encode()
+                        content_type = 'text/plain'
+                    else:
+                        # Call module
+                        response_code, response, content_type = loaded_module(netcdf_path, query_string, http_host, url_scheme, shared_cache, products, product_config, api)
             except HTTPError as he:
                 response_code = he.response_code
                 response = he.response
                 content_type = he.content_type
-            except (AttributeError, ModuleNotFoundError) as e:
-                logger.debug(f"Failed to load module: {product_config['module']} {str(e)}")
-                response_code = '500'
-                response = (f"Failed to load function {product_config['module_function']} " 
-                            f"from module {product_config['module']}. "
-                            "Check the server config.").encode()
-                content_type = 'text/plain'
+            except DeadlineExceeded as de:
+                response_code, response, content_type = _deadline_response(de)
             except OSError as oe:
-                logger.debug(f"Unable to access netcdf file {netcdf_path}: {str(oe)}")
+                logger.debug("Unable to access netcdf file %s: %s", netcdf_path, oe)
                 response_code = '404 Not Found'
                 response = (f"Unable to access netcdf file {netcdf_path}.").encode()
                 content_type = 'text/plain'
             except Exception as e:
                 logger.exception("Exception when trying to load module.")
-                logger.debug(f"Unknown exception {str(e)}")
+                logger.debug("Unknown exception %s", e)
                 response_code = '500 Internal Server Error'
                 response = (f"Unknown server error. Please contact the server administrator.").encode()
                 content_type = 'text/plain'
@@ -17,6 +17,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import io
 import os
 import re
 import sys
@@ -24,11 +25,11 @@ import json
 import warnings
 import yaml
 import hashlib
+import time
 import logging
 import netCDF4
 import datetime
 import requests
-import tempfile
 import mapscript
 import traceback
 from osgeo import gdal
@@ -41,7 +42,19 @@ import numpy as np
 import xarray as xr
 from cartopy import crs
 import metpy # needed for xarray's metpy accessor
-import pandas as pd
+
+from mapgen.modules.ncml import ncml_aggregation, open_member, read_ncml_members
+from mapgen.modules.csw_summary import CSW_TIMEOUT, csw_session, summary as csw_summary
+from mapgen.modules.time_axis import time_axis
+from mapgen.modules.dimension_index import dimension_index
+from mapgen.modules.styles import CLASSIFICATION_LUT, COLORMAP_SCALE_BUCKETS, classification, set_lut_processing
+from mapgen.modules.styles import compile_styles, style_template
+from mapgen.modules import artefact_store
+from mapgen.modules.artefacts import new_artefact_dir, touch_artefact
+from mapgen.modules.metrics import observe, stage, timed
+from mapgen.modules.request_log import cache_outcome
+from mapgen.modules.vector_features import FEATURE_ITEMS, bbox_in_grid_crs, decimate, point_features
+from mapgen.modules.styles import _hex_to_rgb
 
 logger = logging.getLogger(__name__)
 
@@ -67,15 +80,16 @@ def _read_config_file(regexp_config_filename, regexp_config_dir, shared_cache):
         else:
             regexp_config_file = os.path.join(regexp_config_dir,
                                             regexp_config_filename)
-        logger.debug(f"Config file to use: {regexp_config_file}")
+        logger.debug("Config file to use: %s", regexp_config_file)
         regexp_config = None
         try:
             if os.path.exists(regexp_config_file):
                 with open(regexp_config_file) as f:
                     regexp_config = yaml.load(f, Loader=yaml.loader.SafeLoader)
         except Exception as e:
-            logger.debug(f"Failed to read yaml config: {regexp_config_file} with {str(e)}")
+            logger.debug("Failed to read yaml config: %s with %s", regexp_config_file, e)
             pass
+        compile_styles(regexp_config)
         shared_cache[regexp_config_filename] = regexp_config
     return shared_cache[regexp_config_filename]
 
@@ -88,18 +102,18 @@ def find_config_for_this_netcdf(netcdf_path, shared_cache, regexp_config_filenam
     if regexp_config:
         try:
             for url_path_regexp_pattern in regexp_config:
-                logger.debug(f"{url_path_regexp_pattern}")
+                logger.debug("%s", url_path_regexp_pattern)
                 pattern = re.compile(url_path_regexp_pattern['pattern'])
                 if pattern.match(netcdf_path):
-                    logger.debug(f"Got match. Need to load module: {url_path_regexp_pattern['module']}")
+                    logger.debug("Got match. Need to load module: %s", url_path_regexp_pattern['module'])
                     regexp_pattern_module = url_path_regexp_pattern
                     break
             else:
-                logger.debug(f"Could not find any match for the path {netcdf_path} in the configuration file {regexp_config_filename}.")
+                logger.debug("Could not find any match for the path %s in the configuration file %s.", netcdf_path, regexp_config_filename)
                 logger.debug("Please review your config if you expect this path to be handled.")
             
         except Exception as e:
-            logger.debug(f"Exception in the netcdf_path match part with {str(e)}")
+            logger.debug("Exception in the netcdf_path match part with %s", e)
             exc_info = sys.exc_info()
             traceback.print_exception(*exc_info)
             response = f"Exception raised when regexp. Check the config."
@@ -132,7 +146,7 @@ def handle_request(map_object, full_request, product_config={}):
     try:
         # Do some cleanup to the query string
         full_request_string = _query_string_cleanup(full_request_string)
-        logger.debug(f"Full request string: {full_request_string}")
+        logger.debug("Full request string: %s", full_request_string)
     except Exception as e:
         logger.error(f"status_code=500, failed to handle query parameters: {str(full_request)}, with error: {str(e)}")
         raise HTTPError(response_code='500 Internal Server Error',
@@ -153,15 +167,15 @@ def handle_request(map_object, full_request, product_config={}):
         ows_req.setParameter("VERSION", "1.3.0")
         ows_req.setParameter("REQUEST", "GetCapabilities")
     else:
-        logger.debug(f"ALL query params: {full_request_string}")
-    logger.debug(f"NumParams {ows_req.NumParams}")
-    logger.debug(f"TYPE {ows_req.type}")
+        logger.debug("ALL query params: %s", full_request_string)
+    logger.debug("NumParams %s", ows_req.NumParams)
+    logger.debug("TYPE %s", ows_req.type)
     if ows_req.getValueByName('REQUEST') != 'GetCapabilities':
-        logger.debug(f"REQUEST is: {ows_req.getValueByName('REQUEST')}")
+        logger.debug("REQUEST is: %s", ows_req.getValueByName('REQUEST'))
         mapscript.msIO_installStdoutToBuffer()
         try:
             _styles = str(ows_req.getValueByName("STYLES"))
-            logger.debug(f"STYLES: {_styles}")
+            logger.debug("STYLES: %s", _styles)
             if _styles.lower() in 'contour':
                 ows_req.setParameter("STYLES", "")
             if _styles.lower() in 'wind_barbs':
@@ -169,7 +183,7 @@ def handle_request(map_object, full_request, product_config={}):
             if _styles.lower() in 'vector':
                 ows_req.setParameter("STYLES", "")
             _style = str(ows_req.getValueByName("STYLE"))
-            logger.debug(f"STYLE: {_style}")
+            logger.debug("STYLE: %s", _style)
             if _style.lower() in 'contour':
                 ows_req.setParameter("STYLE", "")
             if _style.lower() in 'wind_barbs':
@@ -180,8 +194,9 @@ def handle_request(map_object, full_request, product_config={}):
             logger.debug("STYLES not in the request. Nothing to reset.")
             pass
         try:
-            logger.debug(f"PWD {os.getcwd()}")
-            map_object.OWSDispatch( ows_req )
+            logger.debug("PWD %s", os.getcwd())
+            with stage('ows_dispatch'):
+                map_object.OWSDispatch( ows_req )
         except Exception as e:
             logger.error(f"status_code=500, mapscript fails to parse query parameters: {str(full_request)}, with error: {str(e)}")
             raise HTTPError(response_code='500 Internal Server Error',
@@ -198,21 +213,23 @@ def handle_request(map_object, full_request, product_config={}):
     else:
         try:
             mapscript.msIO_installStdoutToBuffer()
-            dispatch_status = map_object.OWSDispatch(ows_req)
+            with stage('ows_dispatch'):
+                dispatch_status = map_object.OWSDispatch(ows_req)
         except Exception as e:
             logger.error(f"status_code=500, mapscript fails to parse query parameters: {str(full_request)}, with error: {str(e)}")
             raise HTTPError(response_code='500 Internal Server Error',
                             response=f"mapscript fails to parse query parameters: {str(full_request)}, with error: {str(e)}")
         if dispatch_status != mapscript.MS_SUCCESS:
-            logger.debug(f"DISPATCH status {dispatch_status}")
+            logger.debug("DISPATCH status %s", dispatch_status)
         content_type = mapscript.msIO_stripStdoutBufferContentType()
         mapscript.msIO_stripStdoutBufferContentHeaders()
         _result = mapscript.msIO_getStdoutBufferBytes()
 
         if content_type == 'application/vnd.ogc.wms_xml; charset=UTF-8':
             content_type = 'text/xml'
-        dom = xml.dom.minidom.parseString(_result)
-        result = dom.toprettyxml(indent="", newl="").encode()
+        with stage('capabilities_pretty_print'):
+            dom = xml.dom.minidom.parseString(_result)
+            result = dom.toprettyxml(indent="", newl="").encode()
         mapscript.msIO_resetHandlers()
     logger.info(f"status_code=200, mapscript return successfully.")
     response_code = '200 OK'
@@ -244,7 +261,7 @@ def _north(projection: crs.CRS, requested_epsg, x_in: xr.DataArray, y_in: xr.Dat
 
     if isinstance(projection, crs.PlateCarree):
         # No need for rotation
-        logger.debug(f"No rotation {projection}")
+        logger.debug("No rotation %s", projection)
         north_u = x
         north_v = y
     elif requested_epsg == 4326:
@@ -272,6 +289,25 @@ def _get_north(x_vector_param: str, ds: xr.Dataset, requested_epsg):
     return north
 
 
+def _stored_north(store, unique_dataset_string):
+    """The north grid published to the artefact store, or None."""
+    data = artefact_store.get(store, f'north/{unique_dataset_string}.npz')
+    if data is None:
+        return None
+    try:
+        with np.load(io.BytesIO(data)) as stored:
+            return xr.DataArray(data=stored['north'], dims=[str(dim) for dim in stored['dims']])
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"Failed to read north grid {unique_dataset_string} from {store}: {str(e)}")
+        return None
+
+
+def _store_north(store, unique_dataset_string, north):
+    buffer = io.BytesIO()
+    np.savez(buffer, north=np.asarray(north.data), dims=np.array(north.dims))
+    artefact_store.put(store, f'north/{unique_dataset_string}.npz', buffer.getvalue())
+
+
 def _get_crs(ds: xr.Dataset, sample_parameter: str) -> crs.CRS:
     ds = ds.metpy.parse_cf([sample_parameter])
     return ds[sample_parameter].metpy.cartopy_crs
@@ -281,7 +317,7 @@ def _rotate_relative_to_north(from_direction: xr.DataArray, north: np.ndarray):
     from_direction -= north
     from_direction %= 360
 
-def _find_summary_from_csw(search_fname, forecast_time, scheme, netloc):
+def _find_summary_from_csw(search_fname, forecast_time, scheme, netloc, timeout=CSW_TIMEOUT):
     summary_text = None
     search_string = ""
     if 'arome_arctic' in search_fname:
@@ -292,7 +328,7 @@ def _find_summary_from_csw(search_fname, forecast_time, scheme, netloc):
         search_string += "deterministic_"
     if search_string != "":
         search_string += forecast_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-        logger.debug(f"CSW Search string {search_string}")
+        logger.debug("CSW Search string %s", search_string)
         #netloc = full_request.url.netloc
         if 's-enda' in netloc:
             netloc = netloc.replace("fastapi", "csw")
@@ -302,11 +338,18 @@ def _find_summary_from_csw(search_fname, forecast_time, scheme, netloc):
                 'mode=opensearch&service=CSW&version=2.0.2&request=GetRecords&elementsetname=full&'
             f'typenames=csw:Record&resulttype=results&q={search_string}')
         try:
-            xml_string = requests.get(url, timeout=10).text
+            xml_string = csw_session().get(url, timeout=timeout).text
         except requests.exceptions.Timeout:
             logger.debug("csw request timed out. Skip summary")
             return summary_text
-        root = etree.fromstring(xml_string.encode('utf-8'))
+        except requests.exceptions.RequestException as e:
+            logger.debug("csw request failed: %s. Skip summary", e)
+            return summary_text
+        try:
+            root = etree.fromstring(xml_string.encode('utf-8'))
+        except etree.XMLSyntaxError as e:
+            logger.debug("Failed to parse csw response: %s. Skip summary", e)
+            return summary_text
         summarys = root.xpath('.//atom:summary', namespaces=root.nsmap)
         for summary in summarys:
             summary_text = summary.text
@@ -326,16 +369,13 @@ def _size_x_y(xr_dataset):
     logger.warning("Failed to find x and y dimensions in dataset use default 2000 2000")
     return 2000, 2000
 
-def _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, scheme, netloc, xr_dataset, shared_cache, wms_title, api):
+def _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, scheme, netloc, xr_dataset, shared_cache, wms_title, api,
+                              product_config=None):
     """"Add all needed web metadata to the generated map file."""
     bn_summary = f'summary-{os.path.basename(orig_netcdf_path)}'
-    if bn_summary not in shared_cache:
-        summary = _find_summary_from_csw(bn_summary, forecast_time, scheme, netloc)
-        if summary:
-            shared_cache[bn_summary] = summary
-            logger.debug(f"{shared_cache[bn_summary]}")
-        else:
-            shared_cache[bn_summary] = "Not Available."
+    summary = csw_summary(bn_summary, _find_summary_from_csw, (bn_summary, forecast_time, scheme, netloc),
+                          shared_cache, product_config)
+    logger.debug("Summary %s: %s", bn_summary, summary)
     map_object.web.metadata.set("wms_title", wms_title)
     map_object.web.metadata.set("wms_onlineresource", f"{scheme}://{netloc}/{api}{orig_netcdf_path}")
     map_object.web.metadata.set("wms_srs", WMS_SRS_SUPPORTED)
@@ -375,7 +415,7 @@ def _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, schem
 
     # Need to set size of map object after extent is set
     _x, _y = _size_x_y(xr_dataset)
-    logger.debug(f"x and y dimensions in dataset {_x} {_y}")
+    logger.debug("x and y dimensions in dataset %s %s", _x, _y)
     map_object.setSize(_x, _y)
 
     # Causing more trouble than use. Skip for now
@@ -394,17 +434,18 @@ def _fill_metadata_to_mapfile(orig_netcdf_path, forecast_time, map_object, schem
 
     return
 
+@timed('projection')
 def _find_projection(ds, variable, shared_cache, netcdf_file, product_config):
     # Find projection
     if product_config.get('resample_to_grid', None):
-        logger.debug(f"Config says resample to grid for variable {variable}. Try Compute using pyresample.")
+        logger.debug("Config says resample to grid for variable %s. Try Compute using pyresample.", variable)
         try:
             optimal_bb_area, grid_mapping_name = _compute_optimal_bb_area_from_lonlat(ds, shared_cache, netcdf_file)
             del optimal_bb_area
             optimal_bb_area = None
-            logger.debug(f"GRID MAPPING NAME: {grid_mapping_name}")
+            logger.debug("GRID MAPPING NAME: %s", grid_mapping_name)
         except (KeyError, ValueError):
-            logger.debug(f"no grid_mapping for variable {variable} and failed to compute. Skip this.")
+            logger.debug("no grid_mapping for variable %s and failed to compute. Skip this.", variable)
             return None
     else:
         try:
@@ -429,7 +470,7 @@ def _find_projection(ds, variable, shared_cache, netcdf_file, product_config):
                             )
                             shared_cache[grid_mapping_name] = CRS.from_user_input(proj4_attr).to_proj4()
                     except Exception as ex:
-                        logger.debug(f"Could not normalize proj4 attr for {variable}: {ex}. Falling back to raw value.")
+                        logger.debug("Could not normalize proj4 attr for %s: %s. Falling back to raw value.", variable, ex)
                         shared_cache[grid_mapping_name] = proj4_attr
                 else:
                     cs = CRS.from_cf(grid_mapping_var.attrs)
@@ -441,7 +482,7 @@ def _find_projection(ds, variable, shared_cache, netcdf_file, product_config):
                         )
                         shared_cache[grid_mapping_name] = cs.to_proj4()
         except KeyError:
-            logger.debug(f"no grid_mapping for variable {variable}, nor any resample to grid in config. Skip this.")
+            logger.debug("no grid_mapping for variable %s, nor any resample to grid in config. Skip this.", variable)
             grid_mapping_name = None
     return grid_mapping_name
 
@@ -469,7 +510,7 @@ def _extract_extent(ds, variable, transform_rotated=False):
     logger.warning(f"Fail to detect dimmension names from hardcoded values. Try to find dim names from variable")
     dim_names = _find_dim_names(ds, variable)
     if len(dim_names) < 2:
-        logger.debug(f"Failed to find dim names from variable {variable}.")
+        logger.debug("Failed to find dim names from variable %s.", variable)
         raise HTTPError(response_code='500 Internal Server Error', response=f"Could not recognize at least 2 spatial coords for {variable}. Valid for this service are {x_l} and {y_l}.\n")
     try:
         ll_x = min(ds[variable].coords[dim_names[0]].data)
@@ -482,7 +523,7 @@ def _extract_extent(ds, variable, transform_rotated=False):
         return ll_x,ur_x,ll_y,ur_y
     except (KeyError, IndexError):
         pass
-    logger.debug(f"Failed to recognize extent of variable {variable}, valid is {x_l} and {y_l} or {dim_names}(found in dataset).")
+    logger.debug("Failed to recognize extent of variable %s, valid is %s and %s or %s(found in dataset).", variable, x_l, y_l, dim_names)
     raise HTTPError(response_code='500 Internal Server Error', response=f"Could not recognize coords for {variable}. Valid for this service are {x_l} and {y_l} or {dim_names}(found in dataset).")
 
 def _transform_rotated_extent_if_needed(ds, variable, x_coord_name, y_coord_name, ll_x, ur_x, ll_y, ur_y):
@@ -507,7 +548,7 @@ def _transform_rotated_extent_if_needed(ds, variable, x_coord_name, y_coord_name
         if not proj4_str:
             return ll_x, ur_x, ll_y, ur_y
 
-        logger.debug(f"Transforming rotated extent for {variable} from {proj4_str}")
+        logger.debug("Transforming rotated extent for %s from %s", variable, proj4_str)
 
         # Create CRS objects
         crs_rotated = CRS.from_proj4(proj4_str)
@@ -529,12 +570,12 @@ def _transform_rotated_extent_if_needed(ds, variable, x_coord_name, y_coord_name
         min_lat = min(lat_ll, lat_ur, lat_ul, lat_lr)
         max_lat = max(lat_ll, lat_ur, lat_ul, lat_lr)
 
-        logger.debug(f"Transformed extent: {min_lon} {min_lat} {max_lon} {max_lat}")
+        logger.debug("Transformed extent: %s %s %s %s", min_lon, min_lat, max_lon, max_lat)
 
         return min_lon, max_lon, min_lat, max_lat
 
     except Exception as e:
-        logger.debug(f"Failed to transform rotated extent: {e}")
+        logger.debug("Failed to transform rotated extent: %s", e)
         # Return original extent if transformation fails
         return ll_x, ur_x, ll_y, ur_y
 
@@ -587,67 +628,9 @@ def _find_dim_names(ds, variable):
     #return ll_x,ur_x,ll_y,ur_y
 
 def find_time_diff(ds, dim_name):
-    prev = None
-    diff = None
-    prev_diff = None
-    is_range = True
-    diff_string = None
-    if len(ds[dim_name].dt.year.data) == 1:
-        logger.debug(f"Time diff len {len(ds[dim_name].dt.year.data)}")
-        is_range = False
-    else:
-        for y,m,d,h,minute,s in zip(ds[dim_name].dt.year.data, ds[dim_name].dt.month.data, ds[dim_name].dt.day.data, ds[dim_name].dt.hour.data, ds[dim_name].dt.minute.data, ds[dim_name].dt.second.data):
-            stamp = datetime.datetime(y, m, d, h, minute, s)
-            if prev:
-                year_diff = stamp.year - prev.year
-                diff = stamp - prev
-                logger.debug(f"Year diff: {year_diff} {type(year_diff)}")
-                if year_diff > 0:
-                    logger.debug(f"Possible 1 or more years between stamps and possible years range: {prev} {stamp}")
-                    _y, _m, _d, _h, _min, _s, _f = (prev.year, prev.month, prev.day, prev.hour, prev.minute, prev.second, prev.microsecond)
-                    if _m == 1 and _d == 1 and _h == 0 and _min == 0 and _s == 0 and _f == 0:
-                        year_stamp = datetime.datetime(_y + year_diff, _m, _d, _h, _min, _s)
-                        logger.debug(f"prev {prev} year_stamp {year_stamp} stamp {stamp}")
-                        if year_stamp == stamp:
-                            diff = f"P{year_diff}Y"
-                        else:
-                            logger.debug("Can not find year diff. Can not use range.")
-                            is_range = False
-                            break
-                    else:
-                        logger.debug("Can not find year diff. Can not use range.")
-                        is_range = False
-                        break
-                if prev_diff and diff >= datetime.timedelta(days=28) and diff <= datetime.timedelta(days=31) and prev + diff == stamp:
-                    logger.debug(f"Possible monthly range: {prev} {stamp}")
-                    diff = "P1M"
-                elif prev_diff and diff != prev_diff:
-                    logger.debug(f"DIFF {diff} PREV_DIFF {prev_diff}")
-                    logger.debug(f"Stamp {stamp} PREV {prev}")
-                    # Diff between more than three stamps are different. Can not use range.
-                    is_range = False
-                    break
-                prev_diff = diff
-            prev = stamp
-    if is_range:
-        diff_string = _get_time_diff(diff)
-        logger.debug(f"DIFF STRING {diff_string}")
-    else:
-        logger.debug("Is not range")
-    return diff,diff_string,is_range
-
-def _get_time_diff(diff):
-    if isinstance(diff, str) and (diff == 'P1M' or (diff.startswith('P') and diff.endswith('Y'))):
-        diff_string = diff
-    elif diff < datetime.timedelta(hours=1):
-        h = int(diff.seconds/60)
-        diff_string = f"PT{h}M"
-    elif diff < datetime.timedelta(hours=24):
-        h = int(diff.seconds/3600)
-        diff_string = f"PT{h}H"
-    else:
-        diff_string = f"P{diff.days}D"
-    return diff_string
+    """Return diff, diff_string and is_range of the time axis dim_name in ds."""
+    axis = time_axis(ds, dim_name)
+    return axis['diff'], axis['diff_string'], axis['is_range']
 
 def _compute_optimal_bb_area_from_lonlat(ds, shared_cache, netcdf_file):
     resample = False
@@ -673,30 +656,20 @@ def _compute_optimal_bb_area_from_lonlat(ds, shared_cache, netcdf_file):
     raise KeyError
 
 def _read_netcdfs_from_ncml(ncml_file):
-    # ncml_netcdf_files = []
-    # xtree = etree.parse(netcdf_file)
-    # for f in xtree.findall(".//{http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2}netcdf"):
-    #     ncml_netcdf_files.append(f.attrib['location'])
-    # Parse the XML content
-    root = etree.parse(ncml_file).getroot()
-
-    # Define the namespace
-    ns = {'nc': 'http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2'}
-
-    # Find the 'netcdf' elements
-    netcdf_paths = []
-    for netcdf in root.xpath('//nc:netcdf/nc:aggregation/nc:netcdf', namespaces=ns):
-        netcdf_paths.append(netcdf.get('location'))
-    return netcdf_paths
-
-def _hex_to_rgb(value: str):
-    """
-    Takes a string hex value eg. "#002147" and returns a tuple rgb (0, 33, 71)
-    Usage:
-        rgb_tuple = hex_to_rgb("#002147")
-    """
-    value = value.lstrip("#")
-    return tuple(bytes.fromhex(value))
+    return read_ncml_members(ncml_file)
+
+def _set_time_extent(layer, ds, dim_name, shared_cache, netcdf_file):
+    """Set wms_timeextent as a range if possible, else as a list. Returns the first time."""
+    if netcdf_file.endswith('ncml'):
+        logger.debug("Use the time axis from all files in the ncml.")
+        ds = ncml_aggregation(netcdf_file, shared_cache).time_dataset()
+    axis = time_axis(ds, dim_name, shared_cache, netcdf_file)
+    if axis['is_range']:
+        layer.metadata.set("wms_timeextent", f"{axis['start_time']}/{axis['end_time']}/{axis['diff_string']}")
+    else:
+        logger.debug("Use time list.")
+        layer.metadata.set("wms_timeextent", f'{",".join(axis["time_list"])}')
+    return axis['start_time']
 
 def _generate_getcapabilities(layer, ds, variable, shared_cache, netcdf_file, last_ds=None, netcdf_files=[], product_config=None):
     """Generate getcapabilities for the netcdf file."""
@@ -716,11 +689,12 @@ def _generate_getcapabilities(layer, ds, variable, shared_cache, netcdf_file, la
     else:
         try:
             ll_x, ur_x, ll_y, ur_y = _extract_extent(ds, variable, transform_rotated=True)
-            logger.debug(f"ll_x, ur_x, ll_y, ur_y {ll_x} {ur_x} {ll_y} {ur_y}")
+            logger.debug("ll_x, ur_x, ll_y, ur_y %s %s %s %s", ll_x, ur_x, ll_y, ur_y)
         except HTTPError as e:
-            logger.debug(f"Skipping variable {variable} in GetCapabilities due to missing spatial extent: {e}")
+            logger.debug("Skipping variable %s in GetCapabilities due to missing spatial extent: %s", variable, e)
             return None
-    logger.debug(f"Style before set capabilities projection: {grid_mapping_name}, {shared_cache[grid_mapping_name]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Style before set capabilities projection: %s, %s", grid_mapping_name, shared_cache[grid_mapping_name])
     layer.setProjection(shared_cache[grid_mapping_name])
     if "units=km" in shared_cache[grid_mapping_name]:
         layer.units = mapscript.MS_KILOMETERS
@@ -738,14 +712,14 @@ def _generate_getcapabilities(layer, ds, variable, shared_cache, netcdf_file, la
             wms_title += f": {ds[variable].attrs['short_name']}"
         except (AttributeError, KeyError):
             pass
-    logger.debug(f"wms_title {wms_title}")
+    logger.debug("wms_title %s", wms_title)
     layer.metadata.set("wms_title", f"{wms_title}")
 
     ll_x, ll_y, ur_x, ur_y = _adjust_extent_to_units(ds, variable, shared_cache, grid_mapping_name, ll_x, ll_y, ur_x, ur_y)
     layer.metadata.set("wms_extent", f"{ll_x} {ll_y} {ur_x} {ur_y}")
     dims_list = []
     if 'time' not in ds[variable].dims:
-        logger.debug(f"variable {variable} do not contain time variable. wms_timeextent as dimension is not added.")
+        logger.debug("variable %s do not contain time variable. wms_timeextent as dimension is not added.", variable)
         # It makes no sense to add time dimension to a variable without timedimension. It can never be found.
         # Removed from code 2024-10-23
         # try:
@@ -757,34 +731,10 @@ def _generate_getcapabilities(layer, ds, variable, shared_cache, netcdf_file, la
     for dim_name in ds[variable].dims:
         if dim_name in ['x', 'X', 'Xc', 'xc', 'y', 'Y', 'Yc', 'yc', 'longitude', 'latitude', 'lon', 'lat', 'rlon', 'rlat']:
             continue
-        logger.debug(f"Checking dimension: {dim_name}")
+        logger.debug("Checking dimension: %s", dim_name)
         if dim_name in 'time':
             logger.debug("handle time")
-            if netcdf_file.endswith('ncml'):
-                logger.debug("Need to handle ncml time from all files.")
-                last_time = pd.to_datetime(last_ds['time'].data).to_pydatetime()
-                first_time = pd.to_datetime(ds['time'].data).to_pydatetime()
-                diff = (last_time-first_time)/(len(netcdf_files)-1)
-                if len(diff) == 1:
-                    diff_string = _get_time_diff(diff[0])
-                    start_time = first_time[0].strftime('%Y-%m-%dT%H:%M:%SZ')
-                    end_time = last_time[0].strftime('%Y-%m-%dT%H:%M:%SZ')
-                    layer.metadata.set("wms_timeextent", f'{start_time}/{end_time}/{diff_string}')
-                else:
-                    logger.error("Can not calucale wms timeextent in from ncml.")
-            else:
-                _, diff_string, is_range = find_time_diff(ds, dim_name)
-                if is_range:
-                    start_time = min(ds[dim_name].dt.strftime('%Y-%m-%dT%H:%M:%SZ').data)
-                    end_time = max(ds[dim_name].dt.strftime('%Y-%m-%dT%H:%M:%SZ').data)
-                    layer.metadata.set("wms_timeextent", f'{start_time:}/{end_time}/{diff_string}')
-                else:
-                    logger.debug("Use time list.")
-                    time_list = []
-                    for d in ds['time'].dt.strftime('%Y-%m-%dT%H:%M:%SZ'):
-                        time_list.append(f"{str(d.data)}")
-                    start_time = time_list[0]
-                    layer.metadata.set("wms_timeextent", f'{",".join(time_list)}')
+            start_time = _set_time_extent(layer, ds, dim_name, shared_cache, netcdf_file)
             layer.metadata.set("wms_default", f'{start_time}')
         else:
             if ds[dim_name].data.size > 1:
@@ -797,7 +747,7 @@ def _generate_getcapabilities(layer, ds, variable, shared_cache, netcdf_file, la
                 try:
                     layer.metadata.set(f"wms_{dim_name}_units", ds[actual_dim_name].attrs['units'])
                 except KeyError:
-                    logger.debug(f"Failed to set metadata units for dimmension name {dim_name}. Forcing to 1.")
+                    logger.debug("Failed to set metadata units for dimmension name %s. Forcing to 1.", dim_name)
                     layer.metadata.set(f"wms_{dim_name}_units", '1')
                 layer.metadata.set(f"wms_{dim_name}_extent", ','.join([str(d) for d in ds[actual_dim_name].data]))
                 layer.metadata.set(f"wms_{dim_name}_default", str(max(ds[actual_dim_name].data)))
@@ -810,7 +760,7 @@ def _generate_getcapabilities(layer, ds, variable, shared_cache, netcdf_file, la
             for style_config in product_config['styles']:
                 if style_config['name'] == variable:
                     layer.classgroup = style_config['name']
-                    set_styles(layer, style_config)
+                    set_styles(layer, style_config, product_config)
                     break
             else:
                 logger.error(f"Could not find style config matching layer/variable name {variable}. Please add this to the config. No style for this layer is added.")
@@ -838,141 +788,31 @@ def _generate_getcapabilities(layer, ds, variable, shared_cache, netcdf_file, la
 
     return True
 
-def count_digits_total_and_decimal(number):
-    number_is_negative = False
-    decimal_is_zero = False
-    if number < 0:
-        number_is_negative = True
-    # Ensure the number is positive for counting (ignore sign)
-    number = abs(number)
-
-    # Convert to string to handle the integer and decimal parts separately
-    num_str = str(number)
-
-    # Split the number into integer and decimal parts
-    is_decimal = False
-    if '.' in num_str:
-        base, decimal = num_str.split('.')  # Split into base and decimal parts
-        is_decimal = True
-
-        if decimal == "0":
-            decimal_is_zero = True
-    else:
-        base, decimal = num_str, ""  # No decimal part present
-
-    # Count digits in base and decimal parts
-    base_count = len(base)
-    decimal_count = len(decimal)
-    #total_count = add_place + base_count + is_decimal + decimal_count
-    return number_is_negative, base_count, is_decimal, decimal_count, decimal_is_zero
-
-def total_and_decimal_count(color_intervals):
-    numbers_is_negative = []
-    base_counts = []
-    is_decimals = []
-    decimal_counts = []
-    decimals_is_zero = []
-    for color_interval in color_intervals:
-        number_is_negative, base_count, is_decimal, decimal_count, decimal_is_zero = count_digits_total_and_decimal(color_interval)
-        numbers_is_negative.append(number_is_negative)
-        base_counts.append(base_count)
-        is_decimals.append(is_decimal)
-        decimal_counts.append(decimal_count)
-        decimals_is_zero.append(decimal_is_zero)
-
-    if all(decimals_is_zero):
-        # all of the numbers has 0 as decimal. Only use the integer part.
-        logger.debug("All decimals is 0. Don't include the decimals.")
-        total_count = max(numbers_is_negative) + max(base_counts)
-        decimal_count = 0
-    else:
-        #One or more number has not 0 as decimal.
-        logger.debug("One or more decimals is not 0. Include the decimals.")
-        total_count = max(numbers_is_negative) + max(base_counts) + max(is_decimals) + max(decimal_counts)
-        decimal_count = max(decimal_counts)
-
-    return total_count, decimal_count
-
-def set_styles(layer, style_config):
-    prev_color_interval = style_config['intervals'][0]
-    total_count, decimal_count = total_and_decimal_count(style_config['intervals'])
-    if not style_config.get('legend_digit_format'):
-        logger.warning("Missing legend_digit_format. Tries to detect from values")
-        if isinstance(prev_color_interval, float):
-            style_config['legend_digit_format'] = f'{total_count}.{decimal_count}f'
-        elif isinstance(prev_color_interval, int):
-            style_config['legend_digit_format'] = f'{total_count}d'
-        else:
-            logger.warning("Could not detect. Set empty")
-            style_config['legend_digit_format'] = ''
-        logger.debug(f"Styling legent_digit_format is set to: {style_config['legend_digit_format']}")
-    interval_start = 1
-    interval_color_start = 0
-    interval_color_end = len(style_config['colors'])
-    if style_config['open_highest_interval']:
-        interval_color_end = len(style_config['colors']) - 1
-    extra_space_front = " " * total_count
-    if style_config['open_lowest_interval']:
-        # when looping in the next step skip the first interval since this is handled here.
-        logging.debug(f"open_lowest_interval {extra_space_front} < {prev_color_interval:{style_config['legend_digit_format']}}")
-        interval_start = 1
-        interval_color_start = 1
+@timed('style_build')
+def set_styles(layer, style_config, product_config=None):
+    """Add the classes of the style to the layer from the style template compiled at config read."""
+    template = style_template(style_config, product_config)
+    for style_class in template.classes:
         s = mapscript.classObj(layer)
-        s.name = f"{extra_space_front} < {prev_color_interval:{style_config['legend_digit_format']}}"
-        s.group = style_config['name']
-        s.setExpression(f'([pixel]<{prev_color_interval:0.1f})')
+        s.name = style_class.name
+        s.group = style_class.group
+        s.setExpression(style_class.expression)
         _style = mapscript.styleObj(s)
-        color = style_config['colors'][0]
-        rgb = _hex_to_rgb(color)
-        _style.color = mapscript.colorObj(*rgb)
-    interval_for_loop_run = False
-    for color_interval, color in zip(style_config['intervals'][interval_start:], style_config['colors'][interval_color_start:interval_color_end]):
-        logging.debug(f"interval {prev_color_interval:{style_config['legend_digit_format']}} - {color_interval:{style_config['legend_digit_format']}}")
-        s = mapscript.classObj(layer)
-        s.group = style_config['name']
-        s.name = f"{prev_color_interval:{style_config['legend_digit_format']}} - {color_interval:{style_config['legend_digit_format']}}"
-        if color_interval == style_config['intervals'][-1]:
-            # Is last interval, need to include the end point/max val
-            s.setExpression(f'([pixel]>={prev_color_interval:0.1f} and [pixel]<={color_interval:0.1f})')
-        else:
-            s.setExpression(f'([pixel]>={prev_color_interval:0.1f} and [pixel]<{color_interval:0.1f})')
-
-        _style = mapscript.styleObj(s)
-        rgb = _hex_to_rgb(color)
-        _style.color = mapscript.colorObj(*rgb)
-        prev_color_interval = color_interval
-        interval_for_loop_run = True
-    # If the interval size is 1 the for loop above is not run. Need to specify the color_interval here.
-    if len(style_config['intervals']) == 1 and not interval_for_loop_run:
-        color_interval = style_config['intervals'][0]
-    if style_config['open_highest_interval']:
-        if len(style_config['intervals']) == 1:
-            logging.debug(f"open_highest_interval {color_interval:{style_config['legend_digit_format']}} <= ")
-        else:
-            logging.debug(f"open_highest_interval {color_interval:{style_config['legend_digit_format']}} < ")
-        s = mapscript.classObj(layer)
-        if len(style_config['intervals']) == 1:
-            s.name = f"{extra_space_front} >= {color_interval:{style_config['legend_digit_format']}}"
-            s.setExpression(f'([pixel]>={color_interval:0.1f})')
-        else:
-            s.name = f"{extra_space_front} > {color_interval:{style_config['legend_digit_format']}}"
-            s.setExpression(f'([pixel]>{color_interval:0.1f})')
-        s.group = style_config['name']
-        _style = mapscript.styleObj(s)
-        color = style_config['colors'][-1]
-        rgb = _hex_to_rgb(color)
-        _style.color = mapscript.colorObj(*rgb)
+        _style.color = mapscript.colorObj(*style_class.rgb)
+    if template.lut_scale:
+        logger.debug("Classify style %s by lookup table with scale %s", template.name, template.lut_scale)
+        set_lut_processing(layer, template.lut_scale)
 
 def _adjust_extent_to_units(ds, variable, shared_cache, grid_mapping_name, ll_x, ll_y, ur_x, ur_y):
     dim_name = _find_dim_names(ds, variable)
     try:
         if "units=m" in shared_cache[grid_mapping_name]:
             if ds[variable].coords[dim_name[0]].attrs['units'] == 'km':
-                logger.debug(f"adjust extent to units VARIBLE: {variable} {dim_name[0]} from km to m")
+                logger.debug("adjust extent to units VARIBLE: %s %s from km to m", variable, dim_name[0])
                 ll_x *= 1000
                 ur_x *= 1000
             if ds[variable].coords[dim_name[1]].attrs['units'] == 'km':
-                logger.debug(f"adjust extent to units VARIBLE: {variable} {dim_name[1]} from km to m")
+                logger.debug("adjust extent to units VARIBLE: %s %s from km to m", variable, dim_name[1])
                 ll_y *= 1000
                 ur_y *= 1000
     except (KeyError, AttributeError, IndexError):
@@ -1032,31 +872,7 @@ def _generate_getcapabilities_vector(layer, ds, variable, shared_cache, netcdf_f
             continue
         if dim_name in 'time':
             logger.debug("handle time")
-            if netcdf_file.endswith('ncml'):
-                logger.debug("Need to handle ncml time from all files.")
-                last_time = pd.to_datetime(last_ds['time'].data).to_pydatetime()
-                first_time = pd.to_datetime(ds['time'].data).to_pydatetime()
-                diff = (last_time-first_time)/(len(netcdf_files)-1)
-                if len(diff) == 1:
-                    diff_string = _get_time_diff(diff[0])
-                    start_time = first_time[0].strftime('%Y-%m-%dT%H:%M:%SZ')
-                    end_time = last_time[0].strftime('%Y-%m-%dT%H:%M:%SZ')
-                    layer.metadata.set("wms_timeextent", f'{start_time}/{end_time}/{diff_string}')
-                else:
-                    logger.error("Can not calucale wms timeextent in from ncml.")
-            else:
-                _, diff_string, is_range = find_time_diff(ds, dim_name)
-                if is_range:
-                    start_time = min(ds[dim_name].dt.strftime('%Y-%m-%dT%H:%M:%SZ').data)
-                    end_time = max(ds[dim_name].dt.strftime('%Y-%m-%dT%H:%M:%SZ').data)
-                    layer.metadata.set("wms_timeextent", f'{start_time:}/{end_time}/{diff_string}')
-                else:
-                    logger.debug("Use time list.")
-                    time_list = []
-                    for d in ds['time'].dt.strftime('%Y-%m-%dT%H:%M:%SZ'):
-                        time_list.append(f"{str(d.data)}")
-                    start_time = time_list[0]
-                    layer.metadata.set("wms_timeextent", f'{",".join(time_list)}')
+            start_time = _set_time_extent(layer, ds, dim_name, shared_cache, netcdf_file)
             layer.metadata.set("wms_default", f'{start_time}')
         else:
             if ds[dim_name].data.size > 1:
@@ -1103,7 +919,10 @@ def _generate_getcapabilities_vector(layer, ds, variable, shared_cache, netcdf_f
 
     return True
 
-def _find_dimensions(ds, actual_variable, variable, qp, netcdf_file, last_ds):
+@timed('dimensions')
+def _find_dimensions(ds, actual_variable, variable, qp, netcdf_file, last_ds, shared_cache=None, product_config=None):
+    nearest = bool((product_config or {}).get('dimension_nearest_match', False))
+    tolerance = float((product_config or {}).get('dimension_tolerance', 0))
     # Find available dimension not larger than 1
     dimension_search = []
     for dim_name in ds[actual_variable].dims:
@@ -1113,59 +932,46 @@ def _find_dimensions(ds, actual_variable, variable, qp, netcdf_file, last_ds):
             if _dim_name == 'height' or _dim_name == 'dim_height':
                 logger.debug(f"Can not have a dimension name height as this will conflict with query parameter HEIGHT as the size in image.")
                 _dim_name = _dim_name + '_dimension'
-            logger.debug(f"search for dim_name {_dim_name} in query parameters.")
+            logger.debug("search for dim_name %s in query parameters.", _dim_name)
             if _dim_name in qp:
-                logger.debug(f"Found dimension {_dim_name} in request")
+                logger.debug("Found dimension %s in request", _dim_name)
                 if dim_name == 'time':
                     _ds = {}
                     _ds['dim_name'] = dim_name
                     _ds['ds_size'] = ds[dim_name].data.size
                     requested_dimensions = datetime.datetime.strptime(qp[_dim_name], "%Y-%m-%dT%H:%M:%SZ")
                     time_as_band = 0
-                    if last_ds and netcdf_file.endswith('ncml'):
+                    if netcdf_file.endswith('ncml'):
                         logger.debug("Must find netcdf file for data")
-                        ncml_netcdf_files = _read_netcdfs_from_ncml(netcdf_file)
-                        last_time = pd.to_datetime(last_ds['time'].data).to_pydatetime()
-                        first_time = pd.to_datetime(ds['time'].data).to_pydatetime()
-                        diff = ((last_time-first_time)/(len(ncml_netcdf_files)-1))[0]
-                        time_stamp = first_time[0]
-                        for i in range(len(ncml_netcdf_files)):
-                            logger.debug(f"Checking {time_as_band} {time_stamp.strftime('%Y-%m-%dT%H:%M:%SZ')} {requested_dimensions.strftime('%Y-%m-%dT%H:%M:%SZ')}")
-                            if time_stamp == requested_dimensions:
-                                logger.debug(f"{time_stamp.strftime('%Y-%m-%dT%H:%M:%SZ')} {requested_dimensions.strftime('%Y-%m-%dT%H:%M:%SZ')} {requested_dimensions.timestamp()}")
-                                break
-                            time_as_band += 1
-                            time_stamp += diff
+                        aggregation = ncml_aggregation(netcdf_file, shared_cache if shared_cache is not None else {})
+                        try:
+                            member, time_as_band = aggregation.lookup(requested_dimensions)
+                        except KeyError:
+                            logger.error(f"status_code=500, Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
+                            raise HTTPError(response_code='500 Internal Server Error', response=f"Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
+                        logger.debug("Selected netcdf in list in ncml %s with time index %s", member, time_as_band)
+                        _ds['ds_size'] = aggregation.member_time_size(member)
+                        _ds['ncml_file'] = member
                     else:
                         try:
-                            time_as_band = ds.indexes["time"].get_loc(requested_dimensions.strftime('%Y-%m-%d %H:%M:%S'))
-                            logger.debug(f"{time_as_band} {requested_dimensions.strftime('%Y-%m-%dT%H:%M:%SZ')} {requested_dimensions.timestamp()}")
+                            time_as_band = dimension_index(ds, dim_name, shared_cache, netcdf_file).lookup(
+                                requested_dimensions, tolerance=tolerance, nearest=nearest)
+                            logger.debug("%s %s", time_as_band, requested_dimensions.strftime('%Y-%m-%dT%H:%M:%SZ'))
                         except KeyError as ke:
                             logger.error(f"status_code=500, Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
                             raise HTTPError(response_code='500 Internal Server Error', response=f"Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
-                        # for d in ds['time'].dt.strftime('%Y-%m-%dT%H:%M:%SZ'):
-                        #     logger.debug(f"Checking {time_as_band} {datetime.datetime.strptime(str(d.data), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc).timestamp()} {d.data} {requested_dimensions.strftime('%Y-%m-%dT%H:%M:%SZ')}")
-                        #     if d == requested_dimensions.strftime('%Y-%m-%dT%H:%M:%SZ'):
-                        #         logger.debug(f"{d} {requested_dimensions.strftime('%Y-%m-%dT%H:%M:%SZ')} {requested_dimensions.timestamp()}")
-                        #         break
-                        #     time_as_band += 1
-                        # else:
-                        #     logger.error(f"status_code=500, Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
-                        #     raise HTTPError(response_code='500 Internal Server Error', response=f"Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
                     _ds['selected_band_number'] = time_as_band
                     dimension_search.append(_ds)
                 else:
-                    logger.debug(f"other dimension {dim_name}")
+                    logger.debug("other dimension %s", dim_name)
                     _ds = {}
                     _ds['dim_name'] = dim_name
                     _ds['ds_size'] = ds[dim_name].data.size
-                    selected_band_no = 0
-                    for d in ds[dim_name].data:
-                        logger.debug(f"compare dim value {d} to req value {qp[_dim_name]}")
-                        if float(d) == float(qp[_dim_name]):
-                            break
-                        selected_band_no += 1
-                    else:
+                    try:
+                        selected_band_no = dimension_index(ds, dim_name, shared_cache, netcdf_file).lookup(
+                            qp[_dim_name], tolerance=tolerance, nearest=nearest)
+                        logger.debug("dim value %s selected for req value %s", ds[dim_name].data[selected_band_no], qp[_dim_name])
+                    except (KeyError, ValueError):
                         logger.error(f"status_code=500, Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
                         raise HTTPError(response_code='500 Internal Server Error', response=f"Could not find matching dimension {dim_name} {qp[_dim_name]} value for layer {variable}.")
                     _ds['selected_band_number'] = selected_band_no
@@ -1173,7 +979,7 @@ def _find_dimensions(ds, actual_variable, variable, qp, netcdf_file, last_ds):
                 break
             else:
                 if ds[dim_name].data.size == 1:
-                    logger.debug(f"Dimension with size 0 {dim_name}")
+                    logger.debug("Dimension with size 0 %s", dim_name)
                     _ds = {}
                     _ds['dim_name'] = dim_name
                     _ds['ds_size'] = ds[dim_name].data.size
@@ -1181,19 +987,32 @@ def _find_dimensions(ds, actual_variable, variable, qp, netcdf_file, last_ds):
                     dimension_search.append(_ds)
                     break
         else:
-            logger.debug(f"Could not find {_dim_name}. Make some ugly assumption")
+            logger.debug("Could not find %s. Make some ugly assumption", _dim_name)
             _ds = {}
             _ds['dim_name'] = dim_name
             _ds['ds_size'] = ds[dim_name].data.size
             _ds['selected_band_number'] = 0
             dimension_search.append(_ds)
-    logger.debug(f"Dimension Search: {dimension_search}")
+    logger.debug("Dimension Search: %s", dimension_search)
     return dimension_search
 
+def _min_max_by_dimension_name(ds, actual_variable, dimension_search):
+    """Min and max of the selected slice of the variable, selected by dimension name."""
+    try:
+        data = ds[actual_variable].isel({_ds['dim_name']: _ds['selected_band_number'] for _ds in dimension_search}).data
+    except (IndexError, ValueError) as e:
+        logger.error(f"status_code=500, Failed to select {actual_variable} to find min and max: {str(e)}.")
+        raise HTTPError(response_code='500 Internal Server Error',
+                        response=f"Failed to select {actual_variable} to find min and max.")
+    data = np.ma.masked_invalid(data, copy=False)
+    if '_FillValue' in ds[actual_variable].attrs:
+        data = np.ma.masked_equal(data, ds[actual_variable].attrs['_FillValue'], copy=False)
+    return data.min(), data.max()
+
 def _calc_band_number_from_dimensions(dimension_search):
     band_number = 0
     first = True
-    logger.debug(f"Calculate band number from dimension: {dimension_search}")
+    logger.debug("Calculate band number from dimension: %s", dimension_search)
     #dimension_search.reverse()
     for _ds in dimension_search[::-1]:
         if first:
@@ -1206,7 +1025,7 @@ def _calc_band_number_from_dimensions(dimension_search):
     if band_number == 0 and len(dimension_search) == 0:
         logger.warning("Could not calculate band number from empty dimension search. Use 1.")
         band_number = 1
-    logger.debug(f"selected band number {band_number}")
+    logger.debug("selected band number %s", band_number)
     return band_number
 
 def _add_wind_barb(map_obj, layer, colour_tripplet, min, max):
@@ -1252,6 +1071,89 @@ def _add_wind_barb_100_150(map_obj, layer, colour_tripplet, min, max):
     style_base.setSymbolByName(map_obj, f"wind_barb_{min+2}")
     return
 
+def _vector_point_features(ds_xy, actual_x_variable, actual_y_variable, qp, grid_proj):
+    """Decimated wind barb/vector point features, or None to use the UVRASTER layer."""
+    x_vector = ds_xy[actual_x_variable]
+    y_vector = ds_xy[actual_y_variable]
+    if x_vector.ndim != 2:
+        logger.debug("Vector features need 2 dimensions, got %s. Use UVRASTER.", x_vector.dims)
+        return None
+    y_dim, x_dim = x_vector.dims
+    try:
+        x_coords = np.asarray(ds_xy[x_dim].data, dtype=np.float64)
+        y_coords = np.asarray(ds_xy[y_dim].data, dtype=np.float64)
+    except KeyError:
+        logger.debug("Missing x and y coordinates for vector features. Use UVRASTER.")
+        return None
+    if "units=m" in grid_proj:
+        if ds_xy[x_dim].attrs.get('units') == 'km':
+            x_coords = x_coords * 1000
+        if ds_xy[y_dim].attrs.get('units') == 'km':
+            y_coords = y_coords * 1000
+    bbox = None
+    try:
+        bbox = [float(b) for b in qp['bbox'].split(',')]
+        if 'crs' in qp:
+            bbox = bbox_in_grid_crs(bbox, qp['crs'], grid_proj, always_xy=False)
+        elif 'srs' in qp:
+            bbox = bbox_in_grid_crs(bbox, qp['srs'], grid_proj, always_xy=True)
+    except (KeyError, ValueError):
+        bbox = None
+    try:
+        width = int(qp['width'])
+        height = int(qp['height'])
+    except (KeyError, ValueError):
+        width = height = None
+    spacing = qp.get('spacing', qp.get('dim_spacing', 12))
+    try:
+        spacing = int(spacing)
+    except ValueError:
+        spacing = 12
+    y_index, x_index = decimate(x_coords, y_coords, bbox, width, height, spacing)
+    features = point_features(x_coords, y_coords, x_vector.data, y_vector.data, y_index, x_index)
+    logger.debug("Vector features: %s points", features['x'].size)
+    return features
+
+def _add_vector_features(layer, map_obj, features, style, colour_tripplet):
+    """Add the point features inline to the layer with classes on the flag count.
+
+    The barb symbol and angle are bound to the feature attributes, so
+    no speed expression is evaluated when drawing.
+    """
+    layer.setConnectionType(mapscript.MS_INLINE, "")
+    layer.setProcessingKey('ITEMS', ','.join(FEATURE_ITEMS))
+    for i in range(features['x'].size):
+        shape = mapscript.shapeObj(mapscript.MS_SHAPE_POINT)
+        line = mapscript.lineObj()
+        line.add(mapscript.pointObj(float(features['x'][i]), float(features['y'][i])))
+        shape.add(line)
+        shape.initValues(len(FEATURE_ITEMS))
+        for item_no, item in enumerate(FEATURE_ITEMS):
+            shape.setValue(item_no, str(features[item][i]))
+        layer.addFeature(shape)
+    if style.lower() == "wind_barbs":
+        layer.classitem = "flags"
+        s = mapscript.classObj(layer)
+        s.setExpression('calm')
+        _style = mapscript.styleObj(s)
+        _style.updateFromString(f'STYLE SYMBOL [barb] ANGLE [uv_angle] SIZE 20 WIDTH 1 COLOR {colour_tripplet} OUTLINECOLOR {colour_tripplet} END')
+        for flags, polar_offsets in (('0', []), ('1', [-24]), ('2', [-24, -12])):
+            s = mapscript.classObj(layer)
+            s.setExpression(flags)
+            for polar_offset in polar_offsets:
+                style_flag = mapscript.styleObj(s)
+                style_flag.updateFromString(f'STYLE SYMBOL "wind_barb_50_flag" ANGLE [uv_angle] SIZE 20 WIDTH 1 COLOR {colour_tripplet} POLAROFFSET {polar_offset} [uv_angle] END')
+                style_flag.setSymbolByName(map_obj, "wind_barb_50_flag")
+            _style = mapscript.styleObj(s)
+            _style.updateFromString(f'STYLE SYMBOL [barb] ANGLE [uv_angle] SIZE 20 WIDTH 1 COLOR {colour_tripplet} END')
+    elif style.lower() == "vector":
+        s = mapscript.classObj(layer)
+        _style = mapscript.styleObj(s)
+        _style.updateFromString(f'STYLE SYMBOL "vector_arrow" ANGLE [uv_angle] SIZE [uv_length] WIDTH 3 COLOR {colour_tripplet} END')
+        _style.setSymbolByName(map_obj, "vector_arrow")
+    else:
+        logger.debug("Unknown style %s. Check your request.", style)
+
 def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_config, last_ds=None):
     try:
         variable = qp['layer']
@@ -1271,7 +1173,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
     elif style == "":
         if product_config.get('styles'):
             try:
-                logger.debug(f"Selects the first as default as none is given: {product_config['styles'][0]['name']}")
+                logger.debug("Selects the first as default as none is given: %s", product_config['styles'][0]['name'])
                 style = product_config['styles'][0]['name'].lower()
             except (KeyError, IndexError) as err:
                 logging.exception(f"Styles not properly defined in product config: {product_config} with {err}")
@@ -1282,7 +1184,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         else:
             logger.debug("Empty style. Force raster.")
             style = 'raster'
-    logger.debug(f"Selected style: {style}")
+    logger.debug("Selected style: %s", style)
     actual_variable = variable
     #if style in 'contour': #variable.endswith('_contour'):
     #    actual_variable = '_'.join(variable.split("_")[:-1])
@@ -1291,19 +1193,20 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         actual_y_variable = '_'.join(['y'] + variable.split("_")[:-1])
         vector_variable_name = variable
         actual_variable = actual_x_variable
-        logger.debug(f"VECTOR {vector_variable_name} {actual_x_variable} {actual_y_variable}")
+        logger.debug("VECTOR %s %s %s", vector_variable_name, actual_x_variable, actual_y_variable)
     if variable.endswith("_vector_from_direction_and_speed"):
         actual_x_variable = 'wind_speed'  # Not accurate, used to find crs and other proj info
         actual_y_variable = 'wind_direction'  # Not accurate, used to find crs and other proj info
         vector_variable_name = variable
         actual_variable = actual_x_variable
-        logger.debug(f"VECTOR {vector_variable_name} {actual_x_variable} {actual_y_variable}")
+        logger.debug("VECTOR %s %s %s", vector_variable_name, actual_x_variable, actual_y_variable)
 
 
     try:
         grid_mapping_name = _find_projection(ds, actual_variable, shared_cache, netcdf_file, product_config)
 
-        dimension_search = _find_dimensions(ds, actual_variable, variable, qp, netcdf_file, last_ds)
+        dimension_search = _find_dimensions(ds, actual_variable, variable, qp, netcdf_file, last_ds, shared_cache,
+                                            product_config)
     except KeyError as ke:
         logger.error(f"status_code=500, Failed with: {str(ke)}.")
         raise HTTPError(response_code='500 Internal Server Error', response=f"Failed with: {str(ke)}.")
@@ -1311,21 +1214,22 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         logger.error(f"status_code=500, Failed with: {str(ke)}.")
         raise HTTPError(response_code='500 Internal Server Error', response=f"Failed with: {str(ke)}.")
 
+    ncml_member = None
+    if netcdf_file.endswith('ncml'):
+        # Dimension search for time holds the member file and the index in it.
+        # From here on only the member file is used.
+        try:
+            ncml_member = next((_ds['ncml_file'] for _ds in dimension_search if 'ncml_file' in _ds), None)
+            if ncml_member is None:
+                ncml_member = ncml_aggregation(netcdf_file, shared_cache).members[0]
+            logger.debug("Selected netcdf in list in ncml %s", ncml_member)
+            ds = open_member(ncml_member)
+        except Exception:
+            logger.error(f"status_code=500, Failed to find and open correct dataset from ncml file.")
+            raise HTTPError(response_code='500 Internal Server Error', response=f"Failed to find and open correct dataset from ncml file.")
+
     if grid_mapping_name and 'calculated_omerc' in grid_mapping_name:
         band_number = 1
-    elif netcdf_file.endswith('ncml'):
-        band_number = 0
-        first = True
-        for _ds in dimension_search[::-1]:
-            if _ds['dim_name'] == 'time':
-                continue
-            if first:
-                band_number += _ds['selected_band_number'] + 1
-            else:
-                band_number += _ds['selected_band_number']*prev_ds['ds_size']
-            first = False
-            prev_ds = _ds
-        logger.debug(f"selected band number {band_number}")
     else:
         band_number = _calc_band_number_from_dimensions(dimension_search)
     if variable.endswith('_vector') or variable.endswith("_vector_from_direction_and_speed"):
@@ -1334,7 +1238,9 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         layer.setProcessingKey('BANDS', f'{band_number}')
 
     set_scale_processing_key = False
-    logger.debug(f"Style before set layer projection: {grid_mapping_name}, {shared_cache[grid_mapping_name]}")
+    vector_features = None
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Style before set layer projection: %s, %s", grid_mapping_name, shared_cache[grid_mapping_name])
     layer.setProjection(shared_cache[grid_mapping_name])
 
     if "units=km" in shared_cache[grid_mapping_name]:
@@ -1342,22 +1248,13 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
     elif "units=m" in shared_cache[grid_mapping_name]:
         layer.units = mapscript.MS_METERS
     layer.status = 1
-    logger.debug(f"Grid mapping name: {grid_mapping_name}")
+    logger.debug("Grid mapping name: %s", grid_mapping_name)
     if variable.endswith('_vector') or variable.endswith("_vector_from_direction_and_speed"):
 
-        if netcdf_file.endswith('ncml'):
-            logger.debug("Must find netcdf file for data")
-            try:
-                ncml_netcdf_files = _read_netcdfs_from_ncml(netcdf_file)
-                logger.debug(f"Selected netcdf in list in ncml {ncml_netcdf_files[dimension_search[0]['selected_band_number']]}")
-                ds = xr.open_dataset(ncml_netcdf_files[dimension_search[0]["selected_band_number"]], mask_and_scale=False)
-            except Exception:
-                logger.error("Failed to find and opne correct dataset from ncml file.")
-        else:
-            sel_dim = {}
-            for _ds in dimension_search:
-                sel_dim[_ds['dim_name']] = _ds['selected_band_number']
-            ds = ds.isel(**sel_dim)
+        sel_dim = {}
+        for _ds in dimension_search:
+            sel_dim[_ds['dim_name']] = _ds['selected_band_number']
+        ds = ds.isel(**sel_dim)
         # ts = time.time()
         standard_name_prefix = 'wind'
         if variable.endswith("_vector_from_direction_and_speed"):
@@ -1398,18 +1295,27 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         # ts = time.time()
 
             try:
-                logger.debug(f"EPSG CRS: {qp['crs']}")
+                logger.debug("EPSG CRS: %s", qp['crs'])
                 requested_epsg = int(qp['crs'].split(':')[-1])
             except KeyError:
                 requested_epsg = 4326
-            logger.debug(f"{requested_epsg}")
+            logger.debug("%s", requested_epsg)
             # Rotate wind direction, so it relates to the north pole, rather than to the grid's y direction.            
             unique_dataset_string = generate_unique_dataset_string(ds, actual_x_variable, requested_epsg)
-            logger.debug(f"UNIQUE DS STRING {unique_dataset_string}")
+            logger.debug("UNIQUE DS STRING %s", unique_dataset_string)
             if unique_dataset_string in shared_cache:
+                cache_outcome('north', 'hit')
                 north = shared_cache[unique_dataset_string]
             else:
-                north = _get_north(actual_x_variable, ds, requested_epsg)
+                store = artefact_store.store_for(product_config)
+                north = _stored_north(store, unique_dataset_string) if store is not None else None
+                if north is not None:
+                    cache_outcome('north', 'store')
+                else:
+                    cache_outcome('north', 'miss')
+                    north = _get_north(actual_x_variable, ds, requested_epsg)
+                    if store is not None:
+                        _store_north(store, unique_dataset_string, north)
                 shared_cache[unique_dataset_string] = north
             # north = _get_north(actual_x_variable, ds, requested_epsg)
             # te = time.time()
@@ -1430,7 +1336,8 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         except KeyError:
             logger.debug("No grid mapping in dataset. Try use calculate.")
             if grid_mapping_name and 'calculated_omerc' in grid_mapping_name:
-                from pyresample import geometry, kd_tree
+                from pyresample import geometry
+                from mapgen.modules.resample_cache import resample_nearest
                 swath_def = geometry.SwathDefinition(lons=ds['longitude'], lats=ds['latitude'])
                 optimal_bb_area = swath_def.compute_optimal_bb_area()
                 cf_grid_mapping = 'oblique_mercator'
@@ -1445,8 +1352,12 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
                 ds_xy[new_x.attrs['grid_mapping']].attrs['false_easting'] = optimal_cf['false_easting']
                 ds_xy[new_x.attrs['grid_mapping']].attrs['false_northing'] = optimal_cf['false_northing']
 
-                resampled_new_x = kd_tree.resample_nearest(swath_def, new_x.data, optimal_bb_area, radius_of_influence=10000000)
-                resampled_new_y = kd_tree.resample_nearest(swath_def, new_y.data, optimal_bb_area, radius_of_influence=10000000)
+                resampled_new_x = resample_nearest(swath_def, new_x.data, optimal_bb_area, 10000000,
+                                                   cache_dir=product_config.get('resample_cache_dir'),
+                                                   store=artefact_store.store_for(product_config))
+                resampled_new_y = resample_nearest(swath_def, new_y.data, optimal_bb_area, 10000000,
+                                                   cache_dir=product_config.get('resample_cache_dir'),
+                                                   store=artefact_store.store_for(product_config))
 
                 ds_new_x = xr.DataArray(resampled_new_x,
                                         attrs=ds[actual_x_variable].attrs,
@@ -1472,7 +1383,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
             ds_xy['y'].attrs['units'] = "m"
         else:
             try:
-                logger.debug(f"Droping vars: {new_x.dims} {len(new_x.dims)}")
+                logger.debug("Droping vars: %s %s", new_x.dims, len(new_x.dims))
                 if len(new_x.dims) == 2:
                     ds_xy[actual_x_variable] = new_x
                 else:
@@ -1494,51 +1405,49 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         # logger.debug(f"{ds_xy}")
         # for netcdfs in glob.glob(os.path.join(_get_mapfiles_path(product_config), "netcdf-*")):
         #     shutil.rmtree(netcdfs)
-        tmp_netcdf = os.path.join(tempfile.mkdtemp(prefix='netcdf-', dir=_get_mapfiles_path(product_config)),
-                                  f"xy-{actual_x_variable}-{actual_y_variable}.nc")
-        ds_xy.to_netcdf(tmp_netcdf)
-        logger.debug(f"{tmp_netcdf}")
-        # for vrts in glob.glob(os.path.join(_get_mapfiles_path(product_config), "vrt-*")):
-        #     shutil.rmtree(vrts)
-
-        xvar_vrt_filename = os.path.join(tempfile.mkdtemp(prefix='vrt-', dir=_get_mapfiles_path(product_config)),
-                                         f"xvar-{actual_x_variable}-1.vrt")
-        logger.debug(f"{xvar_vrt_filename}")
-        gdal.BuildVRT(xvar_vrt_filename,
-                    [f'NETCDF:{tmp_netcdf}:{actual_x_variable}'],
-                    **{'bandList': [1]})
-        yvar_vrt_filename = os.path.join(tempfile.mkdtemp(prefix='vrt-', dir=_get_mapfiles_path(product_config)),
-                                         f"yvar-{actual_y_variable}-1.vrt")
-        gdal.BuildVRT(yvar_vrt_filename,
-                    [f'NETCDF:{tmp_netcdf}:{actual_y_variable}'],
-                    **{'bandList': [1]})
-        variable_file_vrt = os.path.join(tempfile.mkdtemp(prefix='vrt-', dir=_get_mapfiles_path(product_config)),
-                                         f'var-{actual_x_variable}-{actual_y_variable}-{band_number}.vrt')
-        gdal.BuildVRT(variable_file_vrt,
-                      [f'NETCDF:{tmp_netcdf}:{actual_x_variable}', f'NETCDF:{tmp_netcdf}:{actual_y_variable}'],
-                     #[xvar_vrt_filename, yvar_vrt_filename],
-                     **{'bandList': [1], 'separate': True})
-        # te = time.time()
-        # logger.debug(f"save and create vrts {te - ts}")
-        layer.data = variable_file_vrt
-    elif netcdf_file.endswith('ncml'):
-        logger.debug("Must find netcdf file for data")
-        try:
-            ncml_netcdf_files = _read_netcdfs_from_ncml(netcdf_file)
-            logger.debug(f"Selected netcdf in list in ncml {ncml_netcdf_files[dimension_search[0]['selected_band_number']]}")
-            layer.data = f'NETCDF:{ncml_netcdf_files[dimension_search[0]["selected_band_number"]]}:{actual_variable}'
-        except FileNotFoundError:
-            logger.debug(f"Could not find the ncml xml input file {netcdf_file}.")
-        except Exception:
-            logger.error(f"status_code=500, Failed to parse ncml file to find individual file.")
-            raise HTTPError(response_code='500 Internal Server Error', response=f"Failed to parse ncml file to find individual file.")
+        if product_config.get('vector_rendering') == 'features':
+            vector_features = _vector_point_features(ds_xy, actual_x_variable, actual_y_variable, qp,
+                                                     shared_cache[grid_mapping_name])
+        if vector_features is None:
+            tmp_netcdf = os.path.join(new_artefact_dir(product_config, 'netcdf'),
+                                      f"xy-{actual_x_variable}-{actual_y_variable}.nc")
+            ds_xy.to_netcdf(tmp_netcdf)
+            logger.debug("%s", tmp_netcdf)
+            # for vrts in glob.glob(os.path.join(_get_mapfiles_path(product_config), "vrt-*")):
+            #     shutil.rmtree(vrts)
+
+            xvar_vrt_filename = os.path.join(new_artefact_dir(product_config, 'vrt'),
+                                             f"xvar-{actual_x_variable}-1.vrt")
+            logger.debug("%s", xvar_vrt_filename)
+            gdal.BuildVRT(xvar_vrt_filename,
+                        [f'NETCDF:{tmp_netcdf}:{actual_x_variable}'],
+                        **{'bandList': [1]})
+            yvar_vrt_filename = os.path.join(new_artefact_dir(product_config, 'vrt'),
+                                             f"yvar-{actual_y_variable}-1.vrt")
+            gdal.BuildVRT(yvar_vrt_filename,
+                        [f'NETCDF:{tmp_netcdf}:{actual_y_variable}'],
+                        **{'bandList': [1]})
+            variable_file_vrt = os.path.join(new_artefact_dir(product_config, 'vrt'),
+                                             f'var-{actual_x_variable}-{actual_y_variable}-{band_number}.vrt')
+            gdal.BuildVRT(variable_file_vrt,
+                          [f'NETCDF:{tmp_netcdf}:{actual_x_variable}', f'NETCDF:{tmp_netcdf}:{actual_y_variable}'],
+                         #[xvar_vrt_filename, yvar_vrt_filename],
+                         **{'bandList': [1], 'separate': True})
+            # te = time.time()
+            # logger.debug(f"save and create vrts {te - ts}")
+            layer.data = variable_file_vrt
+    elif ncml_member:
+        layer.data = f'NETCDF:{ncml_member}:{actual_variable}'
 
     elif 'calculated_omerc' in grid_mapping_name:
         logger.debug("Try to resample data on the fly using pyresample and using gdal vsimem to store the result.")
-        from pyresample import kd_tree, geometry
+        from pyresample import geometry
+        from mapgen.modules.resample_cache import resample_nearest
         swath_def = geometry.SwathDefinition(lons=ds['longitude'], lats=ds['latitude'])
         optimal_bb_area = swath_def.compute_optimal_bb_area()
-        resampled_variable = kd_tree.resample_nearest(swath_def, ds[actual_variable].data, optimal_bb_area, radius_of_influence=10000000)
+        resampled_variable = resample_nearest(swath_def, ds[actual_variable].data, optimal_bb_area, 10000000,
+                                              cache_dir=product_config.get('resample_cache_dir'),
+                                              store=artefact_store.store_for(product_config))
         min_val = np.nanmin(resampled_variable)
         max_val = np.nanmax(resampled_variable)
         driver = gdal.GetDriverByName('GTiff')
@@ -1597,14 +1506,15 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
                 interval = 2.5
                 smoothsia = 0.25
             else:
-                logger.debug(f"Unknown unit: {ds[actual_variable].attrs['units']}. contour interval may be of for {actual_variable}.")
+                logger.debug("Unknown unit: %s. contour interval may be of for %s.", ds[actual_variable].attrs['units'], actual_variable)
         except KeyError:
             pass
         layer.setProcessingKey('CONTOUR_INTERVAL', f'{interval}')
         layer.setProcessingKey('CONTOUR_ITEM', 'contour')
         layer.setGeomTransform(f'smoothsia(generalize([shape], {smoothsia}*[data_cellsize]))')
     elif variable.endswith('_vector') or variable.endswith("_vector_from_direction_and_speed"):
-        layer.setConnectionType(mapscript.MS_UVRASTER, "")
+        if vector_features is None:
+            layer.setConnectionType(mapscript.MS_UVRASTER, "")
         layer.type = mapscript.MS_LAYER_POINT
     else:
         layer.type = mapscript.MS_LAYER_RASTER
@@ -1620,7 +1530,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
                 wms_title += f": {ds[variable].attrs['short_name']}"
             except (AttributeError, KeyError):
                 pass
-        logger.debug(f"wms_title {wms_title}")
+        logger.debug("wms_title %s", wms_title)
         layer.metadata.set("wms_title", f"{wms_title}")
     if 'calculated_omerc' in grid_mapping_name:
         ll_x = optimal_bb_area.area_extent[0]
@@ -1633,7 +1543,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
         # Keep native extent in render path; layer projection is also native.
         ll_x, ur_x, ll_y, ur_y = _extract_extent(ds, actual_variable, transform_rotated=False)
     ll_x, ll_y, ur_x, ur_y = _adjust_extent_to_units(ds, actual_variable, shared_cache, grid_mapping_name, ll_x, ll_y, ur_x, ur_y)
-    logger.debug(f"ll ur {ll_x} {ll_y} {ur_x} {ur_y}")
+    logger.debug("ll ur %s %s %s %s", ll_x, ll_y, ur_x, ur_y)
     layer.metadata.set("wms_extent", f"{ll_x} {ll_y} {ur_x} {ur_y}")
 
 
@@ -1654,7 +1564,9 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
             except KeyError:
                 colour_dimension = 'light-green'
 
-        if style.lower() == "wind_barbs":
+        if vector_features is not None:
+            _add_vector_features(layer, map_obj, vector_features, style, colours_by_name[colour_dimension])
+        elif style.lower() == "wind_barbs":
             # Wind barbs
             layer.classitem = "uv_length"
             s = mapscript.classObj(layer)
@@ -1682,7 +1594,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
             _style.setSymbolByName(map_obj, "vector_arrow")
             #layer.setProcessingKey('UV_SIZE_SCALE', '2')
         else:
-            logger.debug(f"Unknown style {style}. Check your request.")
+            logger.debug("Unknown style %s. Check your request.", style)
 
         try:
             uv_spacing = qp['spacing']
@@ -1691,50 +1603,50 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
                 uv_spacing = qp['dim_spacing']
             except KeyError:
                 uv_spacing = 12
-        layer.setProcessingKey('UV_SPACING', str(uv_spacing)) #Default 32
+        if vector_features is None:
+            layer.setProcessingKey('UV_SPACING', str(uv_spacing)) #Default 32
 
     else:
-        logger.debug(f"Dimmension search len {len(dimension_search)}")
+        min_max_start = time.perf_counter()
+        logger.debug("Dimmension search len %s", len(dimension_search))
         if len(dimension_search) == 0:
             logger.debug("Len 0")
             min_val = np.nanmin(ds[actual_variable][:,:].data)
             max_val = np.nanmax(ds[actual_variable][:,:].data)
         elif len(dimension_search) == 1:
-            logger.debug(f"Len 1 of {actual_variable}")
+            logger.debug("Len 1 of %s", actual_variable)
             min_val = np.nanmin(ds[actual_variable][dimension_search[0]['selected_band_number'],:,:].data)
             max_val = np.nanmax(ds[actual_variable][dimension_search[0]['selected_band_number'],:,:].data)
             if '_FillValue' in ds[actual_variable].attrs:
                 if min_val == ds[actual_variable].attrs['_FillValue']:
-                    logger.debug(f"Need to rescale min_val {min_val} due to fillvalue, FILLVALUE {ds[actual_variable].attrs['_FillValue']}")
+                    logger.debug("Need to rescale min_val %s due to fillvalue, FILLVALUE %s", min_val, ds[actual_variable].attrs['_FillValue'])
                     masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],:,:].data,
                                                     ds[actual_variable].attrs['_FillValue'], copy=False)
                     min_val = masked_fillvalue.min()
                 if max_val == ds[actual_variable].attrs['_FillValue']:
-                    logger.debug(f"Need to rescale max_val {max_val} due to fillvalue, FILLVALUE {ds[actual_variable].attrs['_FillValue']}")
+                    logger.debug("Need to rescale max_val %s due to fillvalue, FILLVALUE %s", max_val, ds[actual_variable].attrs['_FillValue'])
                     masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],:,:].data,
                                                     ds[actual_variable].attrs['_FillValue'], copy=False)
                     max_val = masked_fillvalue.max()
         elif len(dimension_search) == 2:
-            logger.debug(f"Len 2 of {actual_variable}")
+            logger.debug("Len 2 of %s", actual_variable)
             try:
                 min_val = np.nanmin(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],:,:].data)
                 max_val = np.nanmax(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],:,:].data)
                 if '_FillValue' in ds[actual_variable].attrs:
                     if min_val == ds[actual_variable].attrs['_FillValue']:
-                        logger.debug(f"Need to rescale min_val {min_val} due to fillvalue, FILLVALUE {ds[actual_variable].attrs['_FillValue']}")
+                        logger.debug("Need to rescale min_val %s due to fillvalue, FILLVALUE %s", min_val, ds[actual_variable].attrs['_FillValue'])
                         masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],:,:].data,
                                                       ds[actual_variable].attrs['_FillValue'], copy=False)
                         min_val = masked_fillvalue.min()
                     if max_val == ds[actual_variable].attrs['_FillValue']:
-                        logger.debug(f"Need to rescale max_val {max_val} due to fillvalue, FILLVALUE {ds[actual_variable].attrs['_FillValue']}")
+                        logger.debug("Need to rescale max_val %s due to fillvalue, FILLVALUE %s", max_val, ds[actual_variable].attrs['_FillValue'])
                         masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],:,:].data,
                                                       ds[actual_variable].attrs['_FillValue'], copy=False)
                         max_val = masked_fillvalue.max()
             except IndexError:
-                ncml_netcdf_files = _read_netcdfs_from_ncml(netcdf_file)
-                with xr.open_dataset(ncml_netcdf_files[dimension_search[0]["selected_band_number"]], mask_and_scale=False) as ds_actual:
-                    min_val = np.nanmin(ds_actual[actual_variable][0,dimension_search[1]['selected_band_number'],:,:].data)
-                    max_val = np.nanmax(ds_actual[actual_variable][0,dimension_search[1]['selected_band_number'],:,:].data)
+                logger.exception("Index error trying to get min and max val for 2 dimension search. Select by dimension name.")
+                min_val, max_val = _min_max_by_dimension_name(ds, actual_variable, dimension_search)
         # Find which band
         elif len(dimension_search) == 3:
             logger.debug("Len 3")
@@ -1743,12 +1655,12 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
             type_to_type = {'float32': 'f4', 'float64': 'f8'}
             try:
                 if min_val == ds[actual_variable].attrs['_FillValue']:
-                    logger.debug(f"Need to rescale min_val {min_val} due to fillvalue, FILLVALUE {ds[actual_variable].attrs['_FillValue']}")
+                    logger.debug("Need to rescale min_val %s due to fillvalue, FILLVALUE %s", min_val, ds[actual_variable].attrs['_FillValue'])
                     masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],dimension_search[2]['selected_band_number'],:,:].data,
                                                     ds[actual_variable].attrs['_FillValue'], copy=False)
                     min_val = masked_fillvalue.min()
                 if max_val == ds[actual_variable].attrs['_FillValue']:
-                    logger.debug(f"Need to rescale max_val {max_val} due to fillvalue, FILLVALUE {ds[actual_variable].attrs['_FillValue']}")
+                    logger.debug("Need to rescale max_val %s due to fillvalue, FILLVALUE %s", max_val, ds[actual_variable].attrs['_FillValue'])
                     masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],dimension_search[2]['selected_band_number'],:,:].data,
                                                     ds[actual_variable].attrs['_FillValue'], copy=False)
                     max_val = masked_fillvalue.max()
@@ -1756,24 +1668,26 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
                 logger.debug("No _FillValue in attrs. Try to compare to default fillvalue.")
                 default_fill_value = netCDF4.default_fillvals[type_to_type[str(ds[actual_variable].encoding.get('dtype'))]]
                 if min_val == default_fill_value:
-                    logger.debug(f"Need to rescale min_val {min_val} due to default fillvalue, FILLVALUE {default_fill_value}")
+                    logger.debug("Need to rescale min_val %s due to default fillvalue, FILLVALUE %s", min_val, default_fill_value)
                     masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],dimension_search[2]['selected_band_number'],:,:].data,
                                                           default_fill_value, copy=False)
                     min_val = masked_fillvalue.min()
                 if max_val == default_fill_value:
-                    logger.debug(f"Need to rescale max_val {max_val} due to default fillvalue, FILLVALUE {default_fill_value}")
+                    logger.debug("Need to rescale max_val %s due to default fillvalue, FILLVALUE %s", max_val, default_fill_value)
                     masked_fillvalue = np.ma.masked_equal(ds[actual_variable][dimension_search[0]['selected_band_number'],dimension_search[1]['selected_band_number'],dimension_search[2]['selected_band_number'],:,:].data,
                                                           default_fill_value, copy=False)
                     max_val = masked_fillvalue.max()
             except IndexError:
-                logger.exception("Index error trying to get min and max val for 3 dimension search.")
+                logger.exception("Index error trying to get min and max val for 3 dimension search. Select by dimension name.")
+                min_val, max_val = _min_max_by_dimension_name(ds, actual_variable, dimension_search)
 
         elif not dimension_search:
             logger.debug("Dimension search empty. Possible calculated field.")
         else:
             logger.error(f"Could not estimate or read min and/or max val of dataset: {actual_variable}")
+        observe('min_max', time.perf_counter() - min_max_start)
         try:
-            logger.debug(f"MIN:MAX {min_val} {max_val}")
+            logger.debug("MIN:MAX %s %s", min_val, max_val)
         except UnboundLocalError as le:
             logger.error(f"status_code=500, Failed with: {str(le)}.")
             raise HTTPError(response_code='500 Internal Server Error', response=f"Unspecified internal server error.")
@@ -1782,7 +1696,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
             try:
                 for style_config in product_config['styles']:
                     if style_config['name'].lower() == style.lower():
-                        set_styles(layer, style_config)
+                        set_styles(layer, style_config, product_config)
                         # prev_color_interval = style_config['intervals'][0]
                         # layer.classgroup = style_config['name']
                         # for color_interval, color in zip(style_config['intervals'][1:], style_config['colors']):
@@ -1835,8 +1749,8 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
                 elif ds[actual_variable].attrs['units'] == 'm/s':
                     label_scaling = 1
                 else:
-                    logger.debug(f"Unknown unit: {ds[actual_variable].attrs['units']}. Label scaling may be of for {actual_variable}.")
-                logger.debug(f"Selected label scale {label_scaling} and offset {label_offset}")
+                    logger.debug("Unknown unit: %s. Label scaling may be of for %s.", ds[actual_variable].attrs['units'], actual_variable)
+                logger.debug("Selected label scale %s and offset %s", label_scaling, label_offset)
             except KeyError:
                 pass
             label.setText(f'(tostring(({label_offset}+[contour]/{label_scaling}),"%.0f"))')
@@ -1847,10 +1761,12 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
             label.position = mapscript.MS_CC
             label.force = True
             label.angle = 0 #mapscript.MS_AUTO
-            logger.debug(f"{label.convertToString()}")
+            logger.debug("%s", label.convertToString())
             s.addLabel(label)
         elif style == 'raster':
-            cfa, min_val, max_val = _colormap_from_attribute(ds, actual_variable, layer, min_val, max_val, set_scale_processing_key)
+            cfa, min_val, max_val = _colormap_from_attribute(ds, actual_variable, layer, min_val, max_val,
+                                                            set_scale_processing_key or
+                                                            classification({}, product_config) == CLASSIFICATION_LUT)
             #Grayscale
             if not cfa:
                 # Use standard linear grayscale
@@ -1863,7 +1779,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
                 _style.maxcolor = mapscript.colorObj(red=255, green=255, blue=255)
                 _style.minvalue = float(min_val)
                 _style.maxvalue = float(max_val)
-            logger.debug(f"After colormap min max {min_val} {max_val}")
+            logger.debug("After colormap min max %s %s", min_val, max_val)
 
     # Generate GetFeatureInfo template
     get_feature_info_filename = os.path.join(_get_mapfiles_path(product_config), f'getfeature-info-{actual_variable}.html')
@@ -1874,6 +1790,7 @@ def _generate_layer(layer, ds, shared_cache, netcdf_file, qp, map_obj, product_c
             gfi.write("Latitude  [y]<br>\n")
             gfi.write(f"Pixel value [value_list] {ds[actual_variable].attrs['units']}<br>\n")
     if os.path.exists(get_feature_info_filename):
+        touch_artefact(get_feature_info_filename)
         layer.template = get_feature_info_filename
 
     return actual_variable
@@ -1883,53 +1800,53 @@ def _colormap_from_attribute(ds, actual_variable, layer, min_val, max_val, set_s
     return_val = False
     colormap_dict = {}
     try:
-        logger.debug(f"module to load {ds[actual_variable].colormap.split('.')[0]}")
+        logger.debug("module to load %s", ds[actual_variable].colormap.split('.')[0])
         loaded_module = importlib.import_module(ds[actual_variable].colormap.split(".")[0])
         cm = getattr(loaded_module, 'cm')
         tools = getattr(loaded_module, 'tools')
-        logger.debug(f"colormap to load {ds[actual_variable].colormap.split('.')[-1]}")
+        logger.debug("colormap to load %s", ds[actual_variable].colormap.split('.')[-1])
         colormap = getattr(cm, ds[actual_variable].colormap.split(".")[-1])
         colormap_dict = tools.get_dict(colormap, N=32)
     except ModuleNotFoundError:
-        logger.debug(f"Module {ds[actual_variable].colormap} not found. Use build in default.")
+        logger.debug("Module %s not found. Use build in default.", ds[actual_variable].colormap)
         return return_val, min_val, max_val
     except AttributeError as ae:
-        logger.debug(f"Attribute not found: {str(ae)}")
+        logger.debug("Attribute not found: %s", ae)
         pass
     except Exception:
         raise
     try:
         minmax = ds[actual_variable].minmax.split(' ')
-        logger.debug(f"minmax from attribute {minmax}")
+        logger.debug("minmax from attribute %s", minmax)
         min_val = float(minmax[0])
         max_val = float(minmax[1])
         try:
-            logger.debug(f"add_offset {ds[actual_variable].add_offset}")
+            logger.debug("add_offset %s", ds[actual_variable].add_offset)
             min_val = float(minmax[0]) - ds[actual_variable].add_offset
             max_val = float(minmax[1]) - ds[actual_variable].add_offset
         except Exception:
             pass
         try:
-            logger.debug(f"scale_factor {ds[actual_variable].scale_factor}")
+            logger.debug("scale_factor %s", ds[actual_variable].scale_factor)
             min_val = min_val/ds[actual_variable].scale_factor
             max_val = max_val/ds[actual_variable].scale_factor
         except Exception:
             pass
 
-        logger.debug(f"Using from minmax min max {min_val} {max_val}")
+        logger.debug("Using from minmax min max %s %s", min_val, max_val)
         if set_scale_processing_key:
             logger.debug("Setting mapserver processing scale and buckets")
             layer.setProcessingKey('SCALE', f'{min_val:0.1f},{max_val:0.1f}')
-            layer.setProcessingKey('SCALE_BUCKETS', '32')
+            layer.setProcessingKey('SCALE_BUCKETS', f'{COLORMAP_SCALE_BUCKETS}')
     except AttributeError as ae:
-        logger.debug(f"Attribute not found: {str(ae)}. Using calculated min max.")
-        logger.debug(f"Using from calculation min max {min_val} {max_val}")
+        logger.debug("Attribute not found: %s. Using calculated min max.", ae)
+        logger.debug("Using from calculation min max %s %s", min_val, max_val)
     except Exception:
         raise
     try:
         units = ds[actual_variable].units
     except AttributeError as ae:
-        logger.debug(f"Attribute not found: {str(ae)}. No units.")
+        logger.debug("Attribute not found: %s. No units.", ae)
         units = ""
     if colormap_dict:
         try:
@@ -1949,7 +1866,7 @@ def _colormap_from_attribute(ds, actual_variable, layer, min_val, max_val, set_s
                 index += 1
             return_val = True
         except AttributeError as ae:
-            logger.debug(f"Attribute not found: {str(ae)}")
+            logger.debug("Attribute not found: %s", ae)
         except Exception:
             raise
 
@@ -1992,7 +1909,7 @@ def _parse_filename(netcdf_path, product_config):
     pattern = re.compile(pattern_match)
     mtchs = pattern.match(netcdf_path)
     if mtchs:
-        logger.debug(f"Pattern match: {mtchs.groups()}")
+        logger.debug("Pattern match: %s", mtchs.groups())
         return mtchs.groups()
     else:
         logger.error(f"status_code=500, No file name match: {netcdf_path}, match string {pattern_match}.")
@@ -2008,9 +1925,9 @@ def _parse_request(query_string):
     query_string = _query_string_cleanup(query_string)
     full_request = parse_qs(query_string, keep_blank_values=True)
     qp = {k.lower(): v for k, v in full_request.items()}
-    logger.debug(f"QP: {qp}")
+    logger.debug("QP: %s", qp)
     qp = {k if (isinstance(v, list) and len(v) == 1) else k:v[0] for k,v in qp.items()}
-    logger.debug(f"QP after flatten lists {qp}")
+    logger.debug("QP after flatten lists %s", qp)
     return qp
 
 def _query_string_cleanup(query_string):
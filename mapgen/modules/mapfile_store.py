@@ -0,0 +1,120 @@
+"""
+mapfile store : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Map files saved for reuse by later requests.
+
+A map file is named by a hash of everything it is generated from: the
+netcdf file and its modification time, the product config, the host and
+api in the metadata and the request parameters used to generate the
+layer. The same name therefore always means the same content, and a
+changed netcdf file or config gives a new name instead of a stale map
+file.
+
+Map files are written to a temporary file in the same directory and
+renamed, so a reader finds either no map file or a complete one and
+can use it without checking it. With an artefact store, map files are
+published there, and a map file not found locally is fetched from it.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+import mapscript
+
+from mapgen.modules import artefact_store
+from mapgen.modules.artefacts import atomic_path
+from mapgen.modules.metrics import timed
+from mapgen.modules.request_log import cache_outcome
+
+logger = logging.getLogger(__name__)
+
+# Request parameters which do not change the generated map file, only how it is drawn or queried.
+VIEW_PARAMETERS = {'service', 'version', 'request', 'bbox', 'width', 'height', 'crs', 'srs',
+                   'format', 'transparent', 'bgcolor', 'exceptions', 'info_format', 'feature_count',
+                   'i', 'j', 'x', 'y', 'query_layers', 'layers', 'layer', 'styles', 'style',
+                   'sld_version', 'time'}
+# Used to decimate point features, so part of the map file with vector_rendering: features.
+FEATURE_PARAMETERS = ('bbox', 'width', 'height', 'crs', 'srs')
+
+
+def _config_digest(product_config):
+    """Digest of the product config as read from the config file."""
+    config = {k: v for k, v in (product_config or {}).items() if k != 'style_templates'}
+    return json.dumps(config, sort_keys=True, default=str)
+
+
+def mapfile_key(netcdf_path, product_config, qp=None, *parts):
+    """Hash of the inputs of a map file.
+
+    qp is the parsed request for a layer map file, None for capabilities.
+    """
+    try:
+        mtime = os.stat(netcdf_path).st_mtime
+    except OSError:
+        mtime = None
+    key = {'netcdf_path': netcdf_path, 'mtime': mtime, 'config': _config_digest(product_config),
+           'parts': [str(part) for part in parts]}
+    if qp is not None:
+        layer = qp.get('layers', qp.get('layer'))
+        style = qp.get('styles') or 'default-style'
+        key['layer'] = [layer, style, qp.get('time', 'notime')]
+        key['parameters'] = {k: v for k, v in qp.items() if k not in VIEW_PARAMETERS}
+        if (product_config or {}).get('vector_rendering') == 'features' and layer and 'vector' in layer:
+            key['parameters'].update({k: qp[k] for k in FEATURE_PARAMETERS if k in qp})
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def mapfile_path(directory, prefix, key):
+    """Path of the map file. The prefix keeps the names readable.
+
+    The artefact cleanup only removes map files named like this.
+    """
+    prefix = prefix.replace(os.sep, '_')
+    return os.path.join(directory, f'{prefix}-{key}.map')
+
+
+@timed('mapfile_save')
+def save_mapfile(map_object, path, store=None):
+    """Save the map file atomically, and publish it to the artefact store."""
+    with atomic_path(path, suffix='.map.tmp') as tmp_file:
+        map_object.save(tmp_file)
+    logger.debug(f"Saved map file {path}")
+    if store is not None:
+        artefact_store.publish_mapfile(store, path)
+    return path
+
+
+def load_mapfile(path, store=None):
+    """The map object of an existing map file, or None if there is none."""
+    outcome = 'hit'
+    if not os.path.exists(path):
+        if store is None or not artefact_store.fetch_mapfile(store, path):
+            cache_outcome('mapfile', 'miss')
+            return None
+        logger.debug(f"Fetched map file {path} from {store}")
+        outcome = 'store'
+    try:
+        map_object = mapscript.mapObj(path)
+    except mapscript.MapServerError as e:
+        logger.warning(f"Failed to load map file {path}: {str(e)}")
+        cache_outcome('mapfile', 'miss')
+        return None
+    cache_outcome('mapfile', outcome)
+    return map_object
@@ -0,0 +1,243 @@
+"""
+metrics : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Latency of the stages of a request as Prometheus histograms.
+
+Each request runs in its own process. The stages timed there are kept
+in the process and published to the shared cache when the request is
+done. The server process collects them after the request process has
+finished, and adds them to the histograms in a file in METRICS_DIR,
+shared by all server processes on the host and updated under flock. /metrics,
+from any of them, renders the cumulative histograms of all of them in
+the Prometheus text format, with the gauges each server process
+reported about itself while it is alive.
+
+Environment:
+    METRICS_DIR: default /tmp/mapgen-metrics.
+
+Stages are labelled with the product config entry (its pattern) and the
+request type of the request.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import functools
+import threading
+from urllib.parse import parse_qs
+from contextlib import contextmanager
+
+from mapgen.modules import artefacts, deadline
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_NAME = 'mapgen_stage_duration_seconds'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/mapgen-metrics')
+
+# Request process side
+_labels = {'product': '', 'request': ''}
+_observations = []
+
+# Server process side
+_histograms = {}
+_lock = threading.Lock()
+
+
+def request_type(query_string):
+    """The request type of a query string, lower case. No request is a getcapabilities."""
+    try:
+        qp = {k.lower(): v for k, v in parse_qs(str(query_string)).items()}
+        return qp['request'][0].lower()
+    except (KeyError, IndexError):
+        return 'getcapabilities'
+
+
+def set_labels(product=None, request=None):
+    """Set the labels of the stages timed from now on in this process."""
+    if product is not None:
+        _labels['product'] = str(product)
+    if request is not None:
+        _labels['request'] = str(request)
+
+
+def labels():
+    """The labels of the stages timed in this process."""
+    return dict(_labels)
+
+
+def observe(stage, seconds):
+    _observations.append((stage, _labels['product'], _labels['request'], seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time the block as stage name, also if it raises.
+
+    Raises deadline.DeadlineExceeded before the block if the request deadline has passed.
+    """
+    deadline.check(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator timing each call of the function as stage name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def publish(shared_cache):
+    """Hand the stages timed in this process over to the server process."""
+    global _observations
+    if _observations:
+        shared_cache[f'metrics-{os.getpid()}'] = _observations
+    _observations = []
+
+
+def _add(histograms, observations):
+    for stage_name, product, request, seconds in observations:
+        histogram = histograms.setdefault((stage_name, product, request),
+                                          {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+def _alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load():
+    """The histograms and process gauges in METRICS_DIR, None if there are none."""
+    try:
+        with open(os.path.join(METRICS_DIR, 'metrics.json')) as f:
+            store = json.load(f)
+    except FileNotFoundError:
+        return None
+    histograms = {(h['stage'], h['product'], h['request']):
+                  {'buckets': h['buckets'], 'sum': h['sum'], 'count': h['count']} for h in store['histograms']}
+    return histograms, store['processes']
+
+
+@contextmanager
+def _store():
+    """The histograms and process gauges in METRICS_DIR, locked and written back after the block."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, 'metrics.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        histograms, processes = _load() or ({}, {})
+        yield histograms, processes
+        store = {'histograms': [{'stage': stage_name, 'product': product, 'request': request, **histogram}
+                                for (stage_name, product, request), histogram in histograms.items()],
+                 'processes': {pid: values for pid, values in processes.items() if _alive(pid)}}
+        with artefacts.atomic_path(os.path.join(METRICS_DIR, 'metrics.json')) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(store, f)
+
+
+def record(observations, gauges=None):
+    """Add observations (stage, product, request, seconds) to the histograms.
+
+    gauges {name: value} are about this process, and replace what it reported before.
+    """
+    with _lock:
+        _add(_histograms, observations)
+    if not observations and not gauges:
+        return
+    try:
+        with _store() as (histograms, processes):
+            _add(histograms, observations)
+            processes.setdefault(str(os.getpid()), {}).update(gauges or {})
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Failed to add to the metrics in {METRICS_DIR}: {str(e)}")
+
+
+def collect(shared_cache, pid, gauges=None):
+    """Collect the stages published by the finished request process pid, and return them.
+
+    gauges {name: value} are recorded about this process along with them.
+    """
+    try:
+        observations = shared_cache.pop(f'metrics-{pid}', None)
+    except Exception as e:
+        logger.debug(f"Failed to collect metrics of {pid}: {str(e)}")
+        observations = None
+    # Also stages timed in this process
+    record((observations or []) + _observations, gauges)
+    _observations.clear()
+    return observations or []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(gauges=None):
+    """The histograms of all server processes, and gauges {name: [(labels, value)]}, in the Prometheus text format.
+
+    Without METRICS_DIR, the histograms of this process.
+    """
+    lines = [f'# HELP {METRIC_NAME} Time spent in each stage of a request.',
+             f'# TYPE {METRIC_NAME} histogram']
+    gauges = {name: list(values) for name, values in (gauges or {}).items()}
+    try:
+        histograms, processes = _load() or (None, {})
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Failed to read the metrics in {METRICS_DIR}: {str(e)}")
+        histograms, processes = None, {}
+    if histograms is None:
+        with _lock:
+            histograms = {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                          for key, h in _histograms.items()}
+    for pid, values in sorted(processes.items()):
+        if _alive(pid):
+            for name, value in values.items():
+                gauges.setdefault(name, []).append(({'pid': pid}, value))
+    for (stage_name, product, request), histogram in sorted(histograms.items()):
+        labels = f'stage="{_escape(stage_name)}",product="{_escape(product)}",request="{_escape(request)}"'
+        for bound, count in zip(BUCKETS, histogram['buckets']):
+            lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{METRIC_NAME}_sum{{{labels}}} {histogram["sum"]}')
+        lines.append(f'{METRIC_NAME}_count{{{labels}}} {histogram["count"]}')
+    for name, values in gauges.items():
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in values:
+            label_string = ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+            lines.append(f'{name}{{{label_string}}} {value}')
+    return ('\n'.join(lines) + '\n').encode()
@@ -0,0 +1,225 @@
+"""
+ncml : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Time aggregation of the netcdf files listed in an ncml file.
+
+The ncml is parsed once and the time coordinate of each member file is
+read to build a sorted time -> (member file, index in member) table.
+The table is kept in the shared cache until the ncml file or one of the
+member files changes.
+
+NcmlDataset is a virtual dataset on top of the table. Members are only
+opened when needed and through a small pool of open files, so a request
+touches only the member holding the requested data.
+"""
+
+import os
+import re
+import logging
+from collections import OrderedDict
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+from lxml import etree
+
+from mapgen.modules.request_log import cache_outcome
+
+logger = logging.getLogger(__name__)
+
+NCML_NAMESPACES = {'nc': 'http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2'}
+
+_TIME_UNITS = {'seconds': 's', 'second': 's', 'secs': 's', 'sec': 's', 's': 's',
+               'minutes': 'm', 'minute': 'm', 'mins': 'm', 'min': 'm',
+               'hours': 'h', 'hour': 'h', 'hrs': 'h', 'hr': 'h', 'h': 'h',
+               'days': 'D', 'day': 'D', 'd': 'D'}
+_STANDARD_CALENDARS = ('standard', 'gregorian', 'proleptic_gregorian')
+
+
+def read_ncml_members(ncml_file):
+    """Return the location of the netcdf files aggregated in the ncml file."""
+    root = etree.parse(ncml_file).getroot()
+    return [netcdf.get('location')
+            for netcdf in root.xpath('//nc:netcdf/nc:aggregation/nc:netcdf', namespaces=NCML_NAMESPACES)]
+
+
+def _decode_time(values, units, calendar='standard'):
+    """Decode CF time values to datetime64[ns].
+
+    Handles reference times with an utc offset like
+    'seconds since 1970-01-01 00:00:00 +00:00'. Other calendars than the
+    standard one are decoded with cftime. Raises ValueError for dates
+    not in the standard calendar, like 30 February in a 360_day calendar.
+    """
+    if calendar.lower() not in _STANDARD_CALENDARS:
+        dates = netCDF4.num2date(np.asarray(values, dtype=np.float64), units, calendar.lower(),
+                                 only_use_cftime_datetimes=True)
+        return np.array([np.datetime64(date.isoformat(), 'ns') for date in np.ravel(dates)],
+                        dtype='datetime64[ns]').reshape(np.shape(dates))
+    match = re.match(r'\s*(\w+)\s+since\s+(.+)$', units)
+    if not match or match.group(1).lower() not in _TIME_UNITS:
+        raise ValueError(f"This unit is not implemented: {units}")
+    reference = pd.Timestamp(match.group(2).strip())
+    if reference.tzinfo is not None:
+        reference = reference.tz_convert('UTC').tz_localize(None)
+    step = np.timedelta64(1, _TIME_UNITS[match.group(1).lower()]).astype('timedelta64[ns]').astype(np.int64)
+    offsets = np.rint(np.asarray(values, dtype=np.float64) * step).astype(np.int64)
+    return np.datetime64(reference.to_datetime64(), 'ns') + offsets.astype('timedelta64[ns]')
+
+
+def _member_times(netcdf_path):
+    """Read the time coordinate of one member without opening it with xarray."""
+    with netCDF4.Dataset(netcdf_path) as nc:
+        time_variable = nc.variables['time']
+        time_variable.set_auto_mask(False)
+        return np.atleast_1d(_decode_time(time_variable[:], time_variable.units,
+                                          getattr(time_variable, 'calendar', 'standard')))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class NcmlAggregation:
+    """Sorted time axis of an ncml aggregation and where to find each time step.
+
+    Only plain lists and numpy arrays are stored, so it can be kept in the
+    shared cache.
+    """
+
+    def __init__(self, ncml_file, members, times, member_index, time_index, mtime=None, member_mtimes=None):
+        self.ncml_file = ncml_file
+        self.members = members
+        self.times = times
+        self.member_index = member_index
+        self.time_index = time_index
+        self.mtime = mtime
+        self.member_mtimes = member_mtimes
+
+    @classmethod
+    def from_ncml(cls, ncml_file, mtime=None):
+        members = read_ncml_members(ncml_file)
+        if not members:
+            raise ValueError(f"No netcdf files found in ncml file {ncml_file}.")
+        # Before reading, so a member changed while reading is read again next time
+        member_mtimes = [_mtime(member) for member in members]
+        times = []
+        member_index = []
+        time_index = []
+        for i, member in enumerate(members):
+            member_times = _member_times(member)
+            times.append(member_times)
+            member_index.append(np.full(member_times.size, i, dtype=np.int64))
+            time_index.append(np.arange(member_times.size, dtype=np.int64))
+        times = np.concatenate(times)
+        order = np.argsort(times, kind='stable')
+        return cls(ncml_file, members, times[order], np.concatenate(member_index)[order],
+                   np.concatenate(time_index)[order], mtime, member_mtimes)
+
+    def lookup(self, requested_time):
+        """Return (member file, index in member) for an exact time. Raises KeyError if not found."""
+        requested = np.datetime64(requested_time, 'ns')
+        position = int(np.searchsorted(self.times, requested))
+        if position >= self.times.size or self.times[position] != requested:
+            raise KeyError(f"Time {requested_time} is not in ncml {self.ncml_file}")
+        return self.members[self.member_index[position]], int(self.time_index[position])
+
+    def member_time_size(self, member):
+        """Number of time steps in a member file."""
+        return int(np.count_nonzero(self.member_index == self.members.index(member)))
+
+    def time_dataset(self):
+        """The combined time axis as a dataset, to be used where a dataset with time is expected."""
+        return xr.Dataset(coords={'time': self.times})
+
+
+def ncml_aggregation(ncml_file, shared_cache):
+    """Return the aggregation of ncml_file. Rebuilt when the ncml file or a member file is modified."""
+    mtime = os.stat(ncml_file).st_mtime
+    cache_key = f'ncml-{ncml_file}'
+    aggregation = shared_cache.get(cache_key)
+    if (aggregation is not None and aggregation.mtime == mtime and
+            aggregation.member_mtimes == [_mtime(member) for member in aggregation.members]):
+        cache_outcome('ncml', 'hit')
+        return aggregation
+    cache_outcome('ncml', 'miss')
+    logger.debug(f"Build time table for ncml {ncml_file}")
+    aggregation = NcmlAggregation.from_ncml(ncml_file, mtime)
+    shared_cache[cache_key] = aggregation
+    return aggregation
+
+
+# Open member datasets in this process, least recently used first.
+_open_members = OrderedDict()
+MAX_OPEN_MEMBERS = 4
+
+
+def open_member(netcdf_path):
+    """Open a member file with xarray through the pool of open files."""
+    if netcdf_path in _open_members:
+        _open_members.move_to_end(netcdf_path)
+        return _open_members[netcdf_path]
+    logger.debug(f"Open ncml member {netcdf_path}")
+    ds = xr.open_dataset(netcdf_path, mask_and_scale=False)
+    _open_members[netcdf_path] = ds
+    while len(_open_members) > MAX_OPEN_MEMBERS:
+        _, oldest = _open_members.popitem(last=False)
+        oldest.close()
+    return ds
+
+
+class NcmlDataset:
+    """Virtual dataset of an ncml aggregation.
+
+    The combined time axis comes from the cached aggregation table. Data
+    and variable metadata are read from the one member holding the
+    requested time, or the first member when no time is requested.
+    """
+
+    def __init__(self, ncml_file, shared_cache):
+        self.ncml_file = ncml_file
+        self.aggregation = ncml_aggregation(ncml_file, shared_cache)
+
+    @property
+    def members(self):
+        return self.aggregation.members
+
+    @property
+    def times(self):
+        return self.aggregation.times
+
+    def time_dataset(self):
+        return self.aggregation.time_dataset()
+
+    def member_for_time(self, requested_time=None):
+        """The member holding requested_time, or the first member if not given or not found."""
+        if requested_time is not None:
+            try:
+                member, _ = self.aggregation.lookup(requested_time)
+                return member
+            except KeyError:
+                logger.debug(f"Time {requested_time} not found in {self.ncml_file}. Use first member.")
+        return self.aggregation.members[0]
+
+    def open(self, requested_time=None):
+        """Open the member holding requested_time."""
+        return open_member(self.member_for_time(requested_time))
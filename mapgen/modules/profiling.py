@@ -0,0 +1,181 @@
+"""
+profiling : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Opt in profiling of single requests.
+
+Profiling is configured with environment variables and is off unless
+one of them is set:
+
+    PROFILE_ONE_IN: profile one in this many requests, at random.
+    PROFILE_SECRET: profile requests with a valid X-Mapgen-Profile header,
+        signed with this secret. See sign().
+    PROFILE_DIR: where the profiles are written, default /tmp/mapgen-profiles.
+    PROFILER: cprofile (default) or pyinstrument, if installed.
+    PROFILE_KEEP: number of profiles kept, default 200.
+
+The server process decides if a request is profiled and gives it a
+request id. The request process runs the profiler around the request and
+writes the profile named by request type, product config entry and
+request id, with a json file describing the request. cProfile writes a
+pstats file, to be read by snakeviz, flameprof or gprof2dot. pyinstrument
+writes a speedscope file.
+"""
+
+import os
+import re
+import hmac
+import json
+import time
+import uuid
+import random
+import hashlib
+import logging
+from contextlib import contextmanager
+
+from mapgen.modules import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_MAPGEN_PROFILE'
+REQUEST_ID_HEADER = 'HTTP_X_REQUEST_ID'
+PROFILE_ONE_IN = int(os.environ.get('PROFILE_ONE_IN', 0))
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/mapgen-profiles')
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+
+
+def sign(secret, path, query_string, expires):
+    """Value of the X-Mapgen-Profile header to profile the request until expires (unix time)."""
+    message = f'{int(expires)}:{path}?{query_string}'.encode()
+    return f'{int(expires)}.{hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()}'
+
+
+def valid_signature(secret, header, path, query_string, now=None):
+    """True if header is sign(secret, path, query_string, expires) and has not expired."""
+    try:
+        expires, _ = header.split('.', 1)
+        expires = int(expires)
+    except ValueError:
+        return False
+    if expires < (now or time.time()):
+        return False
+    return hmac.compare_digest(header, sign(secret, path, query_string, expires))
+
+
+def request_id(environ):
+    """The request id from the X-Request-Id header, or a new one."""
+    given = environ.get(REQUEST_ID_HEADER, '')
+    if re.fullmatch(r'[A-Za-z0-9._-]{1,64}', given):
+        return given
+    return uuid.uuid4().hex
+
+
+def profile_request(environ, one_in=None, secret=None):
+    """The request id if the request should be profiled, else None."""
+    one_in = PROFILE_ONE_IN if one_in is None else one_in
+    secret = PROFILE_SECRET if secret is None else secret
+    if not one_in and not secret:
+        return None
+    header = environ.get(PROFILE_HEADER)
+    if secret and header:
+        if valid_signature(secret, header, environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', '')):
+            return request_id(environ)
+        logger.warning(f"Invalid or expired {PROFILE_HEADER[5:].replace('_', '-')} header. Not profiling.")
+    if one_in and random.randrange(one_in) == 0:
+        return request_id(environ)
+    return None
+
+
+def _start(profiler):
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+            sampler = Profiler()
+            sampler.start()
+            return 'pyinstrument', sampler
+        except ModuleNotFoundError:
+            logger.warning("pyinstrument is not installed. Profile with cProfile.")
+    import cProfile
+    tracer = cProfile.Profile()
+    tracer.enable()
+    return 'cprofile', tracer
+
+
+def _stop(profiler, running):
+    if profiler == 'pyinstrument':
+        running.stop()
+    else:
+        running.disable()
+
+
+def _write(profiler, running, base):
+    if profiler == 'pyinstrument':
+        from pyinstrument.renderers import SpeedscopeRenderer
+        path = base + '.speedscope.json'
+        with open(path, 'w') as f:
+            f.write(running.output(renderer=SpeedscopeRenderer()))
+        return path
+    path = base + '.prof'
+    running.dump_stats(path)
+    return path
+
+
+def _prune(directory, keep):
+    """Remove the oldest profiles above keep."""
+    described = sorted((os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json')
+                        and not name.endswith('.speedscope.json')), key=os.path.getmtime)
+    for description in described[:max(len(described) - keep, 0)]:
+        base = description[:-len('.json')]
+        for path in (description, base + '.prof', base + '.speedscope.json'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+@contextmanager
+def profile(profile_id, path, query_string, directory=None, profiler=None, keep=None):
+    """Profile the block if profile_id is set, and write the profile when it is done."""
+    if profile_id is None:
+        yield
+        return
+    directory = directory or PROFILE_DIR
+    profiler, running = _start(profiler or PROFILER)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stop(profiler, running)
+        seconds = time.perf_counter() - start
+        labels = metrics.labels()
+        product = hashlib.sha256(labels['product'].encode()).hexdigest()[:8] if labels['product'] else 'noproduct'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            request = re.sub(r'[^a-z0-9_]', '_', labels['request'].lower())[:40] or 'unknown'
+            base = os.path.join(directory, f"{request}-{product}-{profile_id}")
+            profile_file = _write(profiler, running, base)
+            with open(base + '.json', 'w') as f:
+                json.dump({'request_id': profile_id, 'product': labels['product'], 'request': labels['request'],
+                           'path': path, 'query_string': query_string, 'seconds': seconds,
+                           'profiler': profiler, 'profile': os.path.basename(profile_file),
+                           'created': time.time()}, f)
+            _prune(directory, PROFILE_KEEP if keep is None else keep)
+            logger.info(f"Wrote profile of request {profile_id} to {profile_file}")
+        except Exception as e:
+            logger.warning(f"Failed to write profile of request {profile_id}: {str(e)}")
@@ -0,0 +1,195 @@
+"""
+request log : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Logging setup and the access log.
+
+Logging is configured once, at the level in the LOG_LEVEL environment
+variable (default INFO). Every log line has the request id of the
+request it belongs to.
+
+Debug logging of a single request is switched on by a log_level entry in
+the product config, or by an X-Mapgen-Debug header signed with the
+secret in LOG_DEBUG_SECRET (see profiling.sign). As every request runs
+in its own process, the level is changed for that process only.
+
+The server process writes one json line per request to the mapgen.access
+logger, with the request id, status, duration, the time spent in each
+stage and the outcome of the caches used by the request. The outcomes are
+recorded in the request process and published to the shared cache like
+the metrics.
+"""
+
+import os
+import json
+import time
+import logging
+import logging.config
+from contextlib import contextmanager
+
+from mapgen.modules.profiling import valid_signature
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('mapgen.access')
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_SECRET = os.environ.get('LOG_DEBUG_SECRET', '')
+DEBUG_HEADER = 'HTTP_X_MAPGEN_DEBUG'
+
+# Request process side
+_request = {'id': '-'}
+_outcomes = {}
+_configured = False
+
+
+class RequestIdFilter(logging.Filter):
+    """Add the id of the current request to the log records."""
+
+    def filter(self, record):
+        record.request_id = _request['id']
+        return True
+
+
+def logging_config(level=LOG_LEVEL):
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'filters': {
+            'request_id': {'()': RequestIdFilter},
+        },
+        'formatters': {
+            'KeyValueFormatter': {
+                'format': (
+                    '[%(asctime)s] [%(process)d] [%(request_id)s] '
+                    '[%(levelname)s] %(message)s'
+                )
+            },
+            'AccessFormatter': {
+                'format': '%(message)s'
+            },
+        },
+        'handlers': {
+            'console': {
+                'level': 'DEBUG',
+                'class': 'logging.StreamHandler',
+                'formatter': 'KeyValueFormatter',
+                'filters': ['request_id'],
+            },
+            'access': {
+                'level': 'INFO',
+                'class': 'logging.StreamHandler',
+                'formatter': 'AccessFormatter',
+            },
+        },
+        'loggers': {
+            'gunicorn.access': {
+                'propagate': True,
+            },
+            'gunicorn.error': {
+                'propagate': True,
+            },
+            'mapgen.access': {
+                'level': 'INFO',
+                'handlers': ['access'],
+                'propagate': False,
+            },
+        },
+        'root': {
+            'level': level,
+            'handlers': ['console'],
+        }
+    }
+
+
+def configure(level=None, force=False):
+    """Configure logging for this process, once."""
+    global _configured
+    if _configured and not force:
+        return
+    logging.config.dictConfig(logging_config(level or LOG_LEVEL))
+    _configured = True
+
+
+def set_request_id(request_id):
+    _request['id'] = request_id or '-'
+
+
+def debug_requested(environ, secret=None):
+    """True if the request has a valid signed X-Mapgen-Debug header."""
+    secret = LOG_DEBUG_SECRET if secret is None else secret
+    header = environ.get(DEBUG_HEADER)
+    if not secret or not header:
+        return False
+    if valid_signature(secret, header, environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', '')):
+        return True
+    logger.warning("Invalid or expired X-Mapgen-Debug header. Not debugging.")
+    return False
+
+
+@contextmanager
+def request_level(level):
+    """Log at level, like DEBUG, in the block. None keeps the level."""
+    root = logging.getLogger()
+    previous = root.level
+    if level:
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+    try:
+        yield
+    finally:
+        root.setLevel(previous)
+
+
+def cache_outcome(cache, outcome):
+    """Record the outcome, like hit or miss, of a cache used by this request."""
+    _outcomes[cache] = outcome
+
+
+def publish(shared_cache):
+    """Hand the cache outcomes of this request over to the server process."""
+    if _outcomes:
+        shared_cache[f'request-log-{os.getpid()}'] = dict(_outcomes)
+    _outcomes.clear()
+
+
+def collect(shared_cache, pid):
+    """The cache outcomes published by the finished request process pid."""
+    try:
+        return shared_cache.pop(f'request-log-{pid}', None) or {}
+    except Exception as e:
+        logger.debug("Failed to collect cache outcomes of %s: %s", pid, e)
+        return {}
+
+
+def stage_seconds(observations):
+    """Time spent in each stage, from metrics observations (stage, product, request, seconds)."""
+    stages = {}
+    for stage_name, _, _, seconds in observations or []:
+        stages[stage_name] = round(stages.get(stage_name, 0.0) + seconds, 6)
+    return stages
+
+
+def access(request_id, method, path, query_string, status, seconds, response_bytes,
+           stages=None, caches=None, **extra):
+    """Write the access log line of a request."""
+    if not access_logger.isEnabledFor(logging.INFO):
+        return
+    entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'request_id': request_id, 'method': method,
+             'path': path, 'query': query_string, 'status': int(str(status).split()[0]),
+             'seconds': round(seconds, 6), 'bytes': response_bytes, 'stages': stages or {},
+             'caches': caches or {}}
+    entry.update(extra)
+    access_logger.info(json.dumps(entry, default=str))
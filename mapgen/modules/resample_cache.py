@@ -0,0 +1,150 @@
+"""
+resample cache : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Disk cache for the pyresample nearest neighbour lookup tables.
+
+The neighbour search is the expensive part of a resample. It only depends
+on the swath lon/lat and the target area, so the result is stored on
+local disk keyed by a hash of those. A later resample of the same
+geometry, e.g. regenerating a layer after the map files are lost, then
+only needs to pick the values. With an artefact store, the tables are
+also published there and fetched by the other replicas.
+"""
+
+import os
+import hashlib
+import logging
+
+import numpy as np
+from pyresample import kd_tree
+
+from mapgen.modules import artefact_store
+from mapgen.modules.artefacts import atomic_path, touch_artefact
+from mapgen.modules.metrics import timed
+from mapgen.modules.request_log import cache_outcome
+
+logger = logging.getLogger(__name__)
+
+# Lookup tables already used in this process. Vector layers resample x and y
+# on the same geometry.
+_neighbour_info_memory = {}
+
+
+def _geometry_key(swath_def, target_area, radius_of_influence):
+    """Hash of the swath lon/lat, the target area and the search radius."""
+    lons = np.ascontiguousarray(np.asarray(swath_def.lons), dtype=np.float64)
+    lats = np.ascontiguousarray(np.asarray(swath_def.lats), dtype=np.float64)
+    key = hashlib.sha256()
+    key.update(str(lons.shape).encode())
+    key.update(lons.tobytes())
+    key.update(lats.tobytes())
+    key.update(str(target_area.crs.to_wkt()).encode())
+    key.update(str(target_area.shape).encode())
+    key.update(str(tuple(target_area.area_extent)).encode())
+    key.update(str(radius_of_influence).encode())
+    return key.hexdigest(), lons, lats
+
+
+def _fingerprint(lons, lats):
+    """A few lon/lat values stored with the table to validate it without hashing."""
+    samples = [0, lons.size // 3, 2 * lons.size // 3, lons.size - 1]
+    return np.concatenate((lons.ravel()[samples], lats.ravel()[samples]))
+
+
+def _load(cache_file, lons, lats, target_area):
+    try:
+        with np.load(cache_file) as lut:
+            if (tuple(lut['source_shape']) != lons.shape or
+                    tuple(lut['target_shape']) != tuple(target_area.shape) or
+                    not np.array_equal(lut['fingerprint'], _fingerprint(lons, lats), equal_nan=True)):
+                logger.warning(f"Resample lookup table {cache_file} does not match the geometry. Recompute.")
+                return None
+            return (lut['valid_input_index'], lut['valid_output_index'], lut['index_array'])
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"Failed to read resample lookup table {cache_file}: {str(e)}")
+    return None
+
+
+def _save(cache_file, neighbour_info, lons, lats, target_area):
+    """Write the table to a temporary file and rename to make it visible atomically."""
+    valid_input_index, valid_output_index, index_array = neighbour_info
+    try:
+        with atomic_path(cache_file, prefix='.lut-', suffix='.npz') as tmp_file, open(tmp_file, 'wb') as f:
+            np.savez(f,
+                     valid_input_index=valid_input_index,
+                     valid_output_index=valid_output_index,
+                     index_array=index_array,
+                     source_shape=np.array(lons.shape),
+                     target_shape=np.array(target_area.shape),
+                     fingerprint=_fingerprint(lons, lats))
+    except OSError as e:
+        logger.warning(f"Failed to write resample lookup table {cache_file}: {str(e)}")
+
+
+def get_neighbour_info(swath_def, target_area, radius_of_influence, cache_dir=None, store=None):
+    """Nearest neighbour lookup table from swath_def to target_area.
+
+    Returns (valid_input_index, valid_output_index, index_array). Looked up
+    in this process, then in cache_dir and then in the artefact store,
+    before doing the neighbour search. Without cache_dir only the in
+    process lookup is used.
+    """
+    key, lons, lats = _geometry_key(swath_def, target_area, radius_of_influence)
+    if key in _neighbour_info_memory:
+        cache_outcome('resample_lut', 'hit')
+        return _neighbour_info_memory[key]
+    cache_file = None
+    neighbour_info = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_file = os.path.join(cache_dir, f'resample-lut-{key}.npz')
+        if os.path.exists(cache_file):
+            neighbour_info = _load(cache_file, lons, lats, target_area)
+            if neighbour_info:
+                logger.debug(f"Reuse resample lookup table {cache_file}")
+                touch_artefact(cache_file)
+                cache_outcome('resample_lut', 'disk')
+        if neighbour_info is None and store is not None and artefact_store.fetch(store, f'resample-lut/{key}.npz',
+                                                                                cache_file):
+            neighbour_info = _load(cache_file, lons, lats, target_area)
+            if neighbour_info:
+                logger.debug(f"Fetched resample lookup table {key} from {store}")
+                cache_outcome('resample_lut', 'store')
+    if neighbour_info is None:
+        cache_outcome('resample_lut', 'miss')
+        valid_input_index, valid_output_index, index_array, _ = kd_tree.get_neighbour_info(
+            swath_def, target_area, radius_of_influence, neighbours=1)
+        neighbour_info = (valid_input_index, valid_output_index, index_array)
+        if cache_file:
+            _save(cache_file, neighbour_info, lons, lats, target_area)
+            if store is not None and os.path.exists(cache_file):
+                artefact_store.publish(store, f'resample-lut/{key}.npz', cache_file)
+    _neighbour_info_memory.clear()
+    _neighbour_info_memory[key] = neighbour_info
+    return neighbour_info
+
+
+@timed('resample')
+def resample_nearest(swath_def, data, target_area, radius_of_influence, fill_value=0, cache_dir=None, store=None):
+    """Same as pyresample kd_tree.resample_nearest, but with the lookup table cached."""
+    valid_input_index, valid_output_index, index_array = get_neighbour_info(swath_def, target_area,
+                                                                            radius_of_influence,
+                                                                            cache_dir=cache_dir, store=store)
+    return kd_tree.get_sample_from_neighbour_info('nn', target_area.shape, np.asarray(data),
+                                                  valid_input_index, valid_output_index, index_array,
+                                                  fill_value=fill_value)
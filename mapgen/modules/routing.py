@@ -0,0 +1,173 @@
+"""
+routing : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Routing of the requests for a dataset to the same replica.
+
+Every replica builds map files, north grids and resample tables, and
+keeps open files, for the datasets it gets requests for. When the
+requests for a dataset go to the same replica, the caches of the
+replicas hold different datasets.
+
+The routing key of a request is its path, without the query. A proxy in
+front can hash it, like ingress-nginx with the annotation
+
+    nginx.ingress.kubernetes.io/upstream-hash-by: "$uri"
+
+Or the replicas forward the requests among themselves. Each replica
+maps the key to a replica on a consistent hash ring of the replicas in
+ROUTING_REPLICAS (host:port,...), so adding or removing a replica only
+moves the datasets of that replica. A request for a dataset of another
+replica is forwarded there, with the X-Mapgen-Forwarded header so it is
+not forwarded again. If that replica is overloaded (503) or can not be
+reached, the next replica on the ring is tried, up to ROUTING_ATTEMPTS
+(default 2) replicas, and then the request is processed locally. A
+replica that can not be reached is skipped for ROUTING_BACKOFF seconds
+(default 30).
+
+This replica is the one in ROUTING_REPLICAS named ROUTING_SELF, by
+default the one with the host name of this host as the first part of
+its name, like fastapi-0 in fastapi-0.fastapi:8080.
+"""
+
+import os
+import time
+import socket
+import bisect
+import hashlib
+import logging
+import urllib.parse
+import urllib.error
+import urllib.request
+
+from mapgen.modules import metrics
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_HEADER = 'X-Mapgen-Forwarded'
+FORWARDED_ENVIRON = 'HTTP_X_MAPGEN_FORWARDED'
+REPLICA_HEADER = 'X-Mapgen-Replica'
+# Request headers passed on to the replica
+PASS_HEADERS = ('HTTP_ACCEPT', 'HTTP_USER_AGENT', 'HTTP_X_MAPGEN_PROFILE', 'HTTP_X_MAPGEN_DEBUG')
+VIRTUAL_NODES = 64
+
+
+def _hash(key):
+    """A hash of the key that is the same in all processes and replicas."""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def routing_key(environ):
+    """The routing key of a request, its path."""
+    return environ.get('PATH_INFO', '')
+
+
+class HashRing:
+    """Consistent hash ring of the replicas, each at VIRTUAL_NODES points."""
+
+    def __init__(self, replicas, virtual_nodes=VIRTUAL_NODES):
+        self.replicas = list(dict.fromkeys(replicas))
+        self._points = sorted((_hash(f'{replica}#{i}'), replica)
+                              for replica in self.replicas for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in self._points]
+
+    def preferred(self, key):
+        """The replicas in order of preference for the key."""
+        if not self._points:
+            return []
+        start = bisect.bisect(self._hashes, _hash(key))
+        replicas = []
+        for i in range(len(self._points)):
+            replica = self._points[(start + i) % len(self._points)][1]
+            if replica not in replicas:
+                replicas.append(replica)
+                if len(replicas) == len(self.replicas):
+                    break
+        return replicas
+
+
+class Router:
+
+    def __init__(self, replicas=(), this_replica=None, attempts=2, backoff=30.):
+        self.ring = HashRing(replicas)
+        if this_replica is None:
+            hostname = socket.gethostname()
+            this_replica = next((r for r in self.ring.replicas if r.split(':')[0].split('.')[0] == hostname), None)
+        self.this_replica = this_replica
+        self.attempts = attempts
+        self.backoff = backoff
+        self._unreachable = {}
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        replicas = [r.strip() for r in environ.get('ROUTING_REPLICAS', '').split(',') if r.strip()]
+        return cls(replicas, environ.get('ROUTING_SELF') or None, int(environ.get('ROUTING_ATTEMPTS', 2)),
+                   float(environ.get('ROUTING_BACKOFF', 30)))
+
+    @property
+    def enabled(self):
+        return len(self.ring.replicas) > 1 and self.this_replica in self.ring.replicas
+
+    def candidates(self, key):
+        """The other replicas to try before processing the request here."""
+        candidates = []
+        for replica in self.ring.preferred(key)[:self.attempts]:
+            if replica == self.this_replica:
+                break
+            if self._unreachable.get(replica, 0) > time.monotonic():
+                continue
+            candidates.append(replica)
+        return candidates
+
+    def forward(self, environ, host, scheme, request_id=None, at=None):
+        """Forward the request to the replica of its dataset.
+
+        Returns (replica, response_code, response, content_type), or None
+        when the request should be processed here.
+        """
+        if not self.enabled or FORWARDED_ENVIRON in environ:
+            return None
+        path = urllib.parse.quote(environ['PATH_INFO'])
+        query_string = environ.get('QUERY_STRING', '')
+        if query_string:
+            path = f'{path}?{query_string}'
+        headers = {k[5:].replace('_', '-').title(): environ[k] for k in PASS_HEADERS if k in environ}
+        headers.update({'Host': host, 'X-Forwarded-Proto': scheme, FORWARDED_HEADER: self.this_replica})
+        if request_id:
+            headers['X-Request-Id'] = request_id
+        for replica in self.candidates(routing_key(environ)):
+            start = time.monotonic()
+            timeout = None if at is None else max(at - start, 1)
+            try:
+                with urllib.request.urlopen(urllib.request.Request(f'http://{replica}{path}', headers=headers),
+                                            timeout=timeout) as upstream:
+                    response = upstream.read()
+                    metrics.record([('forward', '', metrics.request_type(query_string), time.monotonic() - start)])
+                    return (replica, f'{upstream.status} {upstream.reason}', response,
+                            upstream.headers.get('Content-Type', 'text/plain'))
+            except urllib.error.HTTPError as he:
+                if he.code == 503:
+                    logger.info(f"Replica {replica} is overloaded")
+                    continue
+                return replica, f'{he.code} {he.reason}', he.read(), he.headers.get('Content-Type', 'text/plain')
+            except OSError as oe:
+                logger.warning(f"Could not forward to replica {replica}: {oe}")
+                self._unreachable[replica] = time.monotonic() + self.backoff
+        return None
+
+
+router = Router.from_environ()
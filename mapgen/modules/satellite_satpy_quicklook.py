@@ -20,6 +20,8 @@ limitations under the License.
 import os
 import re
 import sys
+import math
+import dask
 import boto3
 import logging
 import botocore
@@ -33,6 +35,8 @@ from datetime import datetime
 
 from mapgen.modules.helpers import handle_request
 from mapgen.modules.helpers import _parse_request, HTTPError, WMS_SRS_SUPPORTED
+from mapgen.modules.mapfile_store import save_mapfile
+from mapgen.modules.metrics import stage, timed
 
 boto3.set_stream_logger('botocore', logging.CRITICAL)
 boto3.set_stream_logger('boto3', logging.CRITICAL)
@@ -95,29 +99,11 @@ def generate_satpy_quicklook(netcdf_path: str,
 
     logger.debug(f"{satpy_products}")
 
-    resolution = None
-    bucket = product_config['geotiff_bucket']
-    if 'mersi2-qk' in netcdf_path:
-        resolution = 250
-    elif 'mersi2-1k' in netcdf_path:
-        resolution = 1000
-    
-    (_path, _platform_name, _, _start_time, _end_time) = _parse_filename(netcdf_path, product_config)
-    start_time = datetime.strptime(_start_time, "%Y%m%d%H%M%S")
-    similar_netcdf_paths = _search_for_similar_netcdf_paths(_path, _platform_name, _start_time, _end_time, netcdf_path)
-    logger.debug(f"Similar netcdf paths: {similar_netcdf_paths}")
     ms_satpy_products = _get_satpy_products(satpy_products, full_request, product_config['default_dataset'])
     logger.debug(f"satpy product/layer {ms_satpy_products}")
+    (start_time, similar_netcdf_paths,
+     satpy_products_to_generate, resolution) = _prepare_satpy_products(netcdf_path, ms_satpy_products, product_config)
 
-    satpy_products_to_generate = []
-    for satpy_product in ms_satpy_products:
-
-        satpy_product_filename = f'{satpy_product}-{start_time:%Y%m%d_%H%M%S}.tif'
-        satpy_products_to_generate.append({'satpy_product': satpy_product,
-                                           'satpy_product_filename': satpy_product_filename,
-                                           'bucket': bucket})
-    
-    
     try:
         if not _generate_satpy_geotiff(similar_netcdf_paths, satpy_products_to_generate, start_time, product_config, resolution):
             logger.error(f"status_code=500, Some part of the generate failed.")
@@ -138,9 +124,46 @@ def generate_satpy_quicklook(netcdf_path: str,
                         satpy_product['bucket'],
                         layer):
             layer_no = map_object.insertLayer(layer)
-    map_object.save(os.path.join(_get_mapfiles_path(product_config), f'satpy-products-{start_time:%Y%m%d%H%M%S}.map'))
+    save_mapfile(map_object, os.path.join(_get_mapfiles_path(product_config), f'satpy-products-{start_time:%Y%m%d%H%M%S}.map'))
     return handle_request(map_object, query_string)
 
+def _prepare_satpy_products(netcdf_path, ms_satpy_products, product_config):
+    """Find start time, the similar netcdf files and the geotiffs to generate for a swath."""
+    resolution = None
+    bucket = product_config['geotiff_bucket']
+    if 'mersi2-qk' in netcdf_path:
+        resolution = 250
+    elif 'mersi2-1k' in netcdf_path:
+        resolution = 1000
+
+    (_path, _platform_name, _, _start_time, _end_time) = _parse_filename(netcdf_path, product_config)
+    start_time = datetime.strptime(_start_time, "%Y%m%d%H%M%S")
+    similar_netcdf_paths = _search_for_similar_netcdf_paths(_path, _platform_name, _start_time, _end_time, netcdf_path)
+    logger.debug(f"Similar netcdf paths: {similar_netcdf_paths}")
+
+    satpy_products_to_generate = []
+    for satpy_product in ms_satpy_products:
+
+        satpy_product_filename = f'{satpy_product}-{start_time:%Y%m%d_%H%M%S}.tif'
+        satpy_products_to_generate.append({'satpy_product': satpy_product,
+                                           'satpy_product_filename': satpy_product_filename,
+                                           'bucket': bucket})
+    return start_time, similar_netcdf_paths, satpy_products_to_generate, resolution
+
+def pregenerate_satpy_geotiff(netcdf_path, product_config, satpy_products=None):
+    """Generate and upload the geotiffs for a swath outside of a http request.
+
+    Used by the pre-generation watcher so the first request for a new pass
+    only needs to assemble the map object. netcdf_path is the full path
+    on disk. If satpy_products is not given the default_dataset from the
+    config is generated.
+    """
+    if not satpy_products:
+        satpy_products = [product_config['default_dataset']]
+    (start_time, similar_netcdf_paths,
+     satpy_products_to_generate, resolution) = _prepare_satpy_products(netcdf_path, satpy_products, product_config)
+    return _generate_satpy_geotiff(similar_netcdf_paths, satpy_products_to_generate, start_time, product_config, resolution)
+
 def _generate_layer(start_time, satpy_product, satpy_product_filename, bucket, layer):
     """Generate a layer based on the metadata from geotiff."""
     try:
@@ -191,6 +214,7 @@ def _fill_metadata_to_mapfile(orig_netcdf_path, map_object, url_scheme, netloc):
 def _generate_key(start_time, satpy_product_filename):
     return os.path.join(f'{start_time:%Y/%m/%d}', os.path.basename(satpy_product_filename))
 
+@timed('s3')
 def _upload_geotiff_to_ceph(filenames, start_time, product_config):
     """Uploads the generated GeoTIFF files to the configured S3/CEPH object store.
 
@@ -243,6 +267,7 @@ def _upload_geotiff_to_ceph(filenames, start_time, product_config):
     logger.debug(f"Done uploading")
     return True
 
+@timed('s3')
 def _exists_on_ceph(satpy_product, start_time):
     exists = False
     logger.debug(f"Start check exists")
@@ -276,6 +301,56 @@ def _exists_on_ceph(satpy_product, start_time):
         s3 = None
     return exists
 
+# Rough number of bytes in flight per swath pixel in a resample task:
+# data, lon/lat, neighbour indices and distances plus the output.
+SATPY_BYTES_PER_PIXEL = 64
+
+def _parse_memory_limit(memory_limit):
+    """Memory limit in bytes from an int or a string like '4GB' or '512MiB'."""
+    if memory_limit is None or isinstance(memory_limit, (int, float)):
+        return memory_limit
+    return dask.utils.parse_bytes(memory_limit)
+
+def _satpy_compute_config(product_config):
+    """Resolve the satpy_compute config of a product.
+
+    satpy_compute:
+      chunk_size: pixels along each side of a dask chunk. Default 2048.
+      num_workers: threads used by the dask scheduler. Default all cores.
+      memory_limit: bytes or string like '4GB'. The chunk size is reduced
+        so num_workers chunks in flight fit in this.
+      resampler: nearest, bilinear or ewa. Default nearest.
+      resampler_kwargs: extra arguments to Scene.resample.
+      cache_dir: directory for the resampling lookup tables. Only used by
+        the nearest and bilinear resamplers. Defaults to resample_cache_dir.
+    """
+    satpy_compute = product_config.get('satpy_compute') or {}
+    num_workers = int(satpy_compute.get('num_workers') or os.cpu_count() or 1)
+    chunk_size = int(satpy_compute.get('chunk_size', 2048))
+    memory_limit = _parse_memory_limit(satpy_compute.get('memory_limit'))
+    if memory_limit:
+        max_chunk_size = int(math.sqrt(memory_limit / (num_workers * SATPY_BYTES_PER_PIXEL)))
+        # Keep chunks useful. Rather use fewer threads than tiny chunks.
+        while max_chunk_size < 256 and num_workers > 1:
+            num_workers -= 1
+            max_chunk_size = int(math.sqrt(memory_limit / (num_workers * SATPY_BYTES_PER_PIXEL)))
+        if max_chunk_size < chunk_size:
+            logger.debug(f"Reduce chunk size from {chunk_size} to {max_chunk_size} to fit memory limit {memory_limit}")
+            chunk_size = max(max_chunk_size, 1)
+    resampler = satpy_compute.get('resampler', 'nearest')
+    if resampler not in ('nearest', 'bilinear', 'ewa'):
+        logger.warning(f"Unknown resampler {resampler} in satpy_compute. Use nearest.")
+        resampler = 'nearest'
+    resampler_kwargs = dict(satpy_compute.get('resampler_kwargs') or {})
+    cache_dir = satpy_compute.get('cache_dir', product_config.get('resample_cache_dir'))
+    if cache_dir and resampler in ('nearest', 'bilinear'):
+        resampler_kwargs.setdefault('cache_dir', cache_dir)
+    return {'dask': {'scheduler': 'threads',
+                     'num_workers': num_workers,
+                     'array.chunk-size': chunk_size * chunk_size * 8},
+            'resampler': resampler,
+            'resampler_kwargs': resampler_kwargs}
+
 def _generate_satpy_geotiff(netcdf_paths, satpy_products_to_generate, start_time, product_config, resolution):
     """Generate and save geotiff to local disk in omerc based on actual area."""
     return_val = True
@@ -294,8 +369,12 @@ def _generate_satpy_geotiff(netcdf_paths, satpy_products_to_generate, start_time
         traceback.print_exc()
         logger.error(f"Scene creation failed with: {str(ve)}")
         return False
+    # Chunks are decided when the data is loaded, so the config must be set for load too.
+    compute_config = _satpy_compute_config(product_config)
+    logger.debug(f"Satpy compute config: {compute_config}")
     logger.debug(f"Before load, resolution: {resolution}")
-    swath_scene.load(satpy_products, resolution=resolution)
+    with dask.config.set(compute_config['dask']):
+        swath_scene.load(satpy_products, resolution=resolution)
     logger.debug(f"Available composites names: {swath_scene.available_composite_names()}")
     proj_dict = {'proj': 'omerc',
                  'ellps': 'WGS84'}
@@ -314,9 +393,30 @@ def _generate_satpy_geotiff(netcdf_paths, satpy_products_to_generate, start_time
         # Need a backup overview area if bb_area doesn't work
         logger.debug(f"Can not compute bb area. Use euro4 as backup.")
         bb_area = 'euro4'
-    logger.debug(f"Before resample")
-    resample_scene = swath_scene.resample(bb_area)
-    logger.debug(f"Before save")
+    with dask.config.set(compute_config['dask']), stage('satpy_resample'):
+        logger.debug(f"Before resample")
+        resample_scene = swath_scene.resample(bb_area, resampler=compute_config['resampler'],
+                                              **compute_config['resampler_kwargs'])
+        logger.debug(f"Before save")
+        products_to_upload_to_ceph = _save_satpy_geotiffs(resample_scene, satpy_products_to_generate,
+                                                          satpy_products, product_config)
+    logger.debug(f"After save {str(products_to_upload_to_ceph)}")
+    if not products_to_upload_to_ceph or not _upload_geotiff_to_ceph(products_to_upload_to_ceph, resample_scene.start_time, product_config):
+        return_val = False
+    swath_scene.unload()
+    resample_scene.unload()
+    del swath_scene
+    del bb_area
+    del resample_scene
+    swath_scene = None
+    bb_area = None
+    resample_scene = None
+    return return_val
+
+def _save_satpy_geotiffs(resample_scene, satpy_products_to_generate, satpy_products, product_config):
+    """Save the resampled products as tiled geotiffs in geotiff_tmp.
+
+    Returns the products which are ready to be uploaded."""
     products_to_upload_to_ceph = []
     for _satpy_product in satpy_products_to_generate:
         if _satpy_product['satpy_product'] in satpy_products:
@@ -341,18 +441,7 @@ def _generate_satpy_geotiff(netcdf_paths, satpy_products_to_generate, start_time
                             os.path.join(product_config.get('geotiff_tmp'), _satpy_product['satpy_product_filename']))
             if os.path.exists(os.path.join(product_config.get('geotiff_tmp'), _satpy_product['satpy_product_filename'])):
                 products_to_upload_to_ceph.append(_satpy_product)
-    logger.debug(f"After save {str(products_to_upload_to_ceph)}")
-    if not products_to_upload_to_ceph or not _upload_geotiff_to_ceph(products_to_upload_to_ceph, resample_scene.start_time, product_config):
-        return_val = False
-    swath_scene.unload()
-    resample_scene.unload()
-    del swath_scene
-    del bb_area
-    del resample_scene
-    swath_scene = None
-    bb_area = None
-    resample_scene = None
-    return return_val
+    return products_to_upload_to_ceph
 
 def _parse_filename(netcdf_path, product_config):
     """Parse the netcdf to return start_time."""
@@ -0,0 +1,205 @@
+"""
+satpy pregenerate : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Watch the base_netcdf_directory of the satpy entries in the config for
+new swath files and generate and upload the default geotiff products
+before anyone asks for them. Run it next to the server with:
+
+    python -m mapgen.modules.satpy_pregenerate --workers 2
+
+The http requests for a pregenerated swath then find the geotiff on the
+object store and only need to assemble the map object.
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import traceback
+from glob import glob
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from mapgen.modules.helpers import _read_config_file
+
+logger = logging.getLogger(__name__)
+
+SATPY_MODULE = 'mapgen.modules.satellite_satpy_quicklook'
+DEFAULT_DIRECTORY_TEMPLATE = 'satellite-thredds/polar-swath/%Y/%m/%d'
+
+
+def _satpy_product_configs(regexp_config):
+    """Return the config entries handled by the satpy module which can be watched."""
+    product_configs = []
+    for product_config in regexp_config or []:
+        if product_config.get('module') != SATPY_MODULE:
+            continue
+        if 'base_netcdf_directory' not in product_config:
+            logger.warning(f"Can not watch {product_config['pattern']} without base_netcdf_directory.")
+            continue
+        product_configs.append(product_config)
+    return product_configs
+
+
+def _directories_to_watch(product_config, now, lookback_days):
+    """The day directories where new swaths for this config can show up."""
+    template = product_config.get('pregenerate_directory_template', DEFAULT_DIRECTORY_TEMPLATE)
+    directories = []
+    for days in range(lookback_days + 1):
+        directory = os.path.join(product_config['base_netcdf_directory'],
+                                 (now - timedelta(days=days)).strftime(template))
+        if directory not in directories:
+            directories.append(directory)
+    return directories
+
+
+def _find_new_swaths(product_configs, seen, now=None, lookback_days=1, settle_seconds=60):
+    """Find swath files not seen before which have not been written to for settle_seconds.
+
+    Returns a list of (netcdf_path, product_config). seen is a dict of
+    netcdf_path to (mtime, time first seen) and is updated with the
+    returned files.
+    """
+    if now is None:
+        now = datetime.utcnow()
+    new_swaths = []
+    for product_config in product_configs:
+        pattern = re.compile(product_config['pattern'])
+        for directory in _directories_to_watch(product_config, now, lookback_days):
+            for netcdf_path in sorted(glob(os.path.join(directory, '*.nc'))):
+                if not pattern.match(netcdf_path):
+                    continue
+                try:
+                    mtime = os.stat(netcdf_path).st_mtime
+                except OSError:
+                    continue
+                if netcdf_path in seen and seen[netcdf_path][0] == mtime:
+                    continue
+                if time.time() - mtime < settle_seconds:
+                    logger.debug(f"Swath {netcdf_path} still being written. Check again later.")
+                    continue
+                seen[netcdf_path] = (mtime, time.time())
+                new_swaths.append((netcdf_path, product_config))
+    return new_swaths
+
+
+def _pregenerate(netcdf_path, product_config):
+    """Worker function. Must not raise as the result is only logged."""
+    from mapgen.modules.satellite_satpy_quicklook import pregenerate_satpy_geotiff
+    try:
+        return pregenerate_satpy_geotiff(netcdf_path, product_config)
+    except Exception as e:
+        logger.error(f"Pregenerate of {netcdf_path} failed with: {str(e)}")
+        exc_info = sys.exc_info()
+        traceback.print_exception(*exc_info)
+        return False
+
+
+def _forget_old(seen, keep_seconds):
+    """Drop files from the seen list when they were first seen before the watched directories."""
+    for netcdf_path, (_, first_seen) in list(seen.items()):
+        if time.time() - first_seen > keep_seconds:
+            del seen[netcdf_path]
+
+
+def watch(product_configs, workers=2, interval=60, lookback_days=1, settle_seconds=60, once=False,
+          executor=None):
+    """Poll for new swaths and generate them with a bounded pool of worker processes.
+
+    At most workers swaths are generated at the same time. New swaths are
+    not submitted before there is a free worker, so a burst of passes is
+    handled oldest first instead of all at once.
+
+    A swath failing is not tried again before the file changes. When a
+    worker process dies, the pool is replaced and the swaths it was
+    generating are tried once more.
+    """
+    seen = {}
+    pending = {}
+    backlog = []
+    retried = set()
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            backlog.extend(_find_new_swaths(product_configs, seen, lookback_days=lookback_days,
+                                            settle_seconds=settle_seconds))
+            broken = False
+            for future, (netcdf_path, product_config) in list(pending.items()):
+                if not future.done():
+                    continue
+                del pending[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if netcdf_path not in retried:
+                        retried.add(netcdf_path)
+                        backlog.append((netcdf_path, product_config))
+                        continue
+                    result = False
+                retried.discard(netcdf_path)
+                if result:
+                    logger.info(f"Pregenerated {netcdf_path}")
+                else:
+                    logger.warning(f"Pregenerate of {netcdf_path} failed. Will retry on next change.")
+            if broken:
+                logger.error("A pregenerate worker process died. Starting a new pool.")
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=workers)
+            while backlog and len(pending) < workers:
+                netcdf_path, product_config = backlog.pop(0)
+                logger.debug(f"Submit {netcdf_path} for pregeneration")
+                pending[executor.submit(_pregenerate, netcdf_path, product_config)] = (netcdf_path, product_config)
+            _forget_old(seen, (lookback_days + 2) * 86400)
+            if once and not backlog and not pending:
+                break
+            time.sleep(1 if once else interval)
+    finally:
+        executor.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pregenerate satpy geotiffs for new satellite swaths.')
+    parser.add_argument('--config', default='url-path-regexp-patterns.yaml',
+                        help='Config file name. Looked up in ./ before --config-dir.')
+    parser.add_argument('--config-dir', default='/config')
+    parser.add_argument('--workers', type=int, default=2, help='Number of swaths to generate in parallel.')
+    parser.add_argument('--interval', type=int, default=60, help='Seconds between each scan.')
+    parser.add_argument('--lookback-days', type=int, default=1, help='Number of previous day directories to scan.')
+    parser.add_argument('--settle-seconds', type=int, default=60,
+                        help='Only handle files not modified in this many seconds.')
+    parser.add_argument('--once', action='store_true', help='Scan and generate once, then exit.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s] [%(process)d] [%(levelname)s] %(message)s')
+    product_configs = _satpy_product_configs(_read_config_file(args.config, args.config_dir, {}))
+    if not product_configs:
+        logger.error(f"No satpy entries with base_netcdf_directory in {args.config}.")
+        return 1
+    watch(product_configs, workers=args.workers, interval=args.interval, lookback_days=args.lookback_days,
+          settle_seconds=args.settle_seconds, once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
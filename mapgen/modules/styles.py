@@ -0,0 +1,294 @@
+"""
+styles : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Styles from the product config.
+
+The classes of each style are computed once, when the config is read,
+into a StyleTemplate. Adding a style to a layer then only creates the
+mapserver class objects from the template, and the config is not changed.
+
+Classification of raster styles by lookup table:
+
+With the mapserver processing keys SCALE and SCALE_BUCKETS the class
+expressions are evaluated once for each bucket instead of for each pixel,
+and a pixel is classified by looking up its bucket. The buckets are
+aligned to the style intervals, as rounded in the class expressions, so
+each bucket falls within exactly one class and the result is the same as
+evaluating the expressions. Mapserver puts values outside the scale range
+in the first or last bucket, so there is one extra bucket below the
+style and one above it, for the open ends or for no class.
+
+The last interval includes its end point. The value of the end point
+falls in the bucket starting there, so with a lookup table the last
+class ends at the end of that bucket instead. The buckets are made as
+narrow as max_buckets allows, in steps of halving, so that with integer
+intervals the bucket of the end point holds no other integer value.
+"""
+
+import math
+import logging
+from fractions import Fraction
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATION_EXPRESSION = 'expression'
+CLASSIFICATION_LUT = 'lut'
+MAX_SCALE_BUCKETS = 256
+COLORMAP_SCALE_BUCKETS = 32
+
+StyleClass = namedtuple('StyleClass', ['name', 'group', 'expression', 'rgb'])
+
+
+def classification(style_config, product_config=None):
+    """The classification mode of a style. The style setting overrides style_classification in the product config."""
+    mode = style_config.get('classification') or (product_config or {}).get('style_classification')
+    mode = (mode or CLASSIFICATION_EXPRESSION).lower()
+    if mode not in (CLASSIFICATION_EXPRESSION, CLASSIFICATION_LUT):
+        logger.warning(f"Unknown classification {mode}. Use {CLASSIFICATION_EXPRESSION}.")
+        return CLASSIFICATION_EXPRESSION
+    return mode
+
+
+def _boundary(interval):
+    """Interval boundary as written in the class expressions."""
+    return Fraction(f'{interval:0.1f}')
+
+
+def _bucket_width(intervals):
+    """Largest width dividing all intervals, as a Fraction, or None if the intervals are not increasing."""
+    boundaries = [_boundary(interval) for interval in intervals]
+    steps = [b - a for a, b in zip(boundaries[:-1], boundaries[1:])]
+    if not steps or any(step <= 0 for step in steps):
+        return None
+    denominator = math.lcm(*[step.denominator for step in steps])
+    return Fraction(math.gcd(*[int(step * denominator) for step in steps]), denominator)
+
+
+def _lut_grid(style_config, max_buckets=MAX_SCALE_BUCKETS):
+    """Return (scale_min, width, buckets), as Fractions, of the buckets for the style, or None."""
+    intervals = style_config['intervals']
+    width = _bucket_width(intervals)
+    if width is None:
+        logger.debug(f"Intervals of style {style_config.get('name')} are not increasing. Can not use lookup table.")
+        return None
+    span = _boundary(intervals[-1]) - _boundary(intervals[0])
+    # A bucket below the lowest interval, for the open lowest interval or no
+    # class, one for the end point, and one above for the open highest
+    # interval or no class.
+    buckets = int(span / width) + 3
+    if buckets > max_buckets:
+        logger.debug(f"Style {style_config.get('name')} needs {buckets} buckets. Can not use lookup table.")
+        return None
+    while int(span / width) * 2 + 3 <= max_buckets:
+        width /= 2
+    return _boundary(intervals[0]) - width, width, int(span / width) + 3
+
+
+def _scale(grid):
+    scale_min, width, buckets = grid
+    return float(scale_min), float(scale_min + width * buckets), buckets
+
+
+def lut_scale(style_config, max_buckets=MAX_SCALE_BUCKETS):
+    """Return (scale_min, scale_max, buckets) with buckets aligned to the style intervals.
+
+    Returns None if the style can not be classified with at most
+    max_buckets buckets. Then the class expressions must be evaluated per pixel.
+    """
+    grid = _lut_grid(style_config, max_buckets)
+    if grid is None:
+        return None
+    return _scale(grid)
+
+
+def set_lut_processing(layer, scale):
+    """Set the processing keys to classify by lookup table."""
+    scale_min, scale_max, buckets = scale
+    layer.setProcessingKey('SCALE', f'{scale_min!r},{scale_max!r}')
+    layer.setProcessingKey('SCALE_BUCKETS', f'{buckets}')
+
+
+def _hex_to_rgb(value: str):
+    """
+    Takes a string hex value eg. "#002147" and returns a tuple rgb (0, 33, 71)
+    Usage:
+        rgb_tuple = hex_to_rgb("#002147")
+    """
+    value = value.lstrip("#")
+    return tuple(bytes.fromhex(value))
+
+
+def count_digits_total_and_decimal(number):
+    number_is_negative = False
+    decimal_is_zero = False
+    if number < 0:
+        number_is_negative = True
+    # Ensure the number is positive for counting (ignore sign)
+    number = abs(number)
+
+    # Convert to string to handle the integer and decimal parts separately
+    num_str = str(number)
+
+    # Split the number into integer and decimal parts
+    is_decimal = False
+    if '.' in num_str:
+        base, decimal = num_str.split('.')  # Split into base and decimal parts
+        is_decimal = True
+
+        if decimal == "0":
+            decimal_is_zero = True
+    else:
+        base, decimal = num_str, ""  # No decimal part present
+
+    # Count digits in base and decimal parts
+    base_count = len(base)
+    decimal_count = len(decimal)
+    #total_count = add_place + base_count + is_decimal + decimal_count
+    return number_is_negative, base_count, is_decimal, decimal_count, decimal_is_zero
+
+def total_and_decimal_count(color_intervals):
+    numbers_is_negative = []
+    base_counts = []
+    is_decimals = []
+    decimal_counts = []
+    decimals_is_zero = []
+    for color_interval in color_intervals:
+        number_is_negative, base_count, is_decimal, decimal_count, decimal_is_zero = count_digits_total_and_decimal(color_interval)
+        numbers_is_negative.append(number_is_negative)
+        base_counts.append(base_count)
+        is_decimals.append(is_decimal)
+        decimal_counts.append(decimal_count)
+        decimals_is_zero.append(decimal_is_zero)
+
+    if all(decimals_is_zero):
+        # all of the numbers has 0 as decimal. Only use the integer part.
+        logger.debug("All decimals is 0. Don't include the decimals.")
+        total_count = max(numbers_is_negative) + max(base_counts)
+        decimal_count = 0
+    else:
+        #One or more number has not 0 as decimal.
+        logger.debug("One or more decimals is not 0. Include the decimals.")
+        total_count = max(numbers_is_negative) + max(base_counts) + max(is_decimals) + max(decimal_counts)
+        decimal_count = max(decimal_counts)
+
+    return total_count, decimal_count
+
+
+def _legend_digit_format(style_config, total_count, decimal_count):
+    if style_config.get('legend_digit_format'):
+        return style_config['legend_digit_format']
+    logger.warning("Missing legend_digit_format. Tries to detect from values")
+    first_interval = style_config['intervals'][0]
+    if isinstance(first_interval, float):
+        legend_digit_format = f'{total_count}.{decimal_count}f'
+    elif isinstance(first_interval, int):
+        legend_digit_format = f'{total_count}d'
+    else:
+        logger.warning("Could not detect. Set empty")
+        legend_digit_format = ''
+    logger.debug(f"Styling legent_digit_format is set to: {legend_digit_format}")
+    return legend_digit_format
+
+
+class StyleTemplate:
+    """The classes of a style, ready to be added to a layer."""
+
+    def __init__(self, name, classes, lut_scale=None):
+        self.name = name
+        self.classes = tuple(classes)
+        self.lut_scale = lut_scale
+
+
+def compile_style(style_config, product_config=None):
+    """Compute the classes of a style config.
+
+    The intervals use >= and < except for the last one, which includes
+    the end point. Open ends add a class below and above the intervals.
+    Classified by lookup table, the last interval ends at the end of the
+    bucket of the end point.
+    """
+    grid = None
+    if classification(style_config, product_config) == CLASSIFICATION_LUT:
+        grid = _lut_grid(style_config)
+    intervals = style_config['intervals']
+    colors = style_config['colors']
+    group = style_config['name']
+    total_count, decimal_count = total_and_decimal_count(intervals)
+    digit_format = _legend_digit_format(style_config, total_count, decimal_count)
+    extra_space_front = " " * total_count
+    classes = []
+    prev_color_interval = intervals[0]
+    interval_color_start = 0
+    interval_color_end = len(colors)
+    if style_config['open_highest_interval']:
+        interval_color_end = len(colors) - 1
+    if style_config['open_lowest_interval']:
+        # when looping in the next step skip the first color since this is handled here.
+        interval_color_start = 1
+        classes.append(StyleClass(f"{extra_space_front} < {prev_color_interval:{digit_format}}", group,
+                                  f'([pixel]<{prev_color_interval:0.1f})', _hex_to_rgb(colors[0])))
+    color_interval = intervals[0]
+    for color_interval, color in zip(intervals[1:], colors[interval_color_start:interval_color_end]):
+        name = f"{prev_color_interval:{digit_format}} - {color_interval:{digit_format}}"
+        if color_interval == intervals[-1] and grid:
+            # Is last interval, the bucket of the end point/max val is in it
+            end = float(_boundary(color_interval) + grid[1])
+            expression = f'([pixel]>={prev_color_interval:0.1f} and [pixel]<{end!r})'
+        elif color_interval == intervals[-1]:
+            # Is last interval, need to include the end point/max val
+            expression = f'([pixel]>={prev_color_interval:0.1f} and [pixel]<={color_interval:0.1f})'
+        else:
+            expression = f'([pixel]>={prev_color_interval:0.1f} and [pixel]<{color_interval:0.1f})'
+        classes.append(StyleClass(name, group, expression, _hex_to_rgb(color)))
+        prev_color_interval = color_interval
+    if style_config['open_highest_interval']:
+        if len(intervals) == 1:
+            name = f"{extra_space_front} >= {color_interval:{digit_format}}"
+            expression = f'([pixel]>={color_interval:0.1f})'
+        else:
+            name = f"{extra_space_front} > {color_interval:{digit_format}}"
+            expression = f'([pixel]>{color_interval:0.1f})'
+        classes.append(StyleClass(name, group, expression, _hex_to_rgb(colors[-1])))
+    return StyleTemplate(style_config['name'], classes, _scale(grid) if grid else None)
+
+
+def compile_styles(regexp_config):
+    """Compile the styles of all entries in the config into product_config['style_templates'].
+
+    A style which fails to compile is left out and compiled again, with
+    the error, when used.
+    """
+    for product_config in regexp_config or []:
+        if not isinstance(product_config, dict) or not product_config.get('styles'):
+            continue
+        templates = {}
+        for style_config in product_config['styles']:
+            try:
+                templates[style_config['name']] = compile_style(style_config, product_config)
+            except Exception as e:
+                logger.warning(f"Failed to compile style {style_config.get('name')}: {str(e)}")
+        product_config['style_templates'] = templates
+
+
+def style_template(style_config, product_config=None):
+    """The compiled template of style_config, compiled now if not done at config read."""
+    template = (product_config or {}).get('style_templates', {}).get(style_config['name'])
+    if template is None:
+        template = compile_style(style_config, product_config)
+    return template
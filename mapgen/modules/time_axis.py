@@ -0,0 +1,162 @@
+"""
+time axis : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Analyse a time axis to describe it as a WMS time extent.
+
+The time steps are handled as int64 seconds since epoch, so finding a
+regular, monthly or yearly range is a few numpy operations also for
+axes with tens of thousands of steps. Only the strings needed for the
+time extent are formatted.
+"""
+
+import os
+import logging
+import datetime
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+
+def _time_values_to_seconds(time_values):
+    """Return the time values as int64 seconds since 1970-01-01.
+
+    time_values is a DataArray with datetime64 or cftime values.
+    """
+    values = np.asarray(time_values.data)
+    if np.issubdtype(values.dtype, np.datetime64):
+        seconds = values.astype('datetime64[s]')
+    else:
+        # cftime values, use the date fields as the old implementation did
+        seconds = pd.to_datetime(pd.DataFrame({'year': time_values.dt.year.data,
+                                               'month': time_values.dt.month.data,
+                                               'day': time_values.dt.day.data,
+                                               'hour': time_values.dt.hour.data,
+                                               'minute': time_values.dt.minute.data,
+                                               'second': time_values.dt.second.data})).to_numpy()
+        seconds = seconds.astype('datetime64[s]')
+    return np.atleast_1d(seconds).astype(np.int64)
+
+
+def format_times(seconds):
+    """Format int64 seconds as the time strings used in the WMS time extent."""
+    return np.char.add(np.datetime_as_string(np.asarray(seconds, dtype=np.int64).astype('datetime64[s]'),
+                                             unit='s'), 'Z').tolist()
+
+
+def _yearly_step(seconds):
+    """Number of years between the steps if all steps are at new year with a constant year step, else None."""
+    stamps = seconds.astype('datetime64[s]')
+    years = stamps.astype('datetime64[Y]')
+    if np.any(years.astype('datetime64[s]') != stamps):
+        return None
+    year_diffs = np.diff(years.astype(np.int64))
+    if year_diffs[0] > 0 and np.all(year_diffs == year_diffs[0]):
+        return int(year_diffs[0])
+    return None
+
+
+def _is_monthly(seconds, diffs):
+    """All steps one calendar month apart at the same day of month and time of day."""
+    if diffs.size < 2 or np.any(diffs < 28 * SECONDS_PER_DAY) or np.any(diffs > 31 * SECONDS_PER_DAY):
+        return False
+    stamps = seconds.astype('datetime64[s]')
+    months = stamps.astype('datetime64[M]')
+    if np.any(np.diff(months.astype(np.int64)) != 1):
+        return False
+    offset_in_month = stamps - months.astype('datetime64[s]')
+    return bool(np.all(offset_in_month == offset_in_month[0]))
+
+
+def analyse_time_axis(seconds):
+    """Describe a time axis given as int64 seconds.
+
+    Returns a dict with:
+        is_range: if the axis can be given as start/end/diff
+        diff: datetime.timedelta for a regular axis, or 'P1M'/'PnY'
+        diff_string: the ISO 8601 duration of the range
+        start_time, end_time: first and last time of the range
+        time_list: all times in the original order if not a range
+    """
+    seconds = np.atleast_1d(np.asarray(seconds, dtype=np.int64))
+    result = {'is_range': False, 'diff': None, 'diff_string': None,
+              'start_time': None, 'end_time': None, 'time_list': None}
+    diff = None
+    if seconds.size > 1:
+        diffs = np.diff(seconds)
+        year_step = _yearly_step(seconds)
+        if year_step:
+            diff = f"P{year_step}Y"
+        elif _is_monthly(seconds, diffs):
+            diff = "P1M"
+        elif diffs[0] > 0 and np.all(diffs == diffs[0]):
+            diff = datetime.timedelta(seconds=int(diffs[0]))
+        else:
+            logger.debug("Time steps are not regular. Can not use range.")
+    else:
+        logger.debug(f"Time diff len {seconds.size}")
+    if diff is not None:
+        start_time, end_time = format_times([seconds.min(), seconds.max()])
+        result.update({'is_range': True, 'diff': diff, 'diff_string': _get_time_diff(diff),
+                       'start_time': start_time, 'end_time': end_time})
+        logger.debug(f"DIFF STRING {result['diff_string']}")
+    else:
+        logger.debug("Is not range")
+        result['time_list'] = format_times(seconds)
+        result['start_time'] = result['time_list'][0]
+    return result
+
+
+def _get_time_diff(diff):
+    if isinstance(diff, str) and (diff == 'P1M' or (diff.startswith('P') and diff.endswith('Y'))):
+        diff_string = diff
+    elif diff < datetime.timedelta(hours=1):
+        h = int(diff.seconds/60)
+        diff_string = f"PT{h}M"
+    elif diff < datetime.timedelta(hours=24):
+        h = int(diff.seconds/3600)
+        diff_string = f"PT{h}H"
+    else:
+        diff_string = f"P{diff.days}D"
+    return diff_string
+
+
+def time_axis(ds, dim_name, shared_cache=None, netcdf_file=None):
+    """Analysed time axis of dim_name in ds.
+
+    With shared_cache and netcdf_file the result is cached until the file is modified.
+    """
+    cache_key = None
+    mtime = None
+    if shared_cache is not None and netcdf_file:
+        try:
+            mtime = os.stat(netcdf_file).st_mtime
+            cache_key = f'time-axis-{netcdf_file}-{dim_name}'
+        except OSError:
+            pass
+    if cache_key:
+        cached = shared_cache.get(cache_key)
+        if cached is not None and cached['mtime'] == mtime:
+            return cached['axis']
+    axis = analyse_time_axis(_time_values_to_seconds(ds[dim_name]))
+    if cache_key:
+        shared_cache[cache_key] = {'mtime': mtime, 'axis': axis}
+    return axis
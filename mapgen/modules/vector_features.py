@@ -0,0 +1,134 @@
+"""
+vector features : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Wind barbs and vectors as point features computed with numpy.
+
+The u/v grid is decimated to about one point per spacing image pixels
+within the requested bounding box. Speed, angle and the wind barb symbol
+of each point are computed here, so mapserver only draws the points
+with the symbol given by the feature attributes. The speed ranges of the
+barb symbols are the same as the class expressions of the UVRASTER
+wind barb layer.
+"""
+
+import math
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KNOTS_PER_METER_PER_SECOND = 1.94384449
+FEATURE_ITEMS = ['uv_length', 'uv_angle', 'barb', 'flags']
+# Number of points along each side of the bounding box when transforming it.
+BBOX_EDGE_SAMPLES = 21
+
+
+def barb_symbols(speed):
+    """Wind barb symbol name and flag count for each speed in m/s.
+
+    Returns (barb, flags, drawable). flags is 'calm', '0', '1' or '2'.
+    Speeds from 103 knots and up have no symbol and are not drawable.
+    """
+    knots = np.asarray(speed, dtype=np.float64) * KNOTS_PER_METER_PER_SECOND
+    barb = np.full(knots.shape, 'wind_barb_0', dtype=object)
+    flags = np.full(knots.shape, 'calm', dtype=object)
+    barbs = (knots >= 3) & (knots < 48)
+    barb[barbs] = ['wind_barb_' + str(5 + 5 * int(b)) for b in (knots[barbs] - 3) // 5]
+    flags[barbs] = '0'
+    one_flag = (knots >= 48) & (knots < 98)
+    barb[one_flag] = ['wind_barb_' + str(50 + 5 * int(b)) for b in (knots[one_flag] - 48) // 5]
+    flags[one_flag] = '1'
+    two_flags = (knots >= 98) & (knots < 103)
+    barb[two_flags] = 'wind_barb_100'
+    flags[two_flags] = '2'
+    drawable = np.isfinite(knots) & (knots < 103)
+    return barb, flags, drawable
+
+
+def _stride(count, image_size, spacing):
+    points_wanted = max(1, int(image_size) // max(1, int(spacing)))
+    return max(1, math.ceil(count / points_wanted))
+
+
+def decimate(x_coords, y_coords, bbox=None, width=None, height=None, spacing=12):
+    """Grid indices (y_index, x_index) of the points to draw.
+
+    bbox is (min_x, min_y, max_x, max_y) in the grid coordinates. Without
+    bbox the whole grid is used, without width and height every spacing
+    grid point is used.
+    """
+    x_coords = np.asarray(x_coords)
+    y_coords = np.asarray(y_coords)
+    if bbox is not None:
+        x_index = np.nonzero((x_coords >= bbox[0]) & (x_coords <= bbox[2]))[0]
+        y_index = np.nonzero((y_coords >= bbox[1]) & (y_coords <= bbox[3]))[0]
+    else:
+        x_index = np.arange(x_coords.size)
+        y_index = np.arange(y_coords.size)
+    if width and height:
+        x_index = x_index[::_stride(x_index.size, width, spacing)]
+        y_index = y_index[::_stride(y_index.size, height, spacing)]
+    else:
+        x_index = x_index[::max(1, int(spacing))]
+        y_index = y_index[::max(1, int(spacing))]
+    return y_index, x_index
+
+
+def point_features(x_coords, y_coords, u, v, y_index, x_index):
+    """Point features at the grid indices from the u and v components along the grid axes.
+
+    Returns a dict with the arrays x, y and the FEATURE_ITEMS. Points
+    without data or with speed above the barb symbols are left out.
+    """
+    u = np.asarray(u)[np.ix_(y_index, x_index)].ravel().astype(np.float64)
+    v = np.asarray(v)[np.ix_(y_index, x_index)].ravel().astype(np.float64)
+    x, y = np.meshgrid(np.asarray(x_coords)[x_index], np.asarray(y_coords)[y_index])
+    uv_length = np.hypot(u, v)
+    uv_angle = np.degrees(np.arctan2(v, u))
+    barb, flags, drawable = barb_symbols(uv_length)
+    keep = drawable & np.isfinite(uv_angle)
+    return {'x': x.ravel()[keep], 'y': y.ravel()[keep],
+            'uv_length': uv_length[keep], 'uv_angle': uv_angle[keep],
+            'barb': barb[keep], 'flags': flags[keep]}
+
+
+def bbox_in_grid_crs(bbox, request_crs, grid_proj, always_xy=False):
+    """Transform the requested bbox to the grid projection.
+
+    always_xy should be True for WMS 1.1.1 (SRS, always x/y order) and
+    False for WMS 1.3.0 (CRS, axis order of the crs). Returns None if the
+    transform fails.
+    """
+    from pyproj import Transformer
+    try:
+        transformer = Transformer.from_crs(request_crs, grid_proj, always_xy=always_xy)
+        first = np.linspace(bbox[0], bbox[2], BBOX_EDGE_SAMPLES)
+        second = np.linspace(bbox[1], bbox[3], BBOX_EDGE_SAMPLES)
+        edge_first = np.concatenate((first, first, np.full(BBOX_EDGE_SAMPLES, bbox[0]), np.full(BBOX_EDGE_SAMPLES, bbox[2])))
+        edge_second = np.concatenate((np.full(BBOX_EDGE_SAMPLES, bbox[1]), np.full(BBOX_EDGE_SAMPLES, bbox[3]), second, second))
+        x, y = transformer.transform(edge_first, edge_second)
+    except Exception as e:
+        logger.debug(f"Failed to transform bbox {bbox} from {request_crs}: {str(e)}")
+        return None
+    x = np.asarray(x)
+    y = np.asarray(y)
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not np.any(valid):
+        return None
+    return float(x[valid].min()), float(y[valid].min()), float(x[valid].max()), float(y[valid].max())
@@ -0,0 +1,244 @@
+"""
+worker recycling : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Memory bounded worker processes for the builtin http server.
+
+The supervisor process does the warm up and never serves requests
+itself. It forks WORKERS worker processes (default 1) serving the same
+listening socket, so a new worker starts warm. Each worker watches its
+own resident set size and asks to be recycled when
+
+    the RSS passes WORKER_MAX_RSS, like 2G (default unset),
+    the RSS has grown WORKER_MAX_RSS_GROWTH, default 512M, above the RSS
+        measured after WORKER_WARMUP_REQUESTS requests (default 10), or
+    the RSS grows more than WORKER_MAX_LEAK_RATE per request, like 2M
+        (default unset), over the last WORKER_LEAK_WINDOW requests
+        (default 20).
+
+The supervisor then starts the replacement first, and when it is
+serving, lets the old worker finish the request it is processing and
+exit. A worker still busy WORKER_DRAIN_TIMEOUT seconds later (default
+the request timeout and grace) is terminated. A worker that dies is
+replaced.
+"""
+
+import os
+import time
+import logging
+import resource
+import threading
+from collections import deque
+from multiprocessing import Process, Event
+
+from mapgen.modules import deadline
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+POLL_INTERVAL = 1.
+
+
+def parse_size(value):
+    """Bytes in a size like 512M, 1.5G or 1048576. None for an empty value."""
+    if value is None or not str(value).strip():
+        return None
+    value = str(value).strip().upper().removesuffix('B')
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(float(value))
+
+
+def rss_bytes(pid='self'):
+    """The resident set size of a process, from /proc.
+
+    Without /proc, the peak RSS of this process.
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if pid != 'self':
+            raise
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryWatch:
+    """The RSS of a worker after its requests, and whether it should be recycled."""
+
+    def __init__(self, max_rss=None, max_growth=None, max_leak_rate=None, warmup_requests=10, window=20):
+        self.max_rss = max_rss
+        self.max_growth = max_growth
+        self.max_leak_rate = max_leak_rate
+        self.warmup_requests = warmup_requests
+        self.baseline = None
+        self.rss = None
+        self.samples = deque(maxlen=max(window, 2))
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        return cls(parse_size(environ.get('WORKER_MAX_RSS')),
+                   parse_size(environ.get('WORKER_MAX_RSS_GROWTH', '512M')),
+                   parse_size(environ.get('WORKER_MAX_LEAK_RATE')),
+                   int(environ.get('WORKER_WARMUP_REQUESTS', 10)),
+                   int(environ.get('WORKER_LEAK_WINDOW', 20)))
+
+    def observe(self, requests, rss):
+        """Record the RSS after requests requests."""
+        self.rss = rss
+        if requests < self.warmup_requests:
+            return
+        if self.baseline is None:
+            self.baseline = rss
+        self.samples.append((requests, rss))
+
+    def leak_rate(self):
+        """Least squares growth in bytes per request over the window, None until the window is full."""
+        if len(self.samples) < self.samples.maxlen:
+            return None
+        n = len(self.samples)
+        mean_requests = sum(r for r, _ in self.samples) / n
+        mean_rss = sum(m for _, m in self.samples) / n
+        variance = sum((r - mean_requests) ** 2 for r, _ in self.samples)
+        if not variance:
+            return None
+        return sum((r - mean_requests) * (m - mean_rss) for r, m in self.samples) / variance
+
+    def reason(self):
+        """Why the worker should be recycled, or None."""
+        if self.rss is None:
+            return None
+        if self.max_rss and self.rss > self.max_rss:
+            return f"RSS {self.rss} bytes above {self.max_rss}"
+        if self.max_growth and self.baseline is not None and self.rss - self.baseline > self.max_growth:
+            return f"RSS grew {self.rss - self.baseline} bytes since warm up, above {self.max_growth}"
+        leak_rate = self.leak_rate()
+        if self.max_leak_rate and leak_rate is not None and leak_rate > self.max_leak_rate:
+            return f"RSS grows {leak_rate:.0f} bytes per request, above {self.max_leak_rate}"
+        return None
+
+
+class WorkerMonitor(threading.Thread):
+    """Watch the RSS of this worker, ask for recycling, and stop the server when drained."""
+
+    def __init__(self, web_server, watch, requests, recycle, drain, poll_interval=POLL_INTERVAL):
+        super().__init__(daemon=True)
+        self.web_server = web_server
+        self.watch = watch
+        self.requests = requests
+        self.recycle = recycle
+        self.drain = drain
+        self.poll_interval = poll_interval
+
+    def run(self):
+        observed = None
+        while not self.drain.wait(self.poll_interval):
+            requests = self.requests()
+            if requests == observed:
+                continue
+            observed = requests
+            self.watch.observe(requests, rss_bytes())
+            reason = self.watch.reason()
+            if reason and not self.recycle.is_set():
+                logger.info(f"Recycling worker {os.getpid()} after {requests} requests: {reason}")
+                self.recycle.set()
+        logger.info(f"Draining worker {os.getpid()}")
+        # Waits for the request being processed
+        self.web_server.shutdown()
+
+
+class Worker:
+
+    def __init__(self, target, args):
+        self.ready = Event()
+        self.recycle = Event()
+        self.drain = Event()
+        self.replacement = None
+        self.drain_started = None
+        self.process = Process(target=target, args=(*args, self.ready, self.recycle, self.drain))
+        self.process.start()
+
+
+class Supervisor:
+    """Keep worker processes running target(*args, ready, recycle, drain), recycling them on request."""
+
+    def __init__(self, target, args=(), workers=1, drain_timeout=None, poll_interval=POLL_INTERVAL):
+        self.target = target
+        self.args = args
+        self.number_of_workers = workers
+        self.drain_timeout = (deadline.REQUEST_TIMEOUT + deadline.TERMINATE_GRACE
+                              if drain_timeout is None else drain_timeout)
+        self.poll_interval = poll_interval
+        self.workers = []
+
+    @classmethod
+    def from_environ(cls, target, args=(), environ=os.environ):
+        drain_timeout = environ.get('WORKER_DRAIN_TIMEOUT')
+        return cls(target, args, int(environ.get('WORKERS', 1)),
+                   float(drain_timeout) if drain_timeout else None)
+
+    def spawn(self):
+        worker = Worker(self.target, self.args)
+        self.workers.append(worker)
+        logger.info(f"Started worker {worker.process.pid}")
+        return worker
+
+    def poll(self):
+        """Replace dead workers and recycle the workers asking for it."""
+        while len(self.workers) < self.number_of_workers:
+            self.spawn()
+        for worker in list(self.workers):
+            if not worker.process.is_alive():
+                worker.process.join()
+                self.workers.remove(worker)
+                if worker.drain_started is None:
+                    logger.warning(f"Worker {worker.process.pid} died with exit code {worker.process.exitcode}")
+                    if worker.replacement is None:
+                        self.spawn()
+                else:
+                    logger.info(f"Worker {worker.process.pid} drained")
+            elif worker.drain_started is not None:
+                if time.monotonic() - worker.drain_started > self.drain_timeout:
+                    logger.warning(f"Worker {worker.process.pid} did not drain in time. Terminating it.")
+                    deadline.terminate(worker.process)
+            elif worker.recycle.is_set() and worker.replacement is None:
+                worker.replacement = self.spawn()
+            elif worker.replacement is not None and (worker.replacement.ready.is_set() or
+                                                     not worker.replacement.process.is_alive()):
+                worker.drain_started = time.monotonic()
+                worker.drain.set()
+
+    def run(self):
+        """Supervise until interrupted, then drain all workers."""
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.drain.set()
+        for worker in self.workers:
+            worker.process.join(self.drain_timeout)
+            if worker.process.is_alive():
+                deadline.terminate(worker.process)
+        self.workers = []
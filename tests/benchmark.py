@@ -0,0 +1,253 @@
+"""
+benchmark : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmark of the quicklook request types.
+
+Runs GetCapabilities, GetMap raster, contour and wind barbs and
+GetLegendGraphic against tests/data/test_arome_arctic.nc or a synthetic
+arome arctic like grid of the given size, and reports throughput,
+p50/p95/p99 latency and peak RSS for each request type:
+
+    python -m tests.benchmark --requests 20
+    python -m tests.benchmark --grid 1000x1000 --times 24 --concurrency 4 --driver wsgi
+    python -m tests.benchmark --save-baseline baseline.json
+    python -m tests.benchmark --baseline baseline.json --max-regression 0.2
+
+The driver get_quicklook calls get_quicklook in this process, or in a
+pool of processes with --concurrency. The driver wsgi calls the WSGI app
+from --concurrency threads, which forks a process per request as the
+server does. The CSW is not asked for summaries.
+
+Not collected by pytest.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import datetime
+import tempfile
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from tests.synthetic_corpus import write_arome
+
+logger = logging.getLogger(__name__)
+
+TEST_NETCDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'test_arome_arctic.nc')
+CONFIG_FILENAME = 'url-path-regexp-patterns.yaml'
+BBOX_3857 = '-4822584.097826986,7566329.44660393,10215292.880334288,24819695.471091438'
+SCENARIOS = {
+    'getcapabilities': 'SERVICE=WMS&VERSION=1.3.0&REQUEST=GetCapabilities',
+    'getmap_raster': ('SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&LAYERS=air_temperature_2m&WIDTH=767&HEIGHT=880&'
+                      f'CRS=EPSG%3A3857&BBOX={BBOX_3857}&STYLES=raster&FORMAT=image/png&TRANSPARENT=TRUE&TIME={{time}}'),
+    'getmap_contour': ('SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&LAYERS=air_pressure_at_sea_level&WIDTH=767&HEIGHT=880&'
+                       f'CRS=EPSG%3A3857&BBOX={BBOX_3857}&STYLES=contour&FORMAT=image/png&TRANSPARENT=TRUE&TIME={{time}}'),
+    'getmap_wind_barbs': ('SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&LAYERS=wind_10m_vector&WIDTH=767&HEIGHT=880&'
+                          f'CRS=EPSG%3A3857&BBOX={BBOX_3857}&STYLES=Wind_Barbs&FORMAT=image/png&TRANSPARENT=TRUE&'
+                          'TIME={time}&DIM_SPACING=32&DIM_COLOUR=light-green'),
+    'getlegendgraphic': ('SERVICE=WMS&VERSION=1.3.0&REQUEST=GetLegendGraphic&LAYER=air_temperature_2m&'
+                         'FORMAT=image/png&SLD_VERSION=1.1.0&STYLE=raster'),
+}
+# Time step of the synthetic grids, and the requested time in the test file
+SYNTHETIC_START = np.datetime64('2024-11-11T06:00:00')
+
+
+def _benchmark_summary(*args, **kwargs):
+    """Summary instead of asking the CSW. A plain function, so it can be sent to the prefetch thread."""
+    return "Benchmark dataset."
+
+
+def write_synthetic_grid(path, nx=200, ny=200, times=2, variables=None):
+    """Write an arome arctic like lambert grid with nx * ny points and times hourly steps."""
+    return write_arome(path, nx, ny, times=times, reference_time=SYNTHETIC_START.astype(datetime.datetime),
+                       variables=variables)
+
+
+def product_config(netcdf_file, mapfiles_path):
+    return {'pattern': rf'^/?({re.escape(os.path.basename(netcdf_file))})$',
+            'base_netcdf_directory': os.path.dirname(os.path.abspath(netcdf_file)),
+            'module': 'mapgen.modules.arome_arctic_quicklook',
+            'module_function': 'arome_arctic_quicklook',
+            'mapfiles_path': mapfiles_path}
+
+
+def _seed_config(shared_cache, config):
+    from mapgen.modules.styles import compile_styles
+    regexp_config = [config]
+    compile_styles(regexp_config)
+    shared_cache[CONFIG_FILENAME] = regexp_config
+
+
+def _quicklook_request(netcdf_path, query_string, config):
+    """One get_quicklook request. Returns (seconds, response_code)."""
+    from mapgen.modules.get_quicklook import get_quicklook
+    shared_cache = _quicklook_request.shared_cache
+    if CONFIG_FILENAME not in shared_cache:
+        _seed_config(shared_cache, config)
+    with patch('mapgen.modules.helpers._find_summary_from_csw', new=_benchmark_summary):
+        start = time.perf_counter()
+        response_code, _, _ = get_quicklook(netcdf_path, query_string, 'localhost', 'http', shared_cache, products=[])
+        return time.perf_counter() - start, response_code
+
+
+# Per process, kept between the requests as in a server
+_quicklook_request.shared_cache = {}
+
+
+def _wsgi_request(app, netcdf_path, query_string):
+    environ = {'PATH_INFO': f'/api/get_quicklook{netcdf_path}', 'QUERY_STRING': query_string,
+               'REQUEST_METHOD': 'GET', 'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http'}
+    status = []
+    start = time.perf_counter()
+    app(environ, lambda response_code, headers: status.append(response_code))
+    return time.perf_counter() - start, status[0]
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process and of the largest finished child process, in MB."""
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def summarize(latencies, response_codes, wall_time):
+    """Throughput and latency percentiles of a run."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    errors = sum(1 for code in response_codes if not str(code).startswith('200'))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies.size else (np.nan,) * 3
+    self_rss, children_rss = _peak_rss_mb()
+    return {'requests': int(latencies.size), 'errors': errors,
+            'throughput': latencies.size / wall_time if wall_time > 0 else 0.,
+            'p50_ms': float(p50) * 1000, 'p95_ms': float(p95) * 1000, 'p99_ms': float(p99) * 1000,
+            'peak_rss_mb': round(self_rss, 1), 'peak_child_rss_mb': round(children_rss, 1)}
+
+
+def run_scenario(driver, netcdf_path, query_string, config, requests, concurrency):
+    if driver == 'wsgi':
+        import mapgen.main
+        _seed_config(mapgen.main.shared_cache, config)
+        with ThreadPoolExecutor(concurrency) as executor:
+            start = time.perf_counter()
+            results = list(executor.map(lambda _: _wsgi_request(mapgen.main.app, netcdf_path, query_string),
+                                        range(requests)))
+            wall_time = time.perf_counter() - start
+    elif concurrency > 1:
+        with ProcessPoolExecutor(concurrency) as executor:
+            start = time.perf_counter()
+            results = list(executor.map(_quicklook_request, [netcdf_path] * requests, [query_string] * requests,
+                                        [config] * requests))
+            wall_time = time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        results = [_quicklook_request(netcdf_path, query_string, config) for _ in range(requests)]
+        wall_time = time.perf_counter() - start
+    return summarize([r[0] for r in results], [r[1] for r in results], wall_time)
+
+
+def compare(results, baseline, max_regression=None):
+    """Print results against the baseline. Returns the scenarios with p50 slower than max_regression."""
+    regressions = []
+    print(f"{'scenario':<20} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8} {'p50 change':>11}")
+    for name, result in results.items():
+        change = ''
+        base = (baseline or {}).get(name)
+        if base and base.get('p50_ms'):
+            ratio = result['p50_ms'] / base['p50_ms'] - 1
+            change = f'{ratio:+.1%}'
+            if max_regression is not None and ratio > max_regression:
+                regressions.append(name)
+        print(f"{name:<20} {result['throughput']:>9.2f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['p99_ms']:>9.1f} {max(result['peak_rss_mb'], result['peak_child_rss_mb']):>8.1f} {change:>11}")
+        if result['errors']:
+            print(f"{'':<20} {result['errors']} of {result['requests']} requests failed")
+    return regressions
+
+
+def _grid_size(value):
+    try:
+        nx, ny = (int(n) for n in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Grid size must be NXxNY, got {value}")
+    return nx, ny
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the quicklook request types.')
+    parser.add_argument('--grid', type=_grid_size, help='Synthetic grid size NXxNY. Default is the test file.')
+    parser.add_argument('--times', type=int, default=2, help='Time steps of the synthetic grid.')
+    parser.add_argument('--variables', nargs='*', help='Variables of the synthetic grid. Default all.')
+    parser.add_argument('--scenarios', nargs='*', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=10, help='Requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=1, help='Requests per scenario before measuring.')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--driver', choices=['get_quicklook', 'wsgi'], default='get_quicklook')
+    parser.add_argument('--baseline', help='Compare against results saved with --save-baseline.')
+    parser.add_argument('--save-baseline', help='Save the results as json.')
+    parser.add_argument('--max-regression', type=float,
+                        help='Exit with 1 if p50 of a scenario is this fraction slower than the baseline.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    work_dir = tempfile.mkdtemp(prefix='mapgen-benchmark-')
+    try:
+        mapfiles_path = os.path.join(work_dir, 'mapfiles')
+        os.makedirs(mapfiles_path)
+        if args.grid:
+            netcdf_file = write_synthetic_grid(os.path.join(work_dir, 'synthetic_grid.nc'), args.grid[0], args.grid[1],
+                                               args.times, args.variables)
+        else:
+            netcdf_file = TEST_NETCDF
+        requested_time = str(SYNTHETIC_START + np.timedelta64(1 if args.times > 1 or not args.grid else 0, 'h')) + 'Z'
+        config = product_config(netcdf_file, mapfiles_path)
+        netcdf_path = '/' + os.path.basename(netcdf_file)
+        results = {}
+        with patch('mapgen.modules.helpers._find_summary_from_csw', new=_benchmark_summary):
+            for name in args.scenarios:
+                query_string = SCENARIOS[name].format(time=requested_time.replace(':', '%3A'))
+                if args.warmup:
+                    run_scenario(args.driver, netcdf_path, query_string, config, args.warmup, 1)
+                results[name] = run_scenario(args.driver, netcdf_path, query_string, config,
+                                             args.requests, args.concurrency)
+        results_info = {'grid': args.grid and 'x'.join(str(n) for n in args.grid) or 'test_arome_arctic.nc',
+                        'times': args.times, 'driver': args.driver, 'concurrency': args.concurrency}
+        print(json.dumps(results_info))
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.max_regression)
+        if args.save_baseline:
+            with open(args.save_baseline, 'w') as f:
+                json.dump({'info': results_info, 'results': results}, f, indent=2)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if regressions:
+        print(f"Slower than baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+synthetic corpus : module
+====================
+
+Copyright 2025 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Write a corpus of synthetic CF netcdf files shaped like the production
+data, with the config entries to serve it:
+
+    python -m tests.synthetic_corpus /tmp/corpus --preset small
+    python -m tests.synthetic_corpus /tmp/corpus --preset production --datasets kss swath
+    python -m tests.synthetic_corpus /tmp/corpus --arome-grid 739x949 --arome-times 67
+
+Datasets:
+    arome: AROME Arctic 2.5km lambert grid with 2m temperature, mean sea
+        level pressure and 10m wind.
+    meps: MEPS 2.5km lambert grid with temperature and wind on pressure
+        levels for each ensemble member.
+    kss: KSS 1km Norway UTM 33 climate grid with a daily time step, one
+        file per year and an ncml aggregating them.
+    swath: lon/lat swath without grid mapping, served with resample_to_grid.
+
+The url-path-regexp-patterns.yaml written next to the data serves the
+corpus with base_netcdf_directory set to the output directory. The data
+is written one time step at a time, so large grids do not need the
+memory of the whole file.
+"""
+
+import os
+import sys
+import logging
+import argparse
+import datetime
+
+import yaml
+import netCDF4
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILENAME = 'url-path-regexp-patterns.yaml'
+REFERENCE_TIME = datetime.datetime(2024, 11, 11, 6)
+EPOCH_UNITS = 'seconds since 1970-01-01 00:00:00 +00:00'
+KSS_TIME_UNITS = 'days since 1950-01-01 00:00:00'
+AROME_PROJ4 = '+proj=lcc +lat_0=77.5 +lon_0=-25 +lat_1=77.5 +lat_2=77.5 +R=6371000 +units=m +no_defs'
+MEPS_PROJ4 = '+proj=lcc +lat_0=63.3 +lon_0=15 +lat_1=63.3 +lat_2=63.3 +R=6371000 +units=m +no_defs'
+UTM33_PROJ4 = '+proj=utm +zone=33 +ellps=WGS84 +units=m +no_defs'
+PRESETS = {
+    'small': {'arome_grid': (100, 120), 'arome_times': 6,
+              'meps_grid': (90, 110), 'meps_times': 6, 'meps_pressure': 4, 'meps_members': 3,
+              'kss_grid': (120, 150), 'kss_years': 2, 'kss_days': 365,
+              'swath_size': (200, 400)},
+    'production': {'arome_grid': (739, 949), 'arome_times': 67,
+                   'meps_grid': (949, 1069), 'meps_times': 62, 'meps_pressure': 13, 'meps_members': 15,
+                   'kss_grid': (1195, 1550), 'kss_years': 10, 'kss_days': 365,
+                   'swath_size': (2048, 6000)},
+}
+DATASETS = ('arome', 'meps', 'kss', 'swath')
+
+
+def _lambert_grid(nx, ny, dx, x0, y0, proj4):
+    """x, y and the 2D longitude, latitude of a lambert grid centred at x0, y0."""
+    from pyproj import CRS, Transformer
+    x = (np.arange(nx) * dx - nx * dx / 2 + x0).astype(np.float32)
+    y = (np.arange(ny) * dx - ny * dx / 2 + y0).astype(np.float32)
+    transformer = Transformer.from_crs(CRS.from_proj4(proj4), 'EPSG:4326', always_xy=True)
+    longitude, latitude = transformer.transform(*np.meshgrid(x, y))
+    return x, y, longitude, latitude
+
+
+def _field(rng, shape, mean, spread):
+    return (mean + spread * rng.standard_normal(shape)).astype(np.float32)
+
+
+def _add_coordinate(nc, name, values, attrs, dtype=None):
+    variable = nc.createVariable(name, dtype or np.asarray(values).dtype, (name,))
+    variable.setncatts(attrs)
+    variable[:] = values
+    return variable
+
+
+def _add_lonlat(nc, longitude, latitude, dims=('y', 'x')):
+    for name, values, units in (('longitude', longitude, 'degree_east'), ('latitude', latitude, 'degree_north')):
+        variable = nc.createVariable(name, 'f8', dims, zlib=True)
+        variable.setncatts({'standard_name': name, 'units': units})
+        variable[:] = values
+
+
+def _add_lambert(nc, name, lat0, lon0):
+    projection = nc.createVariable(name, 'i4')
+    projection.setncatts({'grid_mapping_name': 'lambert_conformal_conic',
+                          'standard_parallel': [lat0, lat0],
+                          'longitude_of_central_meridian': lon0,
+                          'latitude_of_projection_origin': lat0,
+                          'earth_radius': 6371000.})
+
+
+def _add_reference_time(nc, reference_time):
+    frt = nc.createVariable('forecast_reference_time', 'f8')
+    frt.setncatts({'standard_name': 'forecast_reference_time', 'units': EPOCH_UNITS})
+    frt.assignValue(netCDF4.date2num(reference_time, EPOCH_UNITS))
+
+
+def _hourly_times(reference_time, times):
+    return [reference_time + datetime.timedelta(hours=h) for h in range(times)]
+
+
+def write_arome(path, nx=100, ny=120, times=6, reference_time=REFERENCE_TIME, variables=None, seed=0):
+    """AROME Arctic like file. Variables and dimension names as in the production files."""
+    rng = np.random.default_rng(seed)
+    x, y, longitude, latitude = _lambert_grid(nx, ny, 2500., 278603.6, -898000., AROME_PROJ4)
+    fields = {'air_temperature_2m': ('height1', 2., 'air_temperature', 'K', 274, 5),
+              'air_pressure_at_sea_level': ('height_above_msl', 0., 'air_pressure_at_sea_level', 'Pa', 101000, 1000),
+              'x_wind_10m': ('height7', 10., 'x_wind', 'm/s', 0, 10),
+              'y_wind_10m': ('height7', 10., 'y_wind', 'm/s', 0, 10)}
+    if variables:
+        fields = {k: v for k, v in fields.items() if k in variables}
+    with netCDF4.Dataset(path, 'w') as nc:
+        nc.setncatts({'Conventions': 'CF-1.6, ACDD', 'title': 'Synthetic AROME_Arctic 2.5km',
+                      'source': 'AROME-Arctic 2.5km'})
+        nc.createDimension('time', None)
+        nc.createDimension('x', nx)
+        nc.createDimension('y', ny)
+        _add_coordinate(nc, 'time', netCDF4.date2num(_hourly_times(reference_time, times), EPOCH_UNITS),
+                        {'standard_name': 'time', 'units': EPOCH_UNITS}, 'f8')
+        _add_coordinate(nc, 'x', x, {'standard_name': 'projection_x_coordinate', 'units': 'm'})
+        _add_coordinate(nc, 'y', y, {'standard_name': 'projection_y_coordinate', 'units': 'm'})
+        for height_dim, height, *_ in fields.values():
+            if height_dim not in nc.dimensions:
+                nc.createDimension(height_dim, 1)
+                _add_coordinate(nc, height_dim, np.array([height], dtype=np.float32),
+                                {'units': 'm', 'positive': 'up'})
+        _add_lonlat(nc, longitude, latitude)
+        _add_lambert(nc, 'projection_lambert', 77.5, -25.)
+        _add_reference_time(nc, reference_time)
+        for name, (height_dim, _, standard_name, units, mean, spread) in fields.items():
+            variable = nc.createVariable(name, 'f4', ('time', height_dim, 'y', 'x'), zlib=True,
+                                         chunksizes=(1, 1, ny, nx))
+            variable.setncatts({'standard_name': standard_name, 'units': units, 'grid_mapping': 'projection_lambert'})
+            for t in range(times):
+                variable[t, 0] = _field(rng, (ny, nx), mean, spread)
+    return path
+
+
+def write_meps_pl(path, nx=90, ny=110, times=6, pressure_levels=4, members=3, reference_time=REFERENCE_TIME, seed=0):
+    """MEPS pressure level file with an ensemble_member dimension."""
+    rng = np.random.default_rng(seed)
+    x, y, longitude, latitude = _lambert_grid(nx, ny, 2500., 0., 0., MEPS_PROJ4)
+    pressure = np.linspace(1000, 300, pressure_levels).round().astype(np.float32)
+    with netCDF4.Dataset(path, 'w') as nc:
+        nc.setncatts({'Conventions': 'CF-1.6, ACDD', 'title': 'Synthetic MEPS 2.5km pressure levels'})
+        nc.createDimension('time', None)
+        nc.createDimension('pressure', pressure_levels)
+        nc.createDimension('ensemble_member', members)
+        nc.createDimension('x', nx)
+        nc.createDimension('y', ny)
+        _add_coordinate(nc, 'time', netCDF4.date2num(_hourly_times(reference_time, times), EPOCH_UNITS),
+                        {'standard_name': 'time', 'units': EPOCH_UNITS}, 'f8')
+        _add_coordinate(nc, 'pressure', pressure, {'standard_name': 'air_pressure', 'units': 'hPa',
+                                                   'positive': 'down'})
+        _add_coordinate(nc, 'ensemble_member', np.arange(members, dtype=np.int32),
+                        {'standard_name': 'realization'})
+        _add_coordinate(nc, 'x', x, {'standard_name': 'projection_x_coordinate', 'units': 'm'})
+        _add_coordinate(nc, 'y', y, {'standard_name': 'projection_y_coordinate', 'units': 'm'})
+        _add_lonlat(nc, longitude, latitude)
+        _add_lambert(nc, 'projection_lambert', 63.3, 15.)
+        _add_reference_time(nc, reference_time)
+        for name, standard_name, units, mean, spread in (('air_temperature_pl', 'air_temperature', 'K', 250, 10),
+                                                         ('x_wind_pl', 'x_wind', 'm/s', 0, 15),
+                                                         ('y_wind_pl', 'y_wind', 'm/s', 0, 15)):
+            variable = nc.createVariable(name, 'f4', ('time', 'pressure', 'ensemble_member', 'y', 'x'), zlib=True,
+                                         chunksizes=(1, 1, 1, ny, nx))
+            variable.setncatts({'standard_name': standard_name, 'units': units, 'grid_mapping': 'projection_lambert'})
+            for t in range(times):
+                variable[t] = _field(rng, (pressure_levels, members, ny, nx), mean, spread)
+    return path
+
+
+def write_kss(directory, nx=120, ny=150, years=2, days=365, first_year=2071, seed=0):
+    """KSS 1km Norway daily climate files, one per year, and the ncml aggregating them.
+
+    Returns the path of the ncml file.
+    """
+    from pyproj import CRS, Transformer
+    rng = np.random.default_rng(seed)
+    x = (np.arange(nx) * 1000. - 75000. + 500.).astype(np.float64)
+    y = (np.arange(ny) * 1000. + 6450000. + 500.).astype(np.float64)
+    transformer = Transformer.from_crs(CRS.from_proj4(UTM33_PROJ4), 'EPSG:4326', always_xy=True)
+    longitude, latitude = transformer.transform(*np.meshgrid(x, y))
+    members = []
+    for year in range(first_year, first_year + years):
+        path = os.path.join(directory, f'kss_norway_1km_tas_{year}.nc')
+        start = datetime.datetime(year, 1, 1, 12)
+        times = [start + datetime.timedelta(days=d) for d in range(days)]
+        with netCDF4.Dataset(path, 'w') as nc:
+            nc.setncatts({'Conventions': 'CF-1.6', 'title': 'Synthetic KSS Norway 1km daily mean temperature',
+                          'time_coverage_start': start.isoformat()})
+            nc.createDimension('time', None)
+            nc.createDimension('x', nx)
+            nc.createDimension('y', ny)
+            _add_coordinate(nc, 'time', netCDF4.date2num(times, KSS_TIME_UNITS),
+                            {'standard_name': 'time', 'units': KSS_TIME_UNITS, 'calendar': 'standard'}, 'f8')
+            _add_coordinate(nc, 'x', x, {'standard_name': 'projection_x_coordinate', 'units': 'm'})
+            _add_coordinate(nc, 'y', y, {'standard_name': 'projection_y_coordinate', 'units': 'm'})
+            _add_lonlat(nc, longitude, latitude)
+            projection = nc.createVariable('projection_utm', 'i4')
+            projection.setncatts({'grid_mapping_name': 'transverse_mercator', 'utm_zone_number': 33,
+                                  'longitude_of_central_meridian': 15., 'latitude_of_projection_origin': 0.,
+                                  'scale_factor_at_central_meridian': 0.9996, 'false_easting': 500000.,
+                                  'false_northing': 0., 'proj4': UTM33_PROJ4})
+            variable = nc.createVariable('tas', 'f4', ('time', 'y', 'x'), zlib=True, chunksizes=(1, ny, nx))
+            variable.setncatts({'standard_name': 'air_temperature', 'units': 'K', 'grid_mapping': 'projection_utm'})
+            for t in range(days):
+                variable[t] = _field(rng, (ny, nx), 280, 8)
+        members.append(path)
+    ncml_file = os.path.join(directory, 'kss_norway_1km_tas.ncml')
+    with open(ncml_file, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<netcdf xmlns="http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2">\n'
+                '  <aggregation dimName="time" type="joinExisting">\n')
+        for member in members:
+            f.write(f'    <netcdf location="{member}"/>\n')
+        f.write('  </aggregation>\n</netcdf>\n')
+    return ncml_file
+
+
+def write_swath(path, nx=200, ny=400, start_time=REFERENCE_TIME, seed=0):
+    """Swath with 2D longitude and latitude and no grid mapping, along a polar orbit."""
+    rng = np.random.default_rng(seed)
+    along = np.linspace(60., 80., ny)[:, np.newaxis]
+    across = np.linspace(-1., 1., nx)[np.newaxis, :]
+    latitude = along + 0.5 * across ** 2
+    longitude = 10. + 25. * across / np.cos(np.radians(along)) + 0.3 * (along - 60.)
+    with netCDF4.Dataset(path, 'w') as nc:
+        nc.setncatts({'Conventions': 'CF-1.6', 'title': 'Synthetic swath wind speed',
+                      'time_coverage_start': start_time.isoformat()})
+        nc.createDimension('time', 1)
+        nc.createDimension('ni', nx)
+        nc.createDimension('nj', ny)
+        _add_coordinate(nc, 'time', netCDF4.date2num([start_time], EPOCH_UNITS),
+                        {'standard_name': 'time', 'units': EPOCH_UNITS}, 'f8')
+        _add_lonlat(nc, longitude, latitude, dims=('nj', 'ni'))
+        variable = nc.createVariable('wind_speed', 'f4', ('time', 'nj', 'ni'), zlib=True)
+        variable.setncatts({'standard_name': 'wind_speed', 'units': 'm/s', 'coordinates': 'longitude latitude'})
+        variable[0] = np.abs(_field(rng, (ny, nx), 8, 4))
+    return path
+
+
+def config_entries(directory, datasets=DATASETS):
+    """Config entries serving the corpus written to directory."""
+    mapfiles_path = os.path.join(directory, 'mapfiles')
+    entries = {
+        'arome': {'pattern': r'^(.*arome_arctic_det_2_5km_(\d{8}T\d{2})Z.nc)$',
+                  'module': 'mapgen.modules.arome_arctic_quicklook',
+                  'module_function': 'arome_arctic_quicklook'},
+        'meps': {'pattern': r'^(.*meps_pl_2_5km_(\d{8}T\d{2})Z.nc)$',
+                 'module': 'mapgen.modules.generic_quicklook',
+                 'module_function': 'generic_quicklook'},
+        'kss': {'pattern': r'^(.*kss_norway_1km_tas.ncml)$',
+                'module': 'mapgen.modules.generic_quicklook',
+                'module_function': 'generic_quicklook'},
+        'swath': {'pattern': r'^(.*swath_wind_\d{14}.nc)$',
+                  'module': 'mapgen.modules.generic_quicklook',
+                  'module_function': 'generic_quicklook',
+                  'resample_to_grid': True},
+    }
+    return [dict(entries[dataset], base_netcdf_directory=directory, mapfiles_path=mapfiles_path)
+            for dataset in datasets]
+
+
+def write_corpus(directory, datasets=DATASETS, **sizes):
+    """Write the datasets and the config to directory. sizes override the small preset."""
+    sizes = dict(PRESETS['small'], **{k: v for k, v in sizes.items() if v is not None})
+    os.makedirs(os.path.join(directory, 'mapfiles'), exist_ok=True)
+    written = []
+    if 'arome' in datasets:
+        written.append(write_arome(os.path.join(directory, f'arome_arctic_det_2_5km_{REFERENCE_TIME:%Y%m%dT%H}Z.nc'),
+                                   *sizes['arome_grid'], times=sizes['arome_times']))
+    if 'meps' in datasets:
+        written.append(write_meps_pl(os.path.join(directory, f'meps_pl_2_5km_{REFERENCE_TIME:%Y%m%dT%H}Z.nc'),
+                                     *sizes['meps_grid'], times=sizes['meps_times'],
+                                     pressure_levels=sizes['meps_pressure'], members=sizes['meps_members']))
+    if 'kss' in datasets:
+        written.append(write_kss(directory, *sizes['kss_grid'], years=sizes['kss_years'], days=sizes['kss_days']))
+    if 'swath' in datasets:
+        written.append(write_swath(os.path.join(directory, f'swath_wind_{REFERENCE_TIME:%Y%m%d%H%M%S}.nc'),
+                                   *sizes['swath_size']))
+    config_file = os.path.join(directory, CONFIG_FILENAME)
+    with open(config_file, 'w') as f:
+        yaml.safe_dump(config_entries(os.path.abspath(directory), datasets), f, sort_keys=False)
+    written.append(config_file)
+    return written
+
+
+def _size(value):
+    try:
+        nx, ny = (int(n) for n in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Size must be NXxNY, got {value}")
+    return nx, ny
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic corpus of netcdf files and its config.')
+    parser.add_argument('directory')
+    parser.add_argument('--datasets', nargs='*', choices=DATASETS, default=list(DATASETS))
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--arome-grid', type=_size)
+    parser.add_argument('--arome-times', type=int)
+    parser.add_argument('--meps-grid', type=_size)
+    parser.add_argument('--meps-times', type=int)
+    parser.add_argument('--meps-pressure', type=int, help='Number of pressure levels.')
+    parser.add_argument('--meps-members', type=int, help='Number of ensemble members.')
+    parser.add_argument('--kss-grid', type=_size)
+    parser.add_argument('--kss-years', type=int, help='Number of yearly files in the ncml.')
+    parser.add_argument('--kss-days', type=int, help='Daily time steps in each yearly file.')
+    parser.add_argument('--swath-size', type=_size, help='Swath size across x along track.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s')
+    sizes = dict(PRESETS[args.preset])
+    sizes.update({k: v for k, v in vars(args).items() if k in sizes and v is not None})
+    for path in write_corpus(args.directory, args.datasets, **sizes):
+        logger.info(f"Wrote {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
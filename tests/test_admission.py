@@ -0,0 +1,106 @@
+import os
+import time
+from multiprocessing import Process, Event
+
+import pytest
+
+from mapgen.modules import admission
+from mapgen.modules.admission import AdmissionController, Overloaded
+
+
+def _controller(tmp_path, slots=1, queue=1, queue_timeout=0.2):
+    return AdmissionController(str(tmp_path), {'getmap': slots, 'cheap': slots}, {'getmap': queue, 'cheap': queue},
+                               {'getmap': queue_timeout, 'cheap': queue_timeout}, retry_after=7, poll_interval=0.01)
+
+
+def test_request_class():
+    assert admission.request_class('SERVICE=WMS&REQUEST=GetLegendGraphic&LAYER=a') == 'cheap'
+    assert admission.request_class('request=GetFeatureInfo') == 'cheap'
+    assert admission.request_class('') == 'capabilities'
+    assert admission.request_class('REQUEST=GetMap') == 'getmap'
+    satpy = {'module': 'mapgen.modules.satellite_satpy_quicklook'}
+    assert admission.request_class('REQUEST=GetMap', satpy) == 'satpy'
+    assert admission.request_class('', satpy) == 'satpy'
+    assert admission.request_class('REQUEST=GetMap', {'admission_class': 'cheap'}) == 'cheap'
+
+
+def test_from_environ():
+    controller = AdmissionController.from_environ({'ADMISSION_SLOTS': '3,satpy=1', 'ADMISSION_QUEUE': 'getmap=0',
+                                                   'ADMISSION_QUEUE_TIMEOUT': '1.5', 'ADMISSION_DIR': '/tmp/x'})
+    assert controller.slots == {'cheap': 3, 'capabilities': 3, 'getmap': 3, 'satpy': 1}
+    assert controller.queue['getmap'] == 0
+    assert controller.queue['satpy'] == 2
+    assert set(controller.queue_timeout.values()) == {1.5}
+    assert controller.directory == '/tmp/x'
+
+
+def test_admit_and_release(tmp_path):
+    controller = _controller(tmp_path, slots=2)
+    with controller.admit('getmap'):
+        with controller.admit('getmap'):
+            assert len(admission._held) == 2
+        with controller.admit('getmap'):
+            pass
+    assert admission._held == set()
+
+
+def test_queue_full(tmp_path):
+    controller = _controller(tmp_path, queue=0)
+    with controller.admit('getmap'):
+        with pytest.raises(Overloaded) as overloaded:
+            with controller.admit('getmap'):
+                pass
+        assert overloaded.value.retry_after == 7
+        assert overloaded.value.reason == 'queue is full'
+        # Other classes have slots of their own
+        with controller.admit('cheap'):
+            pass
+
+
+def test_queue_timeout(tmp_path):
+    controller = _controller(tmp_path, queue_timeout=0.05)
+    with controller.admit('getmap'):
+        start = time.monotonic()
+        with pytest.raises(Overloaded):
+            with controller.admit('getmap'):
+                pass
+        assert time.monotonic() - start >= 0.05
+    # The queue place is freed
+    assert admission._held == set()
+
+
+def _hold_slot(directory, held, done):
+    controller = _controller(directory)
+    with controller.admit('getmap'):
+        held.set()
+        done.wait(5)
+
+
+def test_slots_are_shared_between_processes(tmp_path):
+    held = Event()
+    done = Event()
+    p = Process(target=_hold_slot, args=(tmp_path, held, done))
+    p.start()
+    try:
+        assert held.wait(5)
+        with pytest.raises(Overloaded):
+            with _controller(tmp_path, queue_timeout=0.05).admit('getmap'):
+                pass
+    finally:
+        done.set()
+        p.join()
+    with _controller(tmp_path).admit('getmap'):
+        pass
+
+
+def test_release_inherited(tmp_path):
+    controller = _controller(tmp_path)
+    fd = controller._acquire('getmap', 'slot', 1)
+    assert controller._acquire('getmap', 'slot', 1) is None
+    admission.release_inherited()
+    assert admission._held == set()
+    with pytest.raises(OSError):
+        os.fstat(fd)
+    fd = controller._acquire('getmap', 'slot', 1)
+    assert fd is not None
+    controller._release(fd)
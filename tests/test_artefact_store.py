@@ -0,0 +1,130 @@
+import os
+import pickle
+import threading
+from unittest.mock import patch
+
+import numpy as np
+from pyresample import geometry
+
+from mapgen.modules import artefact_store, resample_cache
+from mapgen.modules.artefact_store import FileStore, S3Store
+from mapgen.modules.csw_summary import SummaryStore
+
+
+def test_store_for(tmp_path, monkeypatch):
+    monkeypatch.delenv('ARTEFACT_STORE', raising=False)
+    assert artefact_store.store_for({}) is None
+    store = artefact_store.store_for({'artefact_store': f'file://{tmp_path}'})
+    assert isinstance(store, FileStore) and store.directory == str(tmp_path)
+    assert artefact_store.store_for({'artefact_store': f'file://{tmp_path}'}) is store
+    monkeypatch.setenv('ARTEFACT_STORE', 's3://mapgen-artefacts/prod/')
+    store = artefact_store.store_for(None)
+    assert (store.bucket, store.prefix) == ('mapgen-artefacts', 'prod')
+    assert artefact_store.store_for({'artefact_store': ''}) is None
+
+
+def test_s3_store_pickles_without_client():
+    store = S3Store('bucket', 'prefix')
+    store._client = (os.getpid(), threading.Lock())
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy._client is None
+    assert copy._key('north/a.npz') == 'prefix/north/a.npz'
+
+
+def test_file_store(tmp_path):
+    store = FileStore(str(tmp_path / 'store'))
+    assert store.get('north/a.npz') is None
+    assert not store.fetch('north/a.npz', str(tmp_path / 'a.npz'))
+    store.put('north/a.npz', b'north')
+    assert store.get('north/a.npz') == b'north'
+    assert store.fetch('north/a.npz', str(tmp_path / 'local' / 'a.npz'))
+    assert (tmp_path / 'local' / 'a.npz').read_bytes() == b'north'
+    (tmp_path / 'b.tif').write_bytes(b'tif')
+    store.publish('mapfile/b.tif', str(tmp_path / 'b.tif'))
+    assert store.get('mapfile/b.tif') == b'tif'
+    assert not [f for f in os.listdir(tmp_path / 'store' / 'north') if f.startswith('.store-')]
+
+
+def _write_mapfile(directory, name, data):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write(f'MAP\n  LAYER\n    DATA "{data}"\n'
+                f'    TEMPLATE "{os.path.join(directory, "getfeature-info-air_temperature.html")}"\n'
+                f'  END\n  LAYER\n    TEMPLATE "{os.path.join(directory, "templatename")}"\n  END\nEND\n')
+    return path
+
+
+def test_publish_and_fetch_mapfile(tmp_path):
+    store = FileStore(str(tmp_path / 'store'))
+    pod_a = str(tmp_path / 'a')
+    tif = os.path.join(pod_a, 'resample-output_swath.nc-air_temperature.tif')
+    path = _write_mapfile(pod_a, 'swath.nc-air_temperature-abc.map', tif)
+    for name in ('resample-output_swath.nc-air_temperature.tif', 'getfeature-info-air_temperature.html'):
+        with open(os.path.join(pod_a, name), 'w') as f:
+            f.write(name)
+    artefact_store.publish_mapfile(store, path)
+
+    # A replica with the same mapfiles_path, without the files
+    for name in os.listdir(pod_a):
+        os.remove(os.path.join(pod_a, name))
+    assert not artefact_store.fetch_mapfile(store, os.path.join(pod_a, 'other.map'))
+    assert artefact_store.fetch_mapfile(store, path)
+    assert sorted(os.listdir(pod_a)) == ['getfeature-info-air_temperature.html',
+                                         'resample-output_swath.nc-air_temperature.tif',
+                                         'swath.nc-air_temperature-abc.map']
+    with open(tif) as f:
+        assert f.read() == 'resample-output_swath.nc-air_temperature.tif'
+
+
+def test_mapfile_with_request_artefacts_is_not_published(tmp_path):
+    store = FileStore(str(tmp_path / 'store'))
+    directory = str(tmp_path / 'a')
+    path = _write_mapfile(directory, 'meps.nc-wind-abc.map',
+                          f'{os.path.join(directory, "vrt-x1y2", "wind.vrt")}')
+    artefact_store.publish_mapfile(store, path)
+    assert not os.path.exists(tmp_path / 'store')
+
+
+def test_mapfile_missing_a_file_is_not_fetched(tmp_path):
+    store = FileStore(str(tmp_path / 'store'))
+    directory = str(tmp_path / 'a')
+    tif = os.path.join(directory, 'resample-output_swath.nc-air_temperature.tif')
+    path = _write_mapfile(directory, 'swath.nc-air_temperature-abc.map', tif)
+    with open(tif, 'w') as f:
+        f.write('tif')
+    artefact_store.publish_mapfile(store, path)
+    os.remove(os.path.join(store.directory, 'mapfile', 'swath.nc-air_temperature-abc.map.d',
+                           'resample-output_swath.nc-air_temperature.tif'))
+    os.remove(path)
+    os.remove(tif)
+    assert not artefact_store.fetch_mapfile(store, path)
+    assert not os.path.exists(path)
+
+
+def test_resample_lookup_table_from_store(tmp_path):
+    lons, lats = np.meshgrid(np.linspace(10, 20, 50), np.linspace(60, 70, 40))
+    swath_def = geometry.SwathDefinition(lons=lons, lats=lats)
+    area = swath_def.compute_optimal_bb_area()
+    store = FileStore(str(tmp_path / 'store'))
+    resample_cache._neighbour_info_memory.clear()
+    expected = resample_cache.resample_nearest(swath_def, lons + lats, area, 10000000,
+                                               cache_dir=str(tmp_path / 'a'), store=store)
+    assert len(os.listdir(tmp_path / 'store' / 'resample-lut')) == 1
+    resample_cache._neighbour_info_memory.clear()
+    with patch('mapgen.modules.resample_cache.kd_tree.get_neighbour_info') as get_neighbour_info:
+        resampled = resample_cache.resample_nearest(swath_def, lons + lats, area, 10000000,
+                                                    cache_dir=str(tmp_path / 'b'), store=store)
+        get_neighbour_info.assert_not_called()
+    np.testing.assert_array_equal(resampled, expected)
+
+
+def test_summary_from_store(tmp_path):
+    store = FileStore(str(tmp_path / 'store'))
+    entry = {'summary': 'A summary', 'expires': 2e9}
+    SummaryStore(str(tmp_path / 'a'), store).put('key', entry)
+    assert SummaryStore(str(tmp_path / 'b')).get('key', now=1e9) is None
+    assert SummaryStore(str(tmp_path / 'b'), store).get('key', now=1e9)['summary'] == 'A summary'
+    # Now also on local disk
+    assert SummaryStore(str(tmp_path / 'b')).get('key', now=1e9)['summary'] == 'A summary'
+    assert SummaryStore(str(tmp_path / 'c'), store).get('key', now=3e9) is None
@@ -0,0 +1,213 @@
+import os
+import time
+import hashlib
+
+import pytest
+
+from mapgen.modules.artefacts import (new_artefact_dir, scan_artefacts, collect_garbage, cleanup,
+                                      artefact_usage, touch_artefact, atomic_path)
+
+
+def _write(path, content='x', age=0, now=None):
+    with open(path, 'w') as f:
+        f.write(content)
+    mtime = (now or time.time()) - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _mapfile(name):
+    """A map file name as generated by mapfile_store.mapfile_path."""
+    return f'{name}-{hashlib.md5(name.encode()).hexdigest()}.map'
+
+
+def _age_dir(path, age, now):
+    os.utime(path, (now - age, now - age))
+
+
+def test_new_artefact_dir(tmp_path):
+    path = new_artefact_dir({'mapfiles_path': str(tmp_path)}, 'vrt')
+    assert os.path.isdir(path)
+    assert os.path.basename(path).startswith('vrt-')
+    with pytest.raises(ValueError):
+        new_artefact_dir({'mapfiles_path': str(tmp_path)}, 'mapfile')
+
+
+def test_scan_artefacts_references(tmp_path):
+    now = time.time()
+    vrt = new_artefact_dir({'mapfiles_path': str(tmp_path)}, 'vrt')
+    _write(os.path.join(vrt, 'var.vrt'), 'abc')
+    _age_dir(vrt, 5000, now)
+    _write(tmp_path / _mapfile('a'), f'DATA "{vrt}/var.vrt"', age=10, now=now)
+    _write(tmp_path / 'symbol.sym', 'not an artefact')
+    artefacts = {os.path.basename(a.path): a for a in scan_artefacts(str(tmp_path))}
+    assert sorted(a.kind for a in artefacts.values()) == ['mapfile', 'vrt']
+    dependency = artefacts[os.path.basename(vrt)]
+    assert dependency.size == 3
+    assert [m.path for m in dependency.referred_by] == [str(tmp_path / _mapfile('a'))]
+    # Used as long as the map file referring to it
+    assert dependency.last_used == pytest.approx(now - 10, abs=1)
+
+
+def _wind_layer(tmp_path, now, age):
+    """Artefacts of a wind layer: map file -> var vrt -> netcdf, and the unused x/y vrts."""
+    product_config = {'mapfiles_path': str(tmp_path)}
+    netcdf = new_artefact_dir(product_config, 'netcdf')
+    tmp_netcdf = _write(os.path.join(netcdf, 'xy-x_wind-y_wind.nc'), 'x' * 100)
+    vrts = []
+    for name in ('xvar-x_wind-1.vrt', 'yvar-y_wind-1.vrt', 'var-x_wind-y_wind-1.vrt'):
+        vrt = new_artefact_dir(product_config, 'vrt')
+        _write(os.path.join(vrt, name), f'<SourceFilename>NETCDF:{tmp_netcdf}:x_wind</SourceFilename>')
+        vrts.append(vrt)
+    for path in [netcdf] + vrts:
+        _age_dir(path, age, now)
+    mapfile = _write(tmp_path / _mapfile('wind'), f'DATA "{vrts[-1]}/var-x_wind-y_wind-1.vrt"', age=10, now=now)
+    return netcdf, vrts, mapfile
+
+
+def test_scan_artefacts_follows_vrt_references(tmp_path):
+    now = time.time()
+    netcdf, vrts, mapfile = _wind_layer(tmp_path, now, 5000)
+    artefacts = {a.path: a for a in scan_artefacts(str(tmp_path))}
+    referred_by = [a.path for a in artefacts[netcdf].referred_by]
+    assert referred_by[0] == str(mapfile)
+    assert sorted(referred_by[1:]) == sorted(vrts)
+    assert artefacts[netcdf].last_used == pytest.approx(now - 10, abs=1)
+
+
+def test_collect_garbage_keeps_netcdf_of_used_vrt(tmp_path):
+    now = time.time()
+    netcdf, vrts, mapfile = _wind_layer(tmp_path, now, 5000)
+    collect_garbage(str(tmp_path), max_age=1000, min_age=0, now=now)
+    assert os.path.exists(netcdf)
+    assert os.path.exists(vrts[-1])
+    assert os.path.exists(mapfile)
+    # Only the x and y vrts no map file uses
+    assert not os.path.exists(vrts[0])
+    assert not os.path.exists(vrts[1])
+    # The netcdf expires with the map file, and takes the vrt and map file with it
+    collect_garbage(str(tmp_path), max_age=1, min_age=0, now=now)
+    assert not os.path.exists(netcdf)
+    assert not os.path.exists(vrts[-1])
+    assert not os.path.exists(mapfile)
+
+
+def test_scan_artefacts_only_generated_map_files(tmp_path):
+    now = time.time()
+    template = _write(tmp_path / 'mapfile.map', age=5000, now=now)
+    named = _write(tmp_path / 'satpy-products-20240117144743.map', age=5000, now=now)
+    generated = _write(tmp_path / _mapfile('file.nc'), age=5000, now=now)
+    assert sorted(a.path for a in scan_artefacts(str(tmp_path))) == sorted([str(named), str(generated)])
+    collect_garbage(str(tmp_path), max_age=1000, min_age=0, now=now)
+    assert os.path.exists(template)
+    assert not os.path.exists(named)
+    assert not os.path.exists(generated)
+
+
+def test_collect_garbage_max_age(tmp_path):
+    now = time.time()
+    old = _write(tmp_path / _mapfile('old'), age=2000, now=now)
+    recent = _write(tmp_path / _mapfile('recent'), age=100, now=now)
+    usage = collect_garbage(str(tmp_path), max_age=1000, min_age=10, now=now)
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+    assert usage['files'] == 1
+    assert usage['removed'] == 1
+    assert usage['bytes'] == 1
+
+
+def test_collect_garbage_removes_map_files_referring_to_removed(tmp_path):
+    now = time.time()
+    resampled = _write(tmp_path / 'resample-output_file.nc-var.tif', 'x' * 100, age=3000, now=now)
+    mapfile = _write(tmp_path / _mapfile('file.nc-var'), 'DATA "resample-output_file.nc-var.tif"', age=3000, now=now)
+    other = _write(tmp_path / 'getfeature-info-var.html', 'x' * 10, age=50, now=now)
+    usage = collect_garbage(str(tmp_path), max_age=1000, min_age=10, now=now)
+    assert not os.path.exists(resampled)
+    assert not os.path.exists(mapfile)
+    assert os.path.exists(other)
+    assert usage['removed'] == 2
+
+
+def test_collect_garbage_budget_least_recently_used(tmp_path):
+    now = time.time()
+    first = _write(tmp_path / _mapfile('first'), 'x' * 100, age=300, now=now)
+    second = _write(tmp_path / _mapfile('second'), 'x' * 100, age=200, now=now)
+    third = _write(tmp_path / _mapfile('third'), 'x' * 100, age=100, now=now)
+    in_use = _write(tmp_path / _mapfile('in-use'), 'x' * 100, age=1, now=now)
+    usage = collect_garbage(str(tmp_path), max_age=10000, max_bytes=250, min_age=10, now=now)
+    assert not os.path.exists(first)
+    assert not os.path.exists(second)
+    assert os.path.exists(third)
+    assert os.path.exists(in_use)
+    assert usage['bytes'] == 200
+
+
+def test_collect_garbage_keeps_recently_used(tmp_path):
+    now = time.time()
+    mapfile = _write(tmp_path / _mapfile('a'), 'x' * 100, age=5, now=now)
+    collect_garbage(str(tmp_path), max_age=1, max_bytes=0, min_age=10, now=now)
+    assert os.path.exists(mapfile)
+
+
+def test_atomic_path(tmp_path):
+    path = str(tmp_path / 'a.map')
+    with atomic_path(path, suffix='.map.tmp') as tmp_file:
+        assert os.path.dirname(tmp_file) == str(tmp_path)
+        _write(tmp_file, 'new')
+        assert not os.path.exists(path)
+    with open(path) as f:
+        assert f.read() == 'new'
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_path(path) as tmp_file:
+            _write(tmp_file, 'partial')
+            raise KeyboardInterrupt()
+    # The old file is kept and the temporary file removed
+    with open(path) as f:
+        assert f.read() == 'new'
+    assert os.listdir(tmp_path) == ['a.map']
+
+
+def test_touch_artefact(tmp_path):
+    mapfile = _write(tmp_path / 'a.map', age=5000)
+    touch_artefact(str(mapfile))
+    assert os.stat(mapfile).st_mtime > time.time() - 10
+    touch_artefact(str(tmp_path / 'missing.map'))
+
+
+def test_cleanup_policies_and_usage(tmp_path):
+    first = tmp_path / 'first'
+    second = tmp_path / 'second'
+    first.mkdir()
+    second.mkdir()
+    _write(first / _mapfile('a'), age=2000)
+    _write(second / _mapfile('a'), age=2000)
+    shared_cache = {}
+    product_configs = [{'mapfiles_path': str(first), 'artefact_max_age': 1000, 'artefact_min_age': 0},
+                       {'mapfiles_path': str(first), 'artefact_max_age': 100000},
+                       {'mapfiles_path': str(second), 'artefact_max_age': 100000},
+                       'not a config']
+    cleanup(product_configs, shared_cache)
+    assert not os.path.exists(first / _mapfile('a'))
+    assert os.path.exists(second / _mapfile('a'))
+    usage = artefact_usage(shared_cache)
+    assert usage[str(first)]['removed'] == 1
+    assert usage[str(second)]['files'] == 1
+
+
+def test_cleanup_resample_cache_dir(tmp_path):
+    mapfiles_path = tmp_path / 'mapfiles'
+    resample_cache_dir = tmp_path / 'lut'
+    mapfiles_path.mkdir()
+    resample_cache_dir.mkdir()
+    old = _write(resample_cache_dir / 'resample-lut-old.npz', 'x' * 100, age=2000)
+    recent = _write(resample_cache_dir / 'resample-lut-recent.npz', 'x' * 100, age=100)
+    other = _write(resample_cache_dir / 'a.map', age=2000)
+    product_configs = [{'mapfiles_path': str(mapfiles_path), 'resample_cache_dir': str(resample_cache_dir),
+                        'artefact_max_age': 1000, 'artefact_min_age': 0}]
+    usage = cleanup(product_configs)
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+    # Only the lookup tables are cleaned up in resample_cache_dir
+    assert os.path.exists(other)
+    assert usage[str(resample_cache_dir)]['files'] == 1
+    assert usage[str(mapfiles_path)]['files'] == 0
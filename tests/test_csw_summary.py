@@ -0,0 +1,60 @@
+import time
+from unittest.mock import MagicMock, patch
+
+from mapgen.modules import csw_summary
+from mapgen.modules.csw_summary import NOT_AVAILABLE, SummaryStore, summary
+
+
+def test_summary_fetched_once_and_cached():
+    fetch = MagicMock(return_value="A summary")
+    shared_cache = {}
+    assert summary('summary-a.nc', fetch, ('a',), shared_cache, {'csw_timeout': 1}) == "A summary"
+    assert summary('summary-a.nc', fetch, ('a',), shared_cache) == "A summary"
+    fetch.assert_called_once_with('a', timeout=1.0)
+
+
+def test_summary_negative_cache():
+    fetch = MagicMock(return_value=None)
+    shared_cache = {}
+    assert summary('summary-a.nc', fetch, ('a',), shared_cache) == NOT_AVAILABLE
+    assert summary('summary-a.nc', fetch, ('a',), shared_cache) == NOT_AVAILABLE
+    fetch.assert_called_once()
+    shared_cache['summary-a.nc']['expires'] = time.time() - 1
+    fetch.return_value = "Now there"
+    assert summary('summary-a.nc', fetch, ('a',), shared_cache) == "Now there"
+
+
+def test_summary_fetch_failure_is_not_available():
+    fetch = MagicMock(side_effect=RuntimeError("CSW down"))
+    assert summary('summary-a.nc', fetch, ('a',), {}) == NOT_AVAILABLE
+
+
+def test_summary_store_survives_restart(tmp_path):
+    fetch = MagicMock(return_value="Stored summary")
+    product_config = {'csw_summary_cache_dir': str(tmp_path)}
+    assert summary('summary-a.nc', fetch, ('a',), {}, product_config) == "Stored summary"
+    assert summary('summary-a.nc', fetch, ('a',), {}, product_config) == "Stored summary"
+    fetch.assert_called_once()
+
+
+def test_summary_store_expired(tmp_path):
+    store = SummaryStore(str(tmp_path))
+    store.put('summary-a.nc', {'summary': 'old', 'expires': time.time() - 1})
+    assert store.get('summary-a.nc') is None
+    store.put('summary-b.nc', {'summary': 'new', 'expires': time.time() + 10})
+    assert store.get('summary-b.nc')['summary'] == 'new'
+    assert store.get('summary-c.nc') is None
+
+
+def test_summary_queued_when_prefetch_running():
+    fetch = MagicMock(return_value="A summary")
+    queue = MagicMock()
+    shared_cache = {}
+    with patch.object(csw_summary, '_prefetch_queue', queue):
+        assert summary('summary-a.nc', fetch, ('a',), shared_cache) == NOT_AVAILABLE
+        assert summary('summary-a.nc', fetch, ('a',), shared_cache) == NOT_AVAILABLE
+    queue.put.assert_called_once()
+    fetch.assert_not_called()
+    key, _fetch, fetch_args, settings = queue.put.call_args[0][0]
+    csw_summary._fetch_and_store(key, _fetch, fetch_args, settings, shared_cache)
+    assert summary('summary-a.nc', fetch, ('a',), shared_cache) == "A summary"
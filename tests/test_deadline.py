@@ -0,0 +1,93 @@
+import time
+import socket
+from multiprocessing import Process, Queue
+
+import pytest
+
+from mapgen.modules import deadline, metrics
+from mapgen.modules.deadline import DeadlineExceeded, ClientDisconnected, WorkerFailed
+
+
+def test_request_deadline_keeps_the_earliest():
+    assert deadline.remaining() is None
+    with deadline.request_deadline(10):
+        assert 9 < deadline.remaining() <= 10
+        with deadline.request_deadline(100):
+            assert deadline.remaining() <= 10
+        with deadline.request_deadline(at=deadline.after(1)):
+            assert deadline.remaining() <= 1
+        with deadline.request_deadline():
+            assert 9 < deadline.remaining() <= 10
+    assert deadline.remaining() is None
+
+
+def test_check_and_stage():
+    deadline.check('open')
+    with deadline.request_deadline(at=deadline.after(-1)):
+        with pytest.raises(DeadlineExceeded) as exceeded:
+            deadline.check('open')
+        assert exceeded.value.stage == 'open'
+        with pytest.raises(DeadlineExceeded):
+            with metrics.stage('resample'):
+                pass
+        # Not caught by the handlers
+        assert not isinstance(exceeded.value, Exception)
+
+
+def _put(q, delay):
+    time.sleep(delay)
+    q.put(('200 OK', b'done', 'text/plain'))
+
+
+def _exit():
+    pass
+
+
+def test_wait_for_result():
+    q = Queue()
+    p = Process(target=_put, args=(q, 0.1))
+    p.start()
+    assert deadline.wait_for_result(q, p, deadline.after(5), poll_interval=0.05) == ('200 OK', b'done', 'text/plain')
+    p.join()
+
+
+def test_wait_for_result_deadline():
+    q = Queue()
+    p = Process(target=_put, args=(q, 30))
+    p.start()
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        deadline.wait_for_result(q, p, deadline.after(0.1), poll_interval=0.05, grace=0.1)
+    assert time.monotonic() - start < 5
+    assert not p.is_alive()
+
+
+def test_wait_for_result_worker_failed():
+    q = Queue()
+    p = Process(target=_exit)
+    p.start()
+    with pytest.raises(WorkerFailed):
+        deadline.wait_for_result(q, p, deadline.after(5), poll_interval=0.05)
+
+
+def test_wait_for_result_disconnected():
+    q = Queue()
+    p = Process(target=_put, args=(q, 30))
+    p.start()
+    with pytest.raises(ClientDisconnected):
+        deadline.wait_for_result(q, p, deadline.after(5), disconnected=lambda: True, poll_interval=0.05, grace=0.1)
+    assert not p.is_alive()
+
+
+def test_socket_disconnected():
+    server, client = socket.socketpair()
+    try:
+        assert not deadline.socket_disconnected(server)
+        client.sendall(b'GET')
+        # Pending data is not a disconnect, and is not consumed
+        assert not deadline.socket_disconnected(server)
+        assert server.recv(3) == b'GET'
+        client.close()
+        assert deadline.socket_disconnected(server)
+    finally:
+        server.close()
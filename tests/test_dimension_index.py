@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from mapgen.modules.dimension_index import dimension_index
+
+
+def _ds():
+    return xr.Dataset(coords={'time': pd.date_range('2024-01-01', periods=24, freq='h'),
+                              'pressure': np.array([1000, 925, 850, 700, 500], dtype=np.float32),
+                              'ensemble_member': np.arange(10),
+                              'level': np.array([0.1, 0.5, 0.5], dtype=np.float32)})
+
+
+def test_lookup_time():
+    index = dimension_index(_ds(), 'time')
+    assert index.lookup('2024-01-01T05:00:00Z') == 5
+    assert index.lookup(pd.Timestamp('2024-01-01T23:00:00').to_pydatetime()) == 23
+    with pytest.raises(KeyError):
+        index.lookup('2024-01-01T05:10:00Z')
+
+
+def test_lookup_time_tolerance_and_nearest():
+    index = dimension_index(_ds(), 'time')
+    assert index.lookup('2024-01-01T05:10:00Z', tolerance=900) == 5
+    assert index.lookup('2024-01-01T05:40:00Z', nearest=True) == 6
+    assert index.lookup('2023-12-01T00:00:00Z', nearest=True) == 0
+
+
+def test_lookup_unsorted_float_values():
+    index = dimension_index(_ds(), 'pressure')
+    assert index.lookup('850') == 2
+    assert index.lookup(500) == 4
+    assert index.lookup('860', nearest=True) == 2
+    with pytest.raises(KeyError):
+        index.lookup('860')
+
+
+def test_lookup_float32_values_and_duplicates():
+    index = dimension_index(_ds(), 'level')
+    assert index.lookup('0.1') == 0
+    assert index.lookup('0.5') == 1
+
+
+def test_lookup_ensemble_member():
+    assert dimension_index(_ds(), 'ensemble_member').lookup('7') == 7
+
+
+def test_dimension_index_cached_per_file(tmp_path):
+    netcdf_file = tmp_path / 'test.nc'
+    netcdf_file.write_text('')
+    shared_cache = {}
+    index = dimension_index(_ds(), 'pressure', shared_cache, str(netcdf_file))
+    assert f'dimension-index-{netcdf_file}-pressure' in shared_cache
+    assert dimension_index(_ds(), 'pressure', shared_cache, str(netcdf_file)) is index
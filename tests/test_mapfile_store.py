@@ -0,0 +1,68 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from mapgen.modules.mapfile_store import mapfile_key, mapfile_path, save_mapfile, load_mapfile
+
+
+@pytest.fixture
+def netcdf_file(tmp_path):
+    netcdf_file = tmp_path / 'data.nc'
+    netcdf_file.write_text('')
+    return str(netcdf_file)
+
+
+def test_mapfile_key_ignores_view_parameters(netcdf_file):
+    product_config = {'mapfiles_path': '/tmp', 'style_templates': {'style': object()}}
+    get_map = {'request': 'GetMap', 'layers': 'air_temperature', 'styles': '', 'bbox': '0,0,1,1', 'width': '256'}
+    legend = {'request': 'GetLegendGraphic', 'layer': 'air_temperature', 'sld_version': '1.1.0'}
+    assert mapfile_key(netcdf_file, product_config, get_map) == mapfile_key(netcdf_file, product_config, legend)
+
+
+def test_mapfile_key_changes_with_inputs(netcdf_file):
+    product_config = {'mapfiles_path': '/tmp'}
+    qp = {'layers': 'air_temperature', 'time': '2025-01-01T00:00:00Z'}
+    key = mapfile_key(netcdf_file, product_config, qp, 'host', 'https')
+    assert key != mapfile_key(netcdf_file, product_config, dict(qp, time='2025-01-01T01:00:00Z'), 'host', 'https')
+    assert key != mapfile_key(netcdf_file, product_config, dict(qp, elevation='2'), 'host', 'https')
+    assert key != mapfile_key(netcdf_file, dict(product_config, styles=[]), qp, 'host', 'https')
+    assert key != mapfile_key(netcdf_file, product_config, qp, 'other-host', 'https')
+    assert key != mapfile_key(netcdf_file, product_config, None, 'host', 'https')
+    os.utime(netcdf_file, (0, 0))
+    assert key != mapfile_key(netcdf_file, product_config, qp, 'host', 'https')
+
+
+def test_mapfile_key_vector_features_bbox(netcdf_file):
+    qp = {'layers': 'x_wind_vector', 'bbox': '0,0,1,1'}
+    product_config = {}
+    assert mapfile_key(netcdf_file, product_config, qp) == mapfile_key(netcdf_file, product_config, dict(qp, bbox='0,0,2,2'))
+    product_config = {'vector_rendering': 'features'}
+    assert mapfile_key(netcdf_file, product_config, qp) != mapfile_key(netcdf_file, product_config, dict(qp, bbox='0,0,2,2'))
+
+
+def test_mapfile_path():
+    assert mapfile_path('/mapfiles', 'data.nc-air_temperature', 'abc') == '/mapfiles/data.nc-air_temperature-abc.map'
+
+
+def test_save_mapfile_atomic(tmp_path):
+    map_object = MagicMock()
+    map_object.save.side_effect = lambda path: open(path, 'w').write('MAP\nEND\n')
+    path = str(tmp_path / 'data.nc-getcapabilities-abc.map')
+    save_mapfile(map_object, path)
+    saved_to = map_object.save.call_args[0][0]
+    assert saved_to != path
+    assert os.path.dirname(saved_to) == str(tmp_path)
+    assert os.listdir(tmp_path) == ['data.nc-getcapabilities-abc.map']
+
+
+def test_save_mapfile_failure_leaves_nothing(tmp_path):
+    map_object = MagicMock()
+    map_object.save.side_effect = RuntimeError('failed')
+    with pytest.raises(RuntimeError):
+        save_mapfile(map_object, str(tmp_path / 'a.map'))
+    assert os.listdir(tmp_path) == []
+
+
+def test_load_mapfile_missing(tmp_path):
+    assert load_mapfile(str(tmp_path / 'missing.map')) is None
@@ -0,0 +1,113 @@
+import os
+import json
+
+import pytest
+
+from mapgen.modules import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path / 'metrics'))
+    metrics._histograms.clear()
+    metrics._observations.clear()
+    metrics.set_labels(product='', request='')
+    yield
+    metrics._histograms.clear()
+    metrics._observations.clear()
+
+
+def test_request_type():
+    assert metrics.request_type('SERVICE=WMS&REQUEST=GetMap&LAYERS=a') == 'getmap'
+    assert metrics.request_type('service=WMS&request=GetLegendGraphic') == 'getlegendgraphic'
+    assert metrics.request_type('') == 'getcapabilities'
+
+
+def test_stage_and_labels():
+    metrics.set_labels(request='getmap')
+    with metrics.stage('route'):
+        pass
+    metrics.set_labels(product='.*arome.*')
+    with pytest.raises(ValueError):
+        with metrics.stage('open_dataset'):
+            raise ValueError
+    assert [o[:3] for o in metrics._observations] == [('route', '', 'getmap'),
+                                                      ('open_dataset', '.*arome.*', 'getmap')]
+
+
+def test_timed_keeps_function():
+    @metrics.timed('projection')
+    def find(a, b=1):
+        """Docstring"""
+        return a + b
+
+    assert find(1, b=2) == 3
+    assert find.__name__ == 'find'
+    assert metrics._observations[0][0] == 'projection'
+
+
+def test_publish_and_collect():
+    shared_cache = {}
+    metrics.observe('quicklook', 0.2)
+    metrics.publish(shared_cache)
+    assert metrics._observations == []
+    observations = shared_cache.popitem()[1]
+    shared_cache['metrics-1234'] = observations
+    metrics.collect(shared_cache, 1234)
+    assert 'metrics-1234' not in shared_cache
+    histogram = metrics._histograms[('quicklook', '', '')]
+    assert histogram['count'] == 1
+    assert histogram['sum'] == pytest.approx(0.2)
+    # Missing or already collected
+    metrics.collect(shared_cache, 1234)
+    assert histogram['count'] == 1
+
+
+def test_record_cumulative_buckets():
+    metrics.record([('ows_dispatch', 'p', 'getmap', 0.003), ('ows_dispatch', 'p', 'getmap', 0.3),
+                    ('ows_dispatch', 'p', 'getmap', 100)])
+    buckets = dict(zip(metrics.BUCKETS, metrics._histograms[('ows_dispatch', 'p', 'getmap')]['buckets']))
+    assert buckets[0.005] == 1
+    assert buckets[0.25] == 1
+    assert buckets[0.5] == 2
+    assert buckets[60] == 2
+
+
+def test_render():
+    metrics.record([('route', 'a"b', 'getmap', 0.01)])
+    text = metrics.render({'mapgen_artefact_bytes': [({'path': '/mapfiles'}, 42)]}).decode()
+    assert '# TYPE mapgen_stage_duration_seconds histogram' in text
+    assert 'mapgen_stage_duration_seconds_bucket{stage="route",product="a\\"b",request="getmap",le="0.01"} 1' in text
+    assert 'mapgen_stage_duration_seconds_bucket{stage="route",product="a\\"b",request="getmap",le="+Inf"} 1' in text
+    assert 'mapgen_stage_duration_seconds_count{stage="route",product="a\\"b",request="getmap"} 1' in text
+    assert 'mapgen_artefact_bytes{path="/mapfiles"} 42' in text
+    assert text.endswith('\n')
+
+
+def test_render_all_processes():
+    metrics.record([('route', 'p', 'getmap', 0.01)], {'mapgen_worker_rss_bytes': 1000})
+    # Another server process on the host, and one that has ended
+    metrics._histograms.clear()
+    with open(os.path.join(metrics.METRICS_DIR, 'metrics.json')) as f:
+        store = json.load(f)
+    store['processes']['1'] = {'mapgen_worker_rss_bytes': 2000}
+    store['processes']['999999999'] = {'mapgen_worker_rss_bytes': 3000}
+    with open(os.path.join(metrics.METRICS_DIR, 'metrics.json'), 'w') as f:
+        json.dump(store, f)
+    metrics.record([('route', 'p', 'getmap', 0.3)])
+    text = metrics.render().decode()
+    assert 'mapgen_stage_duration_seconds_bucket{stage="route",product="p",request="getmap",le="0.01"} 1' in text
+    assert 'mapgen_stage_duration_seconds_count{stage="route",product="p",request="getmap"} 2' in text
+    assert f'mapgen_worker_rss_bytes{{pid="{os.getpid()}"}} 1000' in text
+    assert 'mapgen_worker_rss_bytes{pid="1"} 2000' in text
+    assert '999999999' not in text
+    with open(os.path.join(metrics.METRICS_DIR, 'metrics.json')) as f:
+        assert '999999999' not in json.load(f)['processes']
+
+
+def test_render_without_metrics_dir(tmp_path, monkeypatch):
+    (tmp_path / 'file').write_text('')
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path / 'file'))
+    metrics.record([('route', 'p', 'getmap', 0.01)])
+    text = metrics.render().decode()
+    assert 'mapgen_stage_duration_seconds_count{stage="route",product="p",request="getmap"} 1' in text
@@ -0,0 +1,110 @@
+"""Test ncml aggregation"""
+import os
+import datetime
+import numpy as np
+import xarray as xr
+import pytest
+
+from mapgen.modules.ncml import NcmlAggregation, ncml_aggregation, read_ncml_members, _decode_time
+
+NCML = """<?xml version="1.0" encoding="UTF-8"?>
+<netcdf xmlns="http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2">
+  <aggregation dimName="time" type="joinExisting">
+{members}
+  </aggregation>
+</netcdf>
+"""
+
+
+def _make_member(member, hours):
+    ds = xr.Dataset({'air_temperature': (('time', 'y', 'x'), np.zeros((len(hours), 2, 2)))},
+                    coords={'time': ('time', np.array(hours, dtype=np.float64) * 3600,
+                                     {'units': 'seconds since 1970-01-01 00:00:00 +00:00'})})
+    ds.to_netcdf(member, encoding={'time': {'dtype': 'float64'}})
+
+
+def _make_ncml(tmp_path, member_hours):
+    members = []
+    for i, hours in enumerate(member_hours):
+        member = os.path.join(str(tmp_path), f'member_{i}.nc')
+        _make_member(member, hours)
+        members.append(member)
+    ncml_file = os.path.join(str(tmp_path), 'test.ncml')
+    with open(ncml_file, 'w') as f:
+        f.write(NCML.format(members='\n'.join(f'    <netcdf location="{m}"/>' for m in members)))
+    return ncml_file, members
+
+
+def test_decode_time():
+    times = _decode_time([0, 3600], 'seconds since 1970-01-01 00:00:00 +00:00')
+    assert times[1] == np.datetime64('1970-01-01T01:00:00')
+    times = _decode_time([1], 'days since 2024-01-01 00:00:00 +01:00')
+    assert times[0] == np.datetime64('2024-01-01T23:00:00')
+    with pytest.raises(ValueError):
+        _decode_time([1], 'fortnights since 2024-01-01')
+
+
+def test_decode_time_calendar():
+    # 2024 is a leap year, but not in the noleap calendar
+    times = _decode_time([59, 60], 'days since 2024-01-01 00:00:00', 'noleap')
+    assert list(times) == [np.datetime64('2024-03-01T00:00:00'), np.datetime64('2024-03-02T00:00:00')]
+    times = _decode_time([3600], 'seconds since 2024-01-01 00:00:00 +01:00', '360_day')
+    assert times[0] == np.datetime64('2024-01-01T00:00:00')
+    assert _decode_time([30], 'days since 2024-01-01', '360_day')[0] == np.datetime64('2024-02-01')
+    # 30 February
+    with pytest.raises(ValueError):
+        _decode_time([59], 'days since 2024-01-01', '360_day')
+
+
+def test_ncml_aggregation_lookup(tmp_path):
+    # Not uniform spacing and a member with more than one time step, listed out of order
+    ncml_file, members = _make_ncml(tmp_path, [[0], [1, 2], [6], [3]])
+    assert read_ncml_members(ncml_file) == members
+    aggregation = NcmlAggregation.from_ncml(ncml_file)
+    assert list(aggregation.times) == [np.datetime64(f'1970-01-01T0{h}:00:00') for h in (0, 1, 2, 3, 6)]
+    assert aggregation.lookup(datetime.datetime(1970, 1, 1, 2)) == (members[1], 1)
+    assert aggregation.lookup(datetime.datetime(1970, 1, 1, 3)) == (members[3], 0)
+    assert aggregation.lookup(datetime.datetime(1970, 1, 1, 6)) == (members[2], 0)
+    assert aggregation.member_time_size(members[1]) == 2
+    with pytest.raises(KeyError):
+        aggregation.lookup(datetime.datetime(1970, 1, 1, 4))
+    assert aggregation.time_dataset()['time'].size == 5
+
+
+def test_ncml_aggregation_cached(tmp_path):
+    ncml_file, members = _make_ncml(tmp_path, [[0], [1]])
+    shared_cache = {}
+    aggregation = ncml_aggregation(ncml_file, shared_cache)
+    assert ncml_aggregation(ncml_file, shared_cache) is aggregation
+    os.utime(ncml_file, (0, 0))
+    assert ncml_aggregation(ncml_file, shared_cache) is not aggregation
+
+
+def test_ncml_aggregation_member_rewritten(tmp_path):
+    ncml_file, members = _make_ncml(tmp_path, [[0], [1]])
+    shared_cache = {}
+    aggregation = ncml_aggregation(ncml_file, shared_cache)
+    # The ncml file is not touched when a member is rewritten in place
+    _make_member(members[1], [1, 2])
+    os.utime(members[1], (1000, 1000))
+    rebuilt = ncml_aggregation(ncml_file, shared_cache)
+    assert rebuilt is not aggregation
+    assert rebuilt.times.size == 3
+    assert ncml_aggregation(ncml_file, shared_cache) is rebuilt
+
+
+def test_ncml_dataset_opens_only_requested_member(tmp_path):
+    from unittest.mock import patch
+    from mapgen.modules import ncml
+    ncml_file, members = _make_ncml(tmp_path, [[0], [1, 2], [3]])
+    ncml_dataset = ncml.NcmlDataset(ncml_file, {})
+    assert ncml_dataset.times.size == 4
+    ncml._open_members.clear()
+    with patch('mapgen.modules.ncml.xr.open_dataset', wraps=xr.open_dataset) as open_dataset:
+        ds = ncml_dataset.open(datetime.datetime(1970, 1, 1, 2))
+        assert ds['time'].size == 2
+        # Reused from the pool
+        assert ncml.open_member(members[1]) is ds
+        assert ncml_dataset.open() is not ds
+        assert [c.args[0] for c in open_dataset.call_args_list] == [members[1], members[0]]
+    ncml._open_members.clear()
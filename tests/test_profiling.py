@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import pstats
+from unittest.mock import patch
+
+import pytest
+
+from mapgen.modules import metrics
+from mapgen.modules import profiling
+
+
+@pytest.fixture(autouse=True)
+def clean_labels():
+    metrics.set_labels(product='', request='')
+    yield
+    metrics.set_labels(product='', request='')
+
+
+def _environ(**headers):
+    environ = {'PATH_INFO': '/api/get_quicklook/data/file.nc', 'QUERY_STRING': 'SERVICE=WMS&REQUEST=GetCapabilities'}
+    environ.update(headers)
+    return environ
+
+
+def test_profile_request_disabled():
+    assert profiling.profile_request(_environ(HTTP_X_MAPGEN_PROFILE='1.abc'), one_in=0, secret='') is None
+
+
+def test_profile_request_signed_header():
+    environ = _environ()
+    header = profiling.sign('secret', environ['PATH_INFO'], environ['QUERY_STRING'], time.time() + 60)
+    profile_id = profiling.profile_request(_environ(HTTP_X_MAPGEN_PROFILE=header, HTTP_X_REQUEST_ID='req-1'),
+                                           one_in=0, secret='secret')
+    assert profile_id == 'req-1'
+    # Other secret, other query or expired
+    assert profiling.profile_request(_environ(HTTP_X_MAPGEN_PROFILE=header), one_in=0, secret='other') is None
+    assert profiling.profile_request(_environ(HTTP_X_MAPGEN_PROFILE=header, QUERY_STRING='REQUEST=GetMap'),
+                                     one_in=0, secret='secret') is None
+    expired = profiling.sign('secret', environ['PATH_INFO'], environ['QUERY_STRING'], time.time() - 1)
+    assert profiling.profile_request(_environ(HTTP_X_MAPGEN_PROFILE=expired), one_in=0, secret='secret') is None
+
+
+def test_profile_request_sampling():
+    assert profiling.profile_request(_environ(HTTP_X_REQUEST_ID='../../x'), one_in=1, secret='') not in (None, '../../x')
+    with patch('mapgen.modules.profiling.random.randrange', return_value=3):
+        assert profiling.profile_request(_environ(), one_in=10, secret='') is None
+
+
+def test_profile_disabled_writes_nothing(tmp_path):
+    with profiling.profile(None, '/file.nc', '', directory=str(tmp_path)):
+        pass
+    assert os.listdir(tmp_path) == []
+
+
+def test_profile_writes_pstats(tmp_path):
+    with profiling.profile('abc', '/file.nc', 'REQUEST=GetMap', directory=str(tmp_path), profiler='cprofile'):
+        metrics.set_labels(product='^(.*arome.*)$', request='getmap')
+        sum(range(1000))
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2
+    base = files[0][:-len('.json')]
+    assert base.startswith('getmap-') and base.endswith('-abc')
+    with open(tmp_path / files[0]) as f:
+        description = json.load(f)
+    assert description['product'] == '^(.*arome.*)$'
+    assert description['query_string'] == 'REQUEST=GetMap'
+    assert pstats.Stats(str(tmp_path / description['profile'])).total_calls > 0
+
+
+def test_profile_keeps_newest(tmp_path):
+    for i in range(4):
+        with profiling.profile(f'id{i}', '/file.nc', '', directory=str(tmp_path), profiler='cprofile', keep=2):
+            pass
+        os.utime(tmp_path / f'unknown-noproduct-id{i}.json', (i, i))
+    assert sorted(os.listdir(tmp_path)) == ['unknown-noproduct-id2.json', 'unknown-noproduct-id2.prof',
+                                            'unknown-noproduct-id3.json', 'unknown-noproduct-id3.prof']
@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import logging
+
+import pytest
+
+from mapgen.modules import request_log
+from mapgen.modules.profiling import sign
+
+
+@pytest.fixture(autouse=True)
+def clean_outcomes():
+    request_log._outcomes.clear()
+    request_log.set_request_id(None)
+    yield
+    request_log._outcomes.clear()
+    request_log.set_request_id(None)
+
+
+def test_request_id_in_log_records():
+    record = logging.LogRecord('mapgen', logging.INFO, __file__, 1, 'message', None, None)
+    request_log.set_request_id('abc')
+    assert request_log.RequestIdFilter().filter(record)
+    assert record.request_id == 'abc'
+    config = request_log.logging_config('WARNING')
+    assert config['root']['level'] == 'WARNING'
+    assert '%(request_id)s' in config['formatters']['KeyValueFormatter']['format']
+
+
+def test_request_level_is_restored():
+    root = logging.getLogger()
+    previous = root.level
+    with request_log.request_level('debug'):
+        assert root.level == logging.DEBUG
+    assert root.level == previous
+    with request_log.request_level(None):
+        assert root.level == previous
+
+
+def test_debug_requested():
+    environ = {'PATH_INFO': '/KSS/file.ncml', 'QUERY_STRING': 'REQUEST=GetCapabilities'}
+    header = sign('secret', environ['PATH_INFO'], environ['QUERY_STRING'], time.time() + 60)
+    assert request_log.debug_requested(dict(environ, HTTP_X_MAPGEN_DEBUG=header), secret='secret')
+    assert not request_log.debug_requested(dict(environ, HTTP_X_MAPGEN_DEBUG=header), secret='')
+    assert not request_log.debug_requested(dict(environ, HTTP_X_MAPGEN_DEBUG='1.abc'), secret='secret')
+    assert not request_log.debug_requested(environ, secret='secret')
+
+
+def test_publish_and_collect_outcomes():
+    shared_cache = {}
+    request_log.cache_outcome('mapfile', 'miss')
+    request_log.cache_outcome('mapfile', 'hit')
+    request_log.cache_outcome('ncml', 'hit')
+    request_log.publish(shared_cache)
+    assert request_log._outcomes == {}
+    assert request_log.collect(shared_cache, os.getpid()) == {'mapfile': 'hit', 'ncml': 'hit'}
+    assert shared_cache == {}
+    # Nothing published
+    request_log.publish(shared_cache)
+    assert shared_cache == {}
+    assert request_log.collect(shared_cache, os.getpid()) == {}
+
+
+def test_access_log(caplog):
+    stages = request_log.stage_seconds([('route', 'p', 'getmap', 0.25), ('ows_dispatch', 'p', 'getmap', 0.5),
+                                        ('route', 'p', 'getmap', 0.25)])
+    assert stages == {'route': 0.5, 'ows_dispatch': 0.5}
+    caplog.set_level(logging.INFO, logger='mapgen.access')
+    request_log.access('abc', 'GET', '/api/get_quicklook/file.nc', 'REQUEST=GetMap', '200 OK', 1.5, 10,
+                       stages, {'mapfile': 'hit'})
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry['request_id'] == 'abc'
+    assert entry['status'] == 200
+    assert entry['stages'] == stages
+    assert entry['caches'] == {'mapfile': 'hit'}
@@ -0,0 +1,46 @@
+"""Test resample cache"""
+import os
+import numpy as np
+from unittest.mock import patch
+from pyresample import geometry, kd_tree
+
+from mapgen.modules import resample_cache
+
+
+def _swath():
+    lons, lats = np.meshgrid(np.linspace(10, 20, 50), np.linspace(60, 70, 40))
+    swath_def = geometry.SwathDefinition(lons=lons, lats=lats)
+    return swath_def, swath_def.compute_optimal_bb_area(), lons + lats
+
+
+def test_resample_nearest_same_as_pyresample(tmp_path):
+    swath_def, optimal_bb_area, data = _swath()
+    resample_cache._neighbour_info_memory.clear()
+    expected = kd_tree.resample_nearest(swath_def, data, optimal_bb_area, radius_of_influence=10000000)
+    resampled = resample_cache.resample_nearest(swath_def, data, optimal_bb_area, 10000000, cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(resampled, expected)
+    assert len([f for f in os.listdir(tmp_path) if f.startswith('resample-lut-')]) == 1
+
+
+def test_resample_nearest_reuse_from_disk(tmp_path):
+    swath_def, optimal_bb_area, data = _swath()
+    resample_cache._neighbour_info_memory.clear()
+    expected = resample_cache.resample_nearest(swath_def, data, optimal_bb_area, 10000000, cache_dir=str(tmp_path))
+    resample_cache._neighbour_info_memory.clear()
+    with patch('mapgen.modules.resample_cache.kd_tree.get_neighbour_info') as get_neighbour_info:
+        resampled = resample_cache.resample_nearest(swath_def, data, optimal_bb_area, 10000000, cache_dir=str(tmp_path))
+        get_neighbour_info.assert_not_called()
+    np.testing.assert_array_equal(resampled, expected)
+
+
+def test_resample_nearest_invalid_table(tmp_path):
+    swath_def, optimal_bb_area, data = _swath()
+    resample_cache._neighbour_info_memory.clear()
+    resample_cache.resample_nearest(swath_def, data, optimal_bb_area, 10000000, cache_dir=str(tmp_path))
+    cache_file = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    with open(cache_file, 'wb') as f:
+        f.write(b'broken')
+    resample_cache._neighbour_info_memory.clear()
+    expected = kd_tree.resample_nearest(swath_def, data, optimal_bb_area, radius_of_influence=10000000)
+    resampled = resample_cache.resample_nearest(swath_def, data, optimal_bb_area, 10000000, cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(resampled, expected)
@@ -0,0 +1,95 @@
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from mapgen.modules import routing
+from mapgen.modules.routing import HashRing, Router
+
+
+def test_hash_ring_is_stable_and_balanced():
+    replicas = [f'fastapi-{i}.fastapi:8080' for i in range(4)]
+    ring = HashRing(replicas)
+    keys = [f'/api/get_quicklook/arome/arome_{i}.nc' for i in range(2000)]
+    first = {key: ring.preferred(key)[0] for key in keys}
+    assert first == {key: HashRing(list(reversed(replicas))).preferred(key)[0] for key in keys}
+    assert sorted(ring.preferred(keys[0])) == sorted(replicas)
+    assert min(Counter(first.values()).values()) > 2000 / 4 / 2
+    # Only the keys of the new replica move
+    grown = HashRing(replicas + ['fastapi-4.fastapi:8080'])
+    moved = [key for key in keys if grown.preferred(key)[0] != first[key]]
+    assert all(grown.preferred(key)[0] == 'fastapi-4.fastapi:8080' for key in moved)
+    assert len(moved) < 2000 / 5 * 2
+    assert HashRing([]).preferred('/a') == []
+
+
+def test_router_from_environ():
+    router = Router.from_environ({'ROUTING_REPLICAS': 'a:8080, b:8080', 'ROUTING_SELF': 'b:8080',
+                                  'ROUTING_ATTEMPTS': '3'})
+    assert router.enabled
+    assert router.ring.replicas == ['a:8080', 'b:8080']
+    assert router.attempts == 3
+    assert not Router.from_environ({}).enabled
+    # Not one of the replicas
+    assert not Router(['a:8080', 'b:8080'], 'c:8080').enabled
+
+
+def _key_for(ring, replica):
+    return next(f'/KSS/{i}.ncml' for i in range(1000) if ring.preferred(f'/KSS/{i}.ncml')[0] == replica)
+
+
+class Replica(BaseHTTPRequestHandler):
+    status = 200
+
+    def do_GET(self):
+        body = f"{self.path} {self.headers['Host']} {self.headers[routing.FORWARDED_HEADER]}".encode()
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def replica():
+    server = HTTPServer(('127.0.0.1', 0), Replica)
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_forward(replica):
+    other = f'127.0.0.1:{replica.server_port}'
+    router = Router([other, 'self:8080'], 'self:8080')
+    path = _key_for(router.ring, other)
+    environ = {'PATH_INFO': path, 'QUERY_STRING': 'SERVICE=WMS&REQUEST=GetCapabilities'}
+    assert router.forward(environ, 'example.met.no', 'https') == (
+        other, '200 OK', f'{path}?SERVICE=WMS&REQUEST=GetCapabilities example.met.no self:8080'.encode(),
+        'text/plain')
+    # Already forwarded
+    assert router.forward(dict(environ, HTTP_X_MAPGEN_FORWARDED='x'), 'example.met.no', 'https') is None
+    # This replica's own dataset
+    assert router.forward(dict(environ, PATH_INFO=_key_for(router.ring, 'self:8080')), 'h', 'http') is None
+
+
+def test_forward_falls_back(replica):
+    other = f'127.0.0.1:{replica.server_port}'
+    router = Router([other, 'self:8080'], 'self:8080')
+    environ = {'PATH_INFO': _key_for(router.ring, other)}
+    replica.status = 503
+    assert router.forward(environ, 'h', 'http') is None
+    replica.status = 404
+    assert router.forward(environ, 'h', 'http')[1] == '404 Not Found'
+    # Unreachable replicas are skipped for a while
+    replica.status = 200
+    router = Router(['127.0.0.1:1', 'self:8080'], 'self:8080', backoff=60)
+    environ = {'PATH_INFO': _key_for(router.ring, '127.0.0.1:1')}
+    assert router.forward(environ, 'h', 'http') is None
+    assert router.candidates(environ['PATH_INFO']) == []
@@ -23,3 +23,50 @@ def test_get_satpy_products_is_list():
     assert isinstance(_get_satpy_products(None,{'NA': 'overview'}, 'overview'), list)
 
     assert isinstance(_get_satpy_products('overview',{'NA': 'overview'}, 'overview'), list)
+
+def test_satpy_compute_config():
+    from mapgen.modules.satellite_satpy_quicklook import _satpy_compute_config
+    compute_config = _satpy_compute_config({})
+    assert compute_config['resampler'] == 'nearest'
+    assert compute_config['resampler_kwargs'] == {}
+    assert compute_config['dask']['scheduler'] == 'threads'
+    assert compute_config['dask']['array.chunk-size'] == 2048 * 2048 * 8
+
+    compute_config = _satpy_compute_config({'satpy_compute': {'num_workers': 8,
+                                                              'memory_limit': '2GB',
+                                                              'resampler': 'bilinear',
+                                                              'cache_dir': '/tmp/resample-cache'}})
+    assert compute_config['dask']['num_workers'] == 8
+    # 8 chunks of 1976x1976 pixels at 64 bytes each fits in 2GB
+    assert compute_config['dask']['array.chunk-size'] == 1976 * 1976 * 8
+    assert compute_config['resampler'] == 'bilinear'
+    assert compute_config['resampler_kwargs'] == {'cache_dir': '/tmp/resample-cache'}
+
+    compute_config = _satpy_compute_config({'satpy_compute': {'num_workers': 8,
+                                                              'memory_limit': 16 * 1024 * 1024,
+                                                              'resampler': 'ewa',
+                                                              'cache_dir': '/tmp/resample-cache'}})
+    # Fewer threads rather than tiny chunks
+    assert compute_config['dask']['num_workers'] == 4
+    assert compute_config['resampler_kwargs'] == {}
+    assert _satpy_compute_config({'satpy_compute': {'resampler': 'unknown'}})['resampler'] == 'nearest'
+
+@patch('mapgen.modules.satellite_satpy_quicklook._exists_on_ceph')
+@patch('mapgen.modules.satellite_satpy_quicklook.Scene')
+@patch('mapgen.modules.satellite_satpy_quicklook._upload_geotiff_to_ceph')
+def test_generate_satpy_geotiff_resampler(mock_upload, mock_scene, mock_exists_on_ceph, tmp_path):
+    from mapgen.modules.satellite_satpy_quicklook import _generate_satpy_geotiff
+    mock_exists_on_ceph.return_value = False
+    product_config = {'geotiff_tmp': str(tmp_path),
+                      'satpy_compute': {'resampler': 'bilinear', 'cache_dir': str(tmp_path)}}
+    satpy_products_to_generate = [{'satpy_product': 'test_product',
+                                   'satpy_product_filename': 'test_product.tif'}]
+    _generate_satpy_geotiff(['/path/to/netcdf'], satpy_products_to_generate,
+                            datetime.datetime(2023, 1, 1), product_config, None)
+    bb_area = mock_scene.return_value.coarsest_area.return_value.compute_optimal_bb_area.return_value
+    mock_scene.return_value.resample.assert_called_once_with(bb_area, resampler='bilinear', cache_dir=str(tmp_path))
+
+def test_satpy_compute_config_resample_cache_dir():
+    from mapgen.modules.satellite_satpy_quicklook import _satpy_compute_config
+    compute_config = _satpy_compute_config({'resample_cache_dir': '/tmp/resample-cache'})
+    assert compute_config['resampler_kwargs'] == {'cache_dir': '/tmp/resample-cache'}
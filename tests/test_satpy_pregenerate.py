@@ -0,0 +1,119 @@
+"""Test satpy pregenerate"""
+import os
+import time
+from datetime import datetime
+from unittest.mock import patch
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from mapgen.modules.satpy_pregenerate import _satpy_product_configs, _find_new_swaths, _forget_old, watch
+
+PATTERN = r'^(.*satellite-thredds/polar-swath/\d{4}/\d{2}/\d{2}/)(noaa21|noaa20|npp)-(viirs-iband)-(\d{14})-(\d{14})\.nc$'
+
+
+def _product_config(base):
+    return {'pattern': PATTERN,
+            'base_netcdf_directory': str(base),
+            'module': 'mapgen.modules.satellite_satpy_quicklook',
+            'module_function': 'generate_satpy_quicklook',
+            'geotiff_bucket': 'geotiff-products-for-senda-iband',
+            'geotiff_tmp': '/tmp',
+            'default_dataset': 'hr_overview'}
+
+
+def _make_swath(base, name, age=3600):
+    directory = os.path.join(base, 'satellite-thredds/polar-swath/2024/01/17')
+    os.makedirs(directory, exist_ok=True)
+    netcdf_path = os.path.join(directory, name)
+    open(netcdf_path, 'w').close()
+    os.utime(netcdf_path, (time.time() - age, time.time() - age))
+    return netcdf_path
+
+
+def test_satpy_product_configs():
+    regexp_config = [{'pattern': '^(.*.nc$)', 'module': 'mapgen.modules.generic_quicklook'},
+                     {'pattern': PATTERN, 'module': 'mapgen.modules.satellite_satpy_quicklook'},
+                     _product_config('/test')]
+    assert _satpy_product_configs(regexp_config) == [_product_config('/test')]
+    assert _satpy_product_configs(None) == []
+
+
+def test_find_new_swaths(tmp_path):
+    product_configs = [_product_config(tmp_path)]
+    swath = _make_swath(str(tmp_path), 'noaa20-viirs-iband-20240117144743-20240117145323.nc')
+    _make_swath(str(tmp_path), 'noaa20-viirs-mband-20240117144743-20240117145323.nc')
+    _make_swath(str(tmp_path), 'npp-viirs-iband-20240117150000-20240117150500.nc', age=0)
+    seen = {}
+    new_swaths = _find_new_swaths(product_configs, seen, now=datetime(2024, 1, 17, 16))
+    assert new_swaths == [(swath, product_configs[0])]
+    assert _find_new_swaths(product_configs, seen, now=datetime(2024, 1, 17, 16)) == []
+    # Also found from the next day directory scan
+    seen = {}
+    assert len(_find_new_swaths(product_configs, seen, now=datetime(2024, 1, 18, 1))) == 1
+    assert _find_new_swaths(product_configs, {}, now=datetime(2024, 1, 19, 1)) == []
+
+
+def test_forget_old_keys_on_first_seen(tmp_path):
+    product_configs = [_product_config(tmp_path)]
+    # Copied in with an old mtime
+    _make_swath(str(tmp_path), 'noaa20-viirs-iband-20240117144743-20240117145323.nc', age=30 * 86400)
+    seen = {}
+    assert len(_find_new_swaths(product_configs, seen, now=datetime(2024, 1, 17, 16))) == 1
+    _forget_old(seen, 3 * 86400)
+    assert _find_new_swaths(product_configs, seen, now=datetime(2024, 1, 17, 16)) == []
+
+
+def _make_todays_swaths(tmp_path, count):
+    today = datetime.utcnow()
+    directory = os.path.join(str(tmp_path), f'satellite-thredds/polar-swath/{today:%Y/%m/%d}')
+    os.makedirs(directory)
+    swaths = []
+    for start in range(count):
+        netcdf_path = os.path.join(directory, f'noaa20-viirs-iband-{today:%Y%m%d}14{start:02d}00-{today:%Y%m%d}145323.nc')
+        open(netcdf_path, 'w').close()
+        os.utime(netcdf_path, (time.time() - 3600, time.time() - 3600))
+        swaths.append(netcdf_path)
+    return swaths
+
+
+@patch('mapgen.modules.satpy_pregenerate._pregenerate')
+def test_watch_once(pregenerate, tmp_path):
+    pregenerate.return_value = True
+    product_configs = [_product_config(tmp_path)]
+    swaths = _make_todays_swaths(tmp_path, 3)
+    watch(product_configs, workers=2, once=True, executor=ThreadPoolExecutor(max_workers=2))
+    assert pregenerate.call_count == 3
+    assert sorted(c.args[0] for c in pregenerate.call_args_list) == swaths
+
+
+@patch('mapgen.modules.satpy_pregenerate._pregenerate')
+def test_watch_failed_not_resubmitted(pregenerate, tmp_path):
+    pregenerate.return_value = False
+    product_configs = [_product_config(tmp_path)]
+    swaths = _make_todays_swaths(tmp_path, 3)
+    # One worker, so the first swaths have failed while the watcher still runs
+    watch(product_configs, workers=1, once=True, executor=ThreadPoolExecutor(max_workers=1))
+    assert sorted(c.args[0] for c in pregenerate.call_args_list) == swaths
+
+
+class _BrokenExecutor:
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool('A process in the process pool was terminated abruptly'))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@patch('mapgen.modules.satpy_pregenerate.ProcessPoolExecutor')
+@patch('mapgen.modules.satpy_pregenerate._pregenerate')
+def test_watch_replaces_broken_pool(pregenerate, process_pool_executor, tmp_path):
+    pregenerate.return_value = True
+    process_pool_executor.side_effect = lambda max_workers: ThreadPoolExecutor(max_workers=max_workers)
+    product_configs = [_product_config(tmp_path)]
+    swaths = _make_todays_swaths(tmp_path, 2)
+    watch(product_configs, workers=2, once=True, executor=_BrokenExecutor())
+    assert process_pool_executor.call_count == 1
+    assert sorted(c.args[0] for c in pregenerate.call_args_list) == swaths
@@ -0,0 +1,155 @@
+from unittest.mock import MagicMock
+
+from mapgen.modules.styles import classification, lut_scale, set_lut_processing
+from mapgen.modules.styles import compile_style, compile_styles, style_template
+
+
+def _style(intervals, open_lowest=False, open_highest=False, **kwargs):
+    style_config = {'name': 'test', 'intervals': intervals,
+                    'open_lowest_interval': open_lowest, 'open_highest_interval': open_highest}
+    style_config.update(kwargs)
+    return style_config
+
+
+def _bucket_centres(scale):
+    scale_min, scale_max, buckets = scale
+    width = (scale_max - scale_min) / buckets
+    return [scale_min + (i + 0.5) * width for i in range(buckets)]
+
+
+def _classify(classes, value):
+    """Name of the first class with an expression true for value, or None."""
+    for style_class in classes:
+        if eval(style_class.expression.replace('[pixel]', repr(float(value)))):
+            return style_class.name
+    return None
+
+
+def _classify_lut(template, value):
+    """Classify like mapserver with SCALE and SCALE_BUCKETS, by the class of the bucket centre."""
+    scale_min, scale_max, buckets = template.lut_scale
+    ratio = buckets / (scale_max - scale_min)
+    index = min(max(int((value - scale_min) * ratio + 1) - 1, 0), buckets - 1)
+    return _classify(template.classes, (index + 0.5) / ratio + scale_min)
+
+
+def test_classification():
+    assert classification(_style([0, 1])) == 'expression'
+    assert classification(_style([0, 1]), {'style_classification': 'LUT'}) == 'lut'
+    # Without a style, like the colormap from the colormap attribute
+    assert classification({}, {'style_classification': 'LUT'}) == 'lut'
+    assert classification(_style([0, 1], classification='expression'), {'style_classification': 'lut'}) == 'expression'
+    assert classification(_style([0, 1], classification='unknown')) == 'expression'
+
+
+def test_lut_scale_integer_intervals():
+    assert lut_scale(_style([0, 3, 4, 5, 10])) == (-0.0625, 10.125, 163)
+    # A bucket below, one for the end point and one above
+    assert lut_scale(_style([0, 3, 4, 5, 10]), max_buckets=13) == (-1.0, 12.0, 13)
+
+
+def test_lut_scale_open_ends():
+    assert lut_scale(_style([-10, -5, 0, 5], open_lowest=True, open_highest=True), max_buckets=6) == (-15.0, 15.0, 6)
+
+
+def test_lut_scale_float_intervals():
+    assert lut_scale(_style([0.5, 1.0, 2.5]), max_buckets=10) == (0.0, 3.5, 7)
+
+
+def test_lut_scale_buckets_within_one_class():
+    intervals = [0, 0.5, 2, 3.5, 10, 25]
+    scale = lut_scale(_style(intervals, open_highest=True))
+    for centre in _bucket_centres(scale):
+        assert sum(1 for a, b in zip(intervals[:-1], intervals[1:]) if a <= centre < b) <= 1
+        assert not any(abs(centre - boundary) < 1e-9 for boundary in intervals)
+
+
+def test_lut_scale_too_many_buckets():
+    assert lut_scale(_style([0, 0.1, 100])) is None
+    assert lut_scale(_style([0, 3, 4, 5, 10]), max_buckets=12) is None
+
+
+def test_lut_same_classes_as_expressions_closed():
+    style_config = _style([0, 3, 4, 5, 10], colors=["#dd5f4d", "#b2182a", "#67001f", "#420114"],
+                          legend_digit_format='2d')
+    expression_classes = compile_style(style_config).classes
+    template = compile_style(dict(style_config, classification='lut'))
+    # Below, on and between the boundaries, the end point and above
+    for value in [-1000, -1, -0.5, 0, 0.5, 2.99, 3, 3.5, 4, 5, 9.99, 10, 11, 1000]:
+        assert _classify_lut(template, value) == _classify(expression_classes, value), value
+    assert _classify_lut(template, 10) == ' 5 - 10'
+    assert _classify_lut(template, 11) is None
+
+
+def test_lut_same_classes_as_expressions_open():
+    style_config = _style([-1.5, 0.0, 1.5], open_lowest=True, open_highest=True,
+                          colors=["#000000", "#111111", "#222222", "#333333"], legend_digit_format='4.1f')
+    expression_classes = compile_style(style_config).classes
+    template = compile_style(dict(style_config, classification='lut'))
+    for value in [-1000, -2, -1.5, -1, 0, 1, 1.5, 1.6, 2, 1000]:
+        assert _classify_lut(template, value) == _classify(expression_classes, value), value
+    assert _classify_lut(template, 1.5) == ' 0.0 -  1.5'
+    assert _classify_lut(template, 1000) == '     >  1.5'
+
+
+def test_lut_integer_end_point_bucket():
+    style_config = _style([0, 50, 100], colors=["#000000", "#ffffff"], legend_digit_format='3d', classification='lut')
+    template = compile_style(style_config)
+    assert template.classes[-1].expression == '([pixel]>=50.0 and [pixel]<100.78125)'
+    # Only the end point value in the last bucket of the last class
+    assert _classify_lut(template, 100) == ' 50 - 100'
+    assert _classify_lut(template, 101) is None
+
+
+def test_lut_scale_not_increasing():
+    assert lut_scale(_style([5, 3, 10])) is None
+    assert lut_scale(_style([5])) is None
+
+
+def test_set_lut_processing():
+    layer = MagicMock()
+    set_lut_processing(layer, (-1.0, 10.0, 11))
+    layer.setProcessingKey.assert_any_call('SCALE', '-1.0,10.0')
+    layer.setProcessingKey.assert_any_call('SCALE_BUCKETS', '11')
+
+
+def test_compile_style_closed_intervals():
+    template = compile_style(_style([0, 3, 4, 5, 10], colors=["#dd5f4d", "#b2182a", "#67001f", "#420114"],
+                                    legend_digit_format='2d'))
+    assert [c.name for c in template.classes] == [' 0 -  3', ' 3 -  4', ' 4 -  5', ' 5 - 10']
+    assert template.classes[0].expression == '([pixel]>=0.0 and [pixel]<3.0)'
+    assert template.classes[-1].expression == '([pixel]>=5.0 and [pixel]<=10.0)'
+    assert template.classes[0].rgb == (221, 95, 77)
+    assert template.classes[0].group == 'test'
+    assert template.lut_scale is None
+
+
+def test_compile_style_open_intervals_detects_digit_format():
+    style_config = _style([-1.5, 0.0, 1.5], open_lowest=True, open_highest=True,
+                          colors=["#000000", "#111111", "#222222", "#333333"])
+    template = compile_style(style_config)
+    assert [c.name for c in template.classes] == ['     < -1.5', '-1.5 -  0.0', ' 0.0 -  1.5', '     >  1.5']
+    assert [c.expression for c in template.classes] == ['([pixel]<-1.5)',
+                                                        '([pixel]>=-1.5 and [pixel]<0.0)',
+                                                        '([pixel]>=0.0 and [pixel]<=1.5)',
+                                                        '([pixel]>1.5)']
+    assert [c.rgb for c in template.classes] == [(0, 0, 0), (17, 17, 17), (34, 34, 34), (51, 51, 51)]
+    assert 'legend_digit_format' not in style_config
+
+
+def test_compile_style_single_interval():
+    template = compile_style(_style([10], open_highest=True, colors=["#ffffff"], legend_digit_format='d'))
+    assert [(c.name, c.expression) for c in template.classes] == [('   >= 10', '([pixel]>=10.0)')]
+
+
+def test_compile_styles_at_config_read():
+    style_config = _style([0, 1, 2], colors=["#000000", "#ffffff"], legend_digit_format='d')
+    regexp_config = [{'pattern': 'a', 'styles': [style_config], 'style_classification': 'lut'},
+                     {'pattern': 'b'}]
+    compile_styles(regexp_config)
+    template = regexp_config[0]['style_templates']['test']
+    assert template.lut_scale == lut_scale(style_config)
+    assert template.classes[-1].expression == '([pixel]>=1.0 and [pixel]<2.015625)'
+    assert 'style_templates' not in regexp_config[1]
+    assert style_template(style_config, regexp_config[0]) is template
+    assert style_template(style_config).lut_scale is None
@@ -0,0 +1,45 @@
+import os
+import re
+
+import yaml
+import xarray as xr
+
+from mapgen.modules.ncml import ncml_aggregation
+from tests.synthetic_corpus import write_corpus, CONFIG_FILENAME
+
+
+def test_write_corpus(tmp_path):
+    written = write_corpus(str(tmp_path), arome_grid=(12, 10), arome_times=2,
+                           meps_grid=(8, 9), meps_times=2, meps_pressure=3, meps_members=2,
+                           kss_grid=(6, 7), kss_years=2, kss_days=4, swath_size=(5, 11))
+    assert len(written) == 5
+    with open(os.path.join(tmp_path, CONFIG_FILENAME)) as f:
+        config = yaml.safe_load(f)
+    assert len(config) == 4
+    files = [os.path.relpath(path, tmp_path) for path in written[:-1]]
+    for entry, file_name in zip(config, files):
+        assert entry['base_netcdf_directory'] == str(tmp_path)
+        assert re.match(entry['pattern'], file_name)
+    assert config[3]['resample_to_grid'] is True
+
+    with xr.open_dataset(written[0]) as ds:
+        assert ds['air_temperature_2m'].dims == ('time', 'height1', 'y', 'x')
+        assert ds['air_temperature_2m'].shape == (2, 1, 10, 12)
+        assert ds['projection_lambert'].attrs['grid_mapping_name'] == 'lambert_conformal_conic'
+    with xr.open_dataset(written[1]) as ds:
+        assert ds['x_wind_pl'].dims == ('time', 'pressure', 'ensemble_member', 'y', 'x')
+        assert ds['x_wind_pl'].shape == (2, 3, 2, 9, 8)
+    with xr.open_dataset(written[3]) as ds:
+        assert 'grid_mapping' not in ds['wind_speed'].attrs
+        assert ds['latitude'].shape == (11, 5)
+
+
+def test_kss_ncml(tmp_path):
+    written = write_corpus(str(tmp_path), datasets=('kss',), kss_grid=(6, 7), kss_years=3, kss_days=5)
+    assert written[0].endswith('.ncml')
+    aggregation = ncml_aggregation(written[0], {})
+    assert len(aggregation.members) == 3
+    assert aggregation.times.size == 15
+    assert str(aggregation.times[5]) == '2072-01-01T12:00:00.000000000'
+    with xr.open_dataset(aggregation.members[0]) as ds:
+        assert ds['tas'].attrs['grid_mapping'] == 'projection_utm'
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from mapgen.modules.time_axis import analyse_time_axis, time_axis, format_times
+
+
+def _seconds(times):
+    return pd.to_datetime(times).to_numpy().astype('datetime64[s]').astype(np.int64)
+
+
+def test_analyse_time_axis_regular_hourly():
+    axis = analyse_time_axis(_seconds(['2024-11-11T06:00:00', '2024-11-11T07:00:00']))
+    assert axis['is_range']
+    assert f"{axis['start_time']}/{axis['end_time']}/{axis['diff_string']}" == \
+        "2024-11-11T06:00:00Z/2024-11-11T07:00:00Z/PT1H"
+
+
+def test_analyse_time_axis_regular_across_new_year():
+    axis = analyse_time_axis(_seconds(pd.date_range('2023-12-31T22:00', periods=5, freq='h')))
+    assert axis['is_range']
+    assert axis['diff_string'] == 'PT1H'
+
+
+def test_analyse_time_axis_monthly():
+    axis = analyse_time_axis(_seconds(pd.date_range('2023-01-01', periods=14, freq='MS')))
+    assert axis['is_range']
+    assert axis['diff_string'] == 'P1M'
+    assert axis['end_time'] == '2024-02-01T00:00:00Z'
+
+
+def test_analyse_time_axis_yearly():
+    axis = analyse_time_axis(_seconds(pd.date_range('2000-01-01', periods=5, freq='2YS')))
+    assert axis['is_range']
+    assert axis['diff_string'] == 'P2Y'
+
+
+def test_analyse_time_axis_daily_many_steps():
+    axis = analyse_time_axis(_seconds(pd.date_range('1950-01-01', periods=40000, freq='D')))
+    assert axis['is_range']
+    assert axis['diff_string'] == 'P1D'
+
+
+def test_analyse_time_axis_irregular_is_list():
+    axis = analyse_time_axis(_seconds(['2024-01-01T00:00', '2024-01-01T01:00', '2024-01-01T03:00']))
+    assert not axis['is_range']
+    assert axis['time_list'] == ['2024-01-01T00:00:00Z', '2024-01-01T01:00:00Z', '2024-01-01T03:00:00Z']
+    assert axis['start_time'] == '2024-01-01T00:00:00Z'
+
+
+def test_analyse_time_axis_single_step_is_list():
+    axis = analyse_time_axis(_seconds(['2024-01-01T12:00']))
+    assert not axis['is_range']
+    assert axis['time_list'] == ['2024-01-01T12:00:00Z']
+
+
+def test_format_times():
+    assert format_times(_seconds(['1970-01-01T00:00:00', '2024-02-29T23:59:59'])) == ['1970-01-01T00:00:00Z',
+                                                                           '2024-02-29T23:59:59Z']
+
+
+def test_time_axis_cached_per_file(tmp_path):
+    netcdf_file = tmp_path / 'test.nc'
+    netcdf_file.write_text('')
+    ds = xr.Dataset(coords={'time': pd.date_range('2024-01-01', periods=3, freq='h')})
+    shared_cache = {}
+    axis = time_axis(ds, 'time', shared_cache, str(netcdf_file))
+    assert axis['diff_string'] == 'PT1H'
+    other_ds = xr.Dataset(coords={'time': pd.date_range('2024-01-01', periods=3, freq='D')})
+    assert time_axis(other_ds, 'time', shared_cache, str(netcdf_file)) == axis
+    assert time_axis(other_ds, 'time')['diff_string'] == 'P1D'
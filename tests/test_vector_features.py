@@ -0,0 +1,78 @@
+import numpy as np
+
+from mapgen.modules.vector_features import barb_symbols, decimate, point_features, bbox_in_grid_crs, FEATURE_ITEMS
+
+
+def _speed(knots):
+    return np.asarray(knots, dtype=np.float64) / 1.94384449
+
+
+def test_barb_symbols_ranges():
+    barb, flags, drawable = barb_symbols(_speed([0, 2.9, 3, 7.9, 8, 47.9, 48, 52.9, 53, 97.9, 98, 102.9, 103, 200]))
+    assert barb.tolist()[:12] == ['wind_barb_0', 'wind_barb_0', 'wind_barb_5', 'wind_barb_5', 'wind_barb_10',
+                                  'wind_barb_45', 'wind_barb_50', 'wind_barb_50', 'wind_barb_55', 'wind_barb_95',
+                                  'wind_barb_100', 'wind_barb_100']
+    assert flags.tolist()[:12] == ['calm', 'calm', '0', '0', '0', '0', '1', '1', '1', '1', '2', '2']
+    assert drawable.tolist() == [True] * 12 + [False, False]
+
+
+def test_barb_symbols_nan_not_drawable():
+    _, _, drawable = barb_symbols([np.nan, 1.0])
+    assert drawable.tolist() == [False, True]
+
+
+def test_decimate_without_image_size():
+    y_index, x_index = decimate(np.arange(10), np.arange(5), spacing=3)
+    assert x_index.tolist() == [0, 3, 6, 9]
+    assert y_index.tolist() == [0, 3]
+
+
+def test_decimate_bbox_and_image_size():
+    x = np.arange(100, dtype=np.float64)
+    y = np.arange(100, dtype=np.float64)[::-1]
+    y_index, x_index = decimate(x, y, bbox=(10, 20, 49, 59), width=120, height=60, spacing=12)
+    # 40 grid points in each direction, 10 points across and 5 points down wanted
+    assert x[x_index].tolist() == [10, 14, 18, 22, 26, 30, 34, 38, 42, 46]
+    assert y[y_index].tolist() == [59, 51, 43, 35, 27]
+
+
+def test_decimate_bbox_outside_grid():
+    y_index, x_index = decimate(np.arange(10), np.arange(10), bbox=(20, 20, 30, 30), width=100, height=100)
+    assert x_index.size == 0
+    assert y_index.size == 0
+
+
+def test_point_features():
+    x = np.array([0., 1., 2.])
+    y = np.array([10., 20.])
+    u = np.array([[1., 0., np.nan],
+                  [-10., 0., 100.]])
+    v = np.array([[0., 5., 1.],
+                  [0., 0., 0.]])
+    features = point_features(x, y, u, v, np.arange(2), np.arange(3))
+    assert sorted(features) == sorted(['x', 'y'] + FEATURE_ITEMS)
+    # nan and too strong wind are left out
+    assert features['x'].tolist() == [0., 1., 0., 1.]
+    assert features['y'].tolist() == [10., 10., 20., 20.]
+    np.testing.assert_allclose(features['uv_length'], [1., 5., 10., 0.])
+    np.testing.assert_allclose(features['uv_angle'], [0., 90., 180., 0.])
+    assert features['barb'].tolist() == ['wind_barb_0', 'wind_barb_10', 'wind_barb_20', 'wind_barb_0']
+    assert features['flags'].tolist() == ['calm', '0', '0', 'calm']
+
+
+def test_bbox_in_grid_crs_identity():
+    bbox = bbox_in_grid_crs((0, 0, 10, 20), 'EPSG:32633', '+proj=utm +zone=33 +datum=WGS84 +units=m +no_defs')
+    np.testing.assert_allclose(bbox, (0, 0, 10, 20), atol=1e-6)
+
+
+def test_bbox_in_grid_crs_axis_order():
+    grid_proj = '+proj=longlat +datum=WGS84 +no_defs'
+    # WMS 1.3.0 EPSG:4326 is lat/lon
+    bbox = bbox_in_grid_crs((60, 5, 70, 15), 'EPSG:4326', grid_proj, always_xy=False)
+    np.testing.assert_allclose(bbox, (5, 60, 15, 70), atol=1e-6)
+    bbox = bbox_in_grid_crs((5, 60, 15, 70), 'EPSG:4326', grid_proj, always_xy=True)
+    np.testing.assert_allclose(bbox, (5, 60, 15, 70), atol=1e-6)
+
+
+def test_bbox_in_grid_crs_invalid():
+    assert bbox_in_grid_crs((0, 0, 1, 1), 'EPSG:not-a-code', '+proj=longlat +datum=WGS84') is None
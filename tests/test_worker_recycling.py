@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+
+from mapgen.modules import worker_recycling
+from mapgen.modules.worker_recycling import MemoryWatch, Supervisor, WorkerMonitor, parse_size
+
+
+def test_parse_size():
+    assert parse_size('512M') == 512 << 20
+    assert parse_size('1.5g') == 3 << 29
+    assert parse_size('2GB') == 2 << 30
+    assert parse_size('1048576') == 1 << 20
+    assert parse_size('') is None
+    assert parse_size(None) is None
+
+
+def test_rss_bytes():
+    assert worker_recycling.rss_bytes() > 0
+    assert worker_recycling.rss_bytes(os.getpid()) > 0
+
+
+def test_max_rss():
+    watch = MemoryWatch(max_rss=1000, warmup_requests=5)
+    watch.observe(1, 900)
+    assert watch.reason() is None
+    # Also during warm up
+    watch.observe(2, 1100)
+    assert 'above 1000' in watch.reason()
+
+
+def test_growth_since_warm_up():
+    watch = MemoryWatch(max_growth=100, warmup_requests=2)
+    # Growth during warm up is not counted
+    watch.observe(1, 1000)
+    watch.observe(2, 5000)
+    watch.observe(3, 5100)
+    assert watch.reason() is None
+    watch.observe(4, 5101)
+    assert 'grew 101 bytes' in watch.reason()
+
+
+def test_leak_rate():
+    watch = MemoryWatch(max_leak_rate=10, warmup_requests=0, window=4)
+    for requests, rss in enumerate([1000, 1020, 1000, 1020]):
+        watch.observe(requests, rss)
+    assert watch.leak_rate() == 4
+    assert watch.reason() is None
+    for requests in range(4, 8):
+        watch.observe(requests, 1000 + 20 * requests)
+    assert watch.leak_rate() == 20
+    assert 'per request' in watch.reason()
+
+
+def test_from_environ():
+    watch = MemoryWatch.from_environ({'WORKER_MAX_RSS': '2G', 'WORKER_LEAK_WINDOW': '5'})
+    assert watch.max_rss == 2 << 30
+    assert watch.max_growth == 512 << 20
+    assert watch.max_leak_rate is None
+    assert watch.samples.maxlen == 5
+    supervisor = Supervisor.from_environ(print, (), {'WORKERS': '3', 'WORKER_DRAIN_TIMEOUT': '7'})
+    assert supervisor.number_of_workers == 3
+    assert supervisor.drain_timeout == 7
+
+
+class FakeServer:
+
+    def __init__(self):
+        self.stopped = threading.Event()
+
+    def shutdown(self):
+        self.stopped.set()
+
+
+def test_worker_monitor():
+    server = FakeServer()
+    recycle = threading.Event()
+    drain = threading.Event()
+    monitor = WorkerMonitor(server, MemoryWatch(max_rss=1, warmup_requests=0), lambda: 1, recycle, drain,
+                            poll_interval=0.01)
+    monitor.start()
+    assert recycle.wait(5)
+    assert not server.stopped.is_set()
+    drain.set()
+    assert server.stopped.wait(5)
+    monitor.join()
+
+
+def _worker(ready, recycle, drain):
+    ready.set()
+    drain.wait(30)
+
+
+def _poll_until(supervisor, condition):
+    for _ in range(500):
+        supervisor.poll()
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_supervisor_recycles_after_the_replacement_is_ready():
+    supervisor = Supervisor(_worker, workers=1, drain_timeout=5, poll_interval=0.01)
+    try:
+        supervisor.poll()
+        old = supervisor.workers[0]
+        assert old.ready.wait(5)
+        old.recycle.set()
+        supervisor.poll()
+        assert old.replacement is not None
+        assert _poll_until(supervisor, lambda: old not in supervisor.workers)
+        assert old.drain.is_set()
+        assert supervisor.workers == [old.replacement]
+        assert old.replacement.process.is_alive()
+    finally:
+        supervisor.stop()
+    assert not old.replacement.process.is_alive()
+
+
+def test_supervisor_replaces_dead_workers():
+    supervisor = Supervisor(_worker, workers=2, drain_timeout=5, poll_interval=0.01)
+    try:
+        supervisor.poll()
+        dead = supervisor.workers[0]
+        dead.process.terminate()
+        dead.process.join()
+        supervisor.poll()
+        assert dead not in supervisor.workers
+        assert len(supervisor.workers) == 2
+    finally:
+        supervisor.stop()
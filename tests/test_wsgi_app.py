@@ -11,6 +11,7 @@ from mapgen.main import app
 from unittest.mock import patch, MagicMock
 from mapgen.modules.helpers import _parse_request, HTTPError
 from mapgen.modules.get_quicklook import get_quicklook
+from mapgen.modules import admission
 from mapgen.modules.satellite_satpy_quicklook import _upload_geotiff_to_ceph, _exists_on_ceph, _generate_satpy_geotiff
 
 def test_no_path():
@@ -52,6 +53,23 @@ def test_favicon():
     print(res.body)
     assert res.status == '200 OK'
 
+def test_metrics():
+    test_app = TestApp(app)
+
+    res = test_app.get('/metrics')
+    assert res.status == '200 OK'
+    assert res.content_type == 'text/plain'
+    assert b'# TYPE mapgen_stage_duration_seconds histogram' in res.body
+
+def test_overloaded():
+    test_app = TestApp(app)
+
+    with patch('mapgen.main.admission.controller') as controller:
+        controller.admit.side_effect = admission.Overloaded('getmap', 'queue is full', 5)
+        res = test_app.get('/api/get_quicklook/some/file.nc?SERVICE=WMS&REQUEST=GetMap', status='*')
+    assert res.status == '503 Service Unavailable'
+    assert res.headers['Retry-After'] == '5'
+
 def test_get_quicklook():
     test_app = TestApp(app)
 